@@ -1,242 +1,881 @@
+import asyncio
+import multiprocessing
+import signal
 import socket
 import struct
+import sys
 import threading
-import traceback
+import time
 import uuid
+from collections import OrderedDict, Counter
 from datetime import datetime, timedelta
 from typing import cast
 
-from common.cryptography_utils import sha256_hash, generate_aes_key, encrypt_aes_cbc
-from common.date_utils import get_date_string, get_timestamp_string, datetime_to_timestamp_bytes
+from Crypto.Random import get_random_bytes
+
+from common.cryptography_utils import sha256_hash, generate_aes_key, encrypt_aes_cbc_fields, encrypt_aes_cbc_batch
+from common.date_utils import get_date_string, datetime_to_timestamp_bytes
+from common.framing_utils import read_client_request, read_client_request_async
+from common.logging_utils import get_logger, get_hot_path_logger
+from common.metrics import ServerMetrics
 from common.network_utils import is_valid_port
-from common.file_utils import read_file_lines, write_line_to_file, write_lines_to_file, is_file_exists
+from common.file_utils import read_file_lines, write_lines_to_file, is_file_exists
 from common.protocol.client_request import ClientRequest
 from common.protocol.encrypted_session_key import EncryptedSessionKey
 from common.protocol.message_codes import CLIENT_REGISTRATION_CODE, CLIENT_REGISTRATION_SUCCESS_CODE, \
     CLIENT_REGISTRATION_FAIL_CODE, SERVER_REGISTRATION_CODE, SERVER_REGISTRATION_SUCCESS_CODE, \
     GENERAL_SERVER_ERROR_CODE, SERVER_LIST_REQUEST_CODE, MESSAGE_SERVER_LIST_RESPONSE_CODE, \
-    SESSION_KEY_AND_TICKET_REQUEST_CODE, SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE
+    SESSION_KEY_AND_TICKET_REQUEST_CODE, SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, SERVER_LIST_PAGE_REQUEST_CODE, \
+    BINARY_SERVER_LIST_REQUEST_CODE, MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE, BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE, \
+    BATCH_SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE, \
+    RATE_LIMITED_RESPONSE_CODE, SERVER_BUSY_RESPONSE_CODE
 from common.protocol.request_1024_user_registration import UserRegistrationRequest
 from common.protocol.request_1025_server_registration import ServerRegistrationRequest
 from common.protocol.request_1027_session_key import SessionKeyAndTicketRequest
+from common.protocol.request_1030_server_list_page import ServerListPageRequest
+from common.protocol.request_1032_batch_session_key import BatchSessionKeyAndTicketRequest
+from common.protocol.request_1033_multi_server_session_key import MultiServerSessionKeyAndTicketRequest
 from common.protocol.response_1600_user_registration_success import UserRegistrationSuccessResponse
 from common.protocol.response_1603_key_and_token_success_response import KeyAndTokenResponse
 from common.protocol.response_1608_message_server_registration_success import MessageServerRegistrationSuccessResponse
+from common.protocol.response_1610_message_server_list import MessageServerListResponse
+from common.protocol.response_1611_batch_key_and_token import BatchKeyAndTokenResponse
 from common.protocol.server_response import ServerResponse
-from common.protocol.ticket import Ticket
+from common.protocol.ticket import Ticket, TICKET_LIFETIME_MINUTES
+from common.request_dispatcher import RequestDispatcher, DispatchedRequest
 from .client import Client
 from .message_server import MessageServer
+from .rate_limiter import TokenBucketLimiter, InFlightLimiter
+from .record_store import RecordStore, LazyRecordMapping
+from .registration_channel import RegistrationProxy, RegistrationService
+from .registration_writer import RegistrationWriter, FSYNC_BATCH
+from .store_converter import convert_text_file
 
 SERVERS = 'servers'
 CLIENTS = 'clients'
+SERVERS_STORE = 'servers.db'
+CLIENTS_STORE = 'clients.db'
 VERSION = 24
-SESSION_KEY_LIFETIMEMINUTES = 5
+THREADED_MODE = 'threaded'
+ASYNC_MODE = 'async'
+SERVER_MODES = (THREADED_MODE, ASYNC_MODE)
+DEFAULT_MAX_CONNECTIONS = 1000
+# connections with no request for this long are closed
+CONNECTION_IDLE_TIMEOUT_SECONDS = 30
+# requests that wait for the registration writer, so async mode runs them off the event loop
+REGISTRATION_REQUEST_CODES = (CLIENT_REGISTRATION_CODE, SERVER_REGISTRATION_CODE)
+MAX_SERVER_LIST_PAGE_SIZE = 1000
+# max number of distinct server list pages kept in the cache
+MAX_CACHED_SERVER_LIST_PAGES = 1024
+MAX_TICKET_BATCH_SIZE = 10000
+# requests for tickets, which are rate limited per client id the tickets are issued to
+TICKET_REQUEST_CODES = (SESSION_KEY_AND_TICKET_REQUEST_CODE, BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE,
+                        MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE)
+
+logger = get_logger('auth_server')
+# per-connection logs, which may be sampled or turned off
+request_logger = get_hot_path_logger('auth_server')
+
 
 class AuthServer:
-    def __init__(self, server_port_file):
+    def __init__(self, server_port_file, mode=None, max_connections=None, fsync_policy=FSYNC_BATCH, workers=1,
+                 metrics_port=None, client_rate_limit=None, ip_rate_limit=None, max_in_flight_requests=None):
         """
         Initializes an auth server.
+        The port file holds the port to listen on in its 1st line, and optionally the server mode
+        ('threaded' or 'async') in its 2nd line.
         :param server_port_file: The address of a file with the port to listen on.
+        :param mode: 'threaded' spawns a thread per connection, 'async' serves all connections on one event loop.
+        Overrides the mode in the port file.
+        :param max_connections: max number of requests processed concurrently in async mode. Idle keep-alive
+        connections don't hold a slot.
+        :param fsync_policy: 'batch' acknowledges registrations only after they were fsynced to disk,
+        'none' acknowledges them once written to the OS
+        :param workers: number of worker processes serving the port with SO_REUSEPORT. With more than one, the
+        workers read the clients and message servers from the memory mapped stores, and forward registrations to
+        the parent process, which checks and writes them all.
+        :param metrics_port: local HTTP port the Prometheus metrics are served on, None to not serve them.
+        Worker n serves its own metrics on metrics_port + n + 1.
+        :param client_rate_limit: (tickets per second, burst) issued to each client id, None for no limit. Batch
+        requests count every ticket they ask for, and a batch with more tickets for a client than the burst is never
+        issued. Requests over the limit are answered with RATE_LIMITED_RESPONSE_CODE.
+        :param ip_rate_limit: (requests per second, burst) of all the requests of each ip address, None for no limit
+        :param max_in_flight_requests: max number of requests processed at once, None for no limit. Requests over it
+        are answered with SERVER_BUSY_RESPONSE_CODE right away instead of waiting. In async mode requests are processed
+        one at a time on the event loop, so the cap only counts the registrations run off the loop - there, it also
+        answers the requests that find all max_connections slots taken with SERVER_BUSY_RESPONSE_CODE, instead of
+        queueing them.
+        The limits are kept per process, so with several workers each of them enforces them on its own connections.
+        Registrations the workers forward to the parent process are not limited again there.
         """
         lines = read_file_lines(server_port_file)
         port = lines[0]
-        if is_valid_port(port):
-            print("port must be a number between 1024 and 65535. Using default port 1256!")
-        else:
+        if not is_valid_port(port):
+            logger.warning("port must be a number between 1024 and 65535. Using default port 1256!")
             port = 1256
         self.port = int(port)
         self.host = '127.0.0.1'
         self.clients = dict()
         self.message_servers = dict()
+        # name -> id string indexes of the clients and message_servers dicts, for O(1) duplicate name checks
+        self.client_ids_by_name = dict()
+        self.message_server_ids_by_name = dict()
+        # the names of the clients in the clients store are indexed on the first registration, not on startup
+        self.client_names_loaded = False
+        # makes the duplicate name check and the insert of a registration atomic
+        self.registration_lock = threading.Lock()
+        # (binary, offset, limit, name filter) -> packed server list response, least recently used first. Replaced by a
+        # new dict when a message server registers, so a response built from the old servers list can't be cached
+        # after the invalidation.
+        self.server_list_cache = OrderedDict()
+        self.server_list_cache_lock = threading.Lock()
+        # set in worker processes, which forward registrations to the parent process through it
+        self.registration_proxy = None
+        # serializes picking up the records other processes appended to the stores
+        self.store_refresh_lock = threading.Lock()
+
+        if mode is None:
+            mode = lines[1] if len(lines) > 1 else THREADED_MODE
+        if mode not in SERVER_MODES:
+            raise ValueError(f'Unknown server mode {mode}!')
+        self.mode = mode
+        self.max_connections = max_connections if max_connections is not None else DEFAULT_MAX_CONNECTIONS
+        self.registration_writer = RegistrationWriter(fsync_policy)
+        if workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("Multiple workers require SO_REUSEPORT support!")
+        self.workers = workers
+        self.metrics_port = metrics_port
+        self.metrics = ServerMetrics('auth_server')
+        self.metrics.registry.gauge_function('auth_server_clients', lambda: len(self.clients), 'Registered clients')
+        self.metrics.registry.gauge_function('auth_server_message_servers', lambda: len(self.message_servers),
+                                             'Registered message servers')
+        self.metrics.registry.gauge_function('auth_server_workers', lambda: self.workers, 'Worker processes')
+        self.client_rate_limiter = TokenBucketLimiter(*client_rate_limit) if client_rate_limit is not None else None
+        self.ip_rate_limiter = TokenBucketLimiter(*ip_rate_limit) if ip_rate_limit is not None else None
+        self.in_flight_limiter = InFlightLimiter(max_in_flight_requests) \
+            if max_in_flight_requests is not None else None
+        # the rejections are the same for every request, so they are packed once
+        self.rate_limited_response = ServerResponse(VERSION, RATE_LIMITED_RESPONSE_CODE, None).pack()
+        self.server_busy_response = ServerResponse(VERSION, SERVER_BUSY_RESPONSE_CODE, None).pack()
+        if self.client_rate_limiter is not None:
+            self.metrics.registry.gauge_function('auth_server_rate_limited_clients',
+                                                 lambda: len(self.client_rate_limiter),
+                                                 'Client ids tracked by the rate limiter')
+        if self.ip_rate_limiter is not None:
+            self.metrics.registry.gauge_function('auth_server_rate_limited_ips', lambda: len(self.ip_rate_limiter),
+                                                 'Ip addresses tracked by the rate limiter')
+        if self.in_flight_limiter is not None:
+            self.metrics.registry.gauge_function('auth_server_in_flight_requests',
+                                                 lambda: self.in_flight_limiter.in_flight,
+                                                 'Requests being processed')
+        self.dispatcher = self.create_dispatcher()
 
         self.start_server()
 
+    def create_dispatcher(self):
+        """
+        :return: the RequestDispatcher with the handler and payload type of every request code
+        """
+        dispatcher = RequestDispatcher(self.reject_request)
+        dispatcher.route(CLIENT_REGISTRATION_CODE, self.process_user_registration, UserRegistrationRequest)
+        dispatcher.route(SERVER_REGISTRATION_CODE, self.process_server_registration, ServerRegistrationRequest)
+        dispatcher.route(SERVER_LIST_REQUEST_CODE, self.process_server_list_request)
+        dispatcher.route(SERVER_LIST_PAGE_REQUEST_CODE, self.process_server_list_page_request, ServerListPageRequest)
+        dispatcher.route(BINARY_SERVER_LIST_REQUEST_CODE, self.process_binary_server_list_request,
+                         ServerListPageRequest, payload_optional=True)
+        dispatcher.route(SESSION_KEY_AND_TICKET_REQUEST_CODE, self.process_session_key_and_ticket_request,
+                         SessionKeyAndTicketRequest)
+        dispatcher.route(BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE, self.process_batch_session_key_and_ticket_request,
+                         BatchSessionKeyAndTicketRequest)
+        dispatcher.route(MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE,
+                         self.process_multi_server_session_key_and_ticket_request,
+                         MultiServerSessionKeyAndTicketRequest)
+        return dispatcher
+
+    def add_admission_control(self):
+        """
+        Adds the rate limiting and in-flight middleware to the dispatcher, in the processes that accept connections.
+        The cheapest checks run first, so a flood is rejected before it costs anything. The parent process of the
+        workers only serves the registrations they forward, which the workers already admitted, so it does not
+        limit them a second time.
+        """
+        if self.ip_rate_limiter is not None:
+            self.dispatcher.add_middleware(self.limit_ip_rate)
+        if self.client_rate_limiter is not None:
+            self.dispatcher.add_middleware(self.limit_client_rate, TICKET_REQUEST_CODES)
+        if self.in_flight_limiter is not None:
+            self.dispatcher.add_middleware(self.limit_in_flight_requests)
+
     def handle_client_request(self, client_socket, client_address):
         """
-        Gets the socket object and client address and handles the request
+        Gets the socket object and client address and serves requests on the connection until the client closes it
+        or it is idle for CONNECTION_IDLE_TIMEOUT_SECONDS.
+        Requests are handled one after the other, so a client may keep the connection open for its next requests,
+        or pipeline several requests and read the responses in the same order.
         :param client_socket:
         :param client_address:
         :return:
         """
-        print(f"Connection from {client_address}")
+        request_logger.info("Connection from %s", client_address)
+        self.metrics.connection_opened()
+        client_socket.settimeout(CONNECTION_IDLE_TIMEOUT_SECONDS)
 
-        # Receiving data in chunks
-        received_data = b''
-        while True:
-            chunk = client_socket.recv(1024)
-            received_data += chunk
-            if len(chunk) < 1024:
-                break
+        try:
+            while True:
+                received_data = read_client_request(client_socket)
+                if received_data is None:
+                    break
+                request_logger.info("Received a request from %s", client_address)
+
+                start_time = time.perf_counter()
+                request = DispatchedRequest(received_data, client_address)
+                try:
+                    response = self.dispatcher.dispatch(request)
+                except Exception:
+                    logger.exception("Error handling a request from %s", client_address)
+                    self.metrics.error('internal_error')
+                    response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None).pack()
+
+                # Send a response back to the client
+                client_socket.sendall(response)
+                self.metrics.request_handled(request.code, start_time, len(received_data), len(response))
+
+        except socket.timeout:
+            request_logger.info("Connection with %s was idle for %d seconds.", client_address,
+                                CONNECTION_IDLE_TIMEOUT_SECONDS)
+
+        except ConnectionError as e:
+            request_logger.warning("Connection with %s ended before a full request was received: %s", client_address, e)
+            self.metrics.error('incomplete_request')
+
+        except Exception:
+            # The stream can't be trusted after a framing error, so report it and drop the connection
+            logger.exception("Error reading a request from %s", client_address)
+            self.metrics.error('framing_error')
+            client_socket.sendall(ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None).pack())
 
-        print(f"Received a request from {client_address}")
+        finally:
+            request_logger.info("Connection with %s closed.", client_address)
+            self.metrics.connection_closed()
+            client_socket.close()
 
+    async def handle_client_request_async(self, reader, writer):
+        """
+        The async mode counterpart of handle_client_request. Serves the requests of the stream one after the other,
+        processing them on the event loop, until the client closes it or it is idle for
+        CONNECTION_IDLE_TIMEOUT_SECONDS. A request holds one of the max_connections slots from the time it was read
+        until its response is written, so idle keep-alive connections don't keep other clients waiting.
+        :param reader: asyncio StreamReader of the connection
+        :param writer: asyncio StreamWriter of the connection
+        :return:
+        """
+        client_address = writer.get_extra_info('peername')
+        request_logger.info("Connection from %s", client_address)
+        self.metrics.connection_opened()
         try:
-            response = self.process_request(received_data, client_socket)
-            # Send a response back to the client
-            client_socket.send(response)
-
-        except Exception as e:
-            print(f"error  {e}")
-            traceback.print_exc()
-            client_socket.send(ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None))
+            while True:
+                received_data = await asyncio.wait_for(read_client_request_async(reader),
+                                                       CONNECTION_IDLE_TIMEOUT_SECONDS)
+                if received_data is None:
+                    break
+                request_logger.info("Received a request from %s", client_address)
+
+                start_time = time.perf_counter()
+                request = DispatchedRequest(received_data, client_address)
+                if self.in_flight_limiter is not None and self.connection_semaphore.locked():
+                    # with admission control, a request that would wait for a slot is answered busy right away
+                    request_logger.info("Rejected request %d from %s: server busy", request.code, client_address)
+                    self.metrics.error('overloaded')
+                    response = self.server_busy_response
+                    writer.write(response)
+                    await writer.drain()
+                    self.metrics.request_handled(request.code, start_time, len(received_data), len(response))
+                    continue
+
+                async with self.connection_semaphore:
+                    try:
+                        if request.code in REGISTRATION_REQUEST_CODES:
+                            response = await asyncio.get_running_loop().run_in_executor(
+                                None, self.dispatcher.dispatch, request)
+                        else:
+                            response = self.dispatcher.dispatch(request)
+                    except Exception:
+                        logger.exception("Error handling a request from %s", client_address)
+                        self.metrics.error('internal_error')
+                        response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None).pack()
+                    writer.write(response)
+                    await writer.drain()
+                self.metrics.request_handled(request.code, start_time, len(received_data), len(response))
+
+        except asyncio.TimeoutError:
+            request_logger.info("Connection with %s was idle for %d seconds.", client_address,
+                                CONNECTION_IDLE_TIMEOUT_SECONDS)
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            request_logger.warning("Connection with %s ended before a full request was received", client_address)
+            self.metrics.error('incomplete_request')
+
+        except Exception:
+            logger.exception("Error reading a request from %s", client_address)
+            self.metrics.error('framing_error')
+            writer.write(ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None).pack())
+            await writer.drain()
 
         finally:
-            print(f"Connection with {client_address} closed.")
-            client_socket.close()
+            request_logger.info("Connection with %s closed.", client_address)
+            self.metrics.connection_closed()
+            writer.close()
 
     def start_server(self):
         """
-        Initializes the clients list from clients file
-        Initializes message %s list from server.csv
-        Starts listening on the port passed in initialization.
-        """
-        print(f'auth server started on port {self.port}!')
-        if is_file_exists(CLIENTS):
-            lines = read_file_lines(CLIENTS)
-            for line in lines:
-                client = Client.from_line(line)
-                self.clients[client.get_id_string()] = client
-            print(f'Loaded {len(lines)} clients from "clients" file')
-
-        if is_file_exists(SERVERS):
-            lines = read_file_lines(SERVERS)
-            for line in lines:
-                server = MessageServer.from_line(line)
-                self.message_servers[server.get_id_string()] = server
-            print(f'Loaded {len(lines)} message servers from "servers" file')
+        Initializes the clients list from the clients store
+        Initializes message servers list from the servers store
+        Starts listening on the port passed in initialization, in the configured server mode.
+        """
+        logger.info('auth server started on port %d in %s mode!', self.port, self.mode)
+        self.load_clients()
+        self.load_message_servers()
+
+        if self.workers > 1:
+            self.serve_workers()
+            return
+
+        self.registration_writer.start()
+        self.add_admission_control()
+        self.metrics.start_http_server(self.metrics_port)
+        self.serve()
+
+    def serve(self):
+        if self.mode == ASYNC_MODE:
+            asyncio.run(self.serve_async())
+        else:
+            self.serve_threaded()
+
+    def serve_workers(self):
+        """
+        Forks the worker processes, then serves the registrations they forward until they exit.
+        The workers are forked before any thread is started, and inherit the loaded stores.
+        """
+        context = multiprocessing.get_context('fork')
+        worker_processes = []
+        parent_connections = []
+        for number in range(self.workers):
+            parent_connection, worker_connection = context.Pipe()
+            worker_processes.append(context.Process(target=self.run_worker, args=(worker_connection, number),
+                                                    name=f'worker-{number}', daemon=True))
+            parent_connections.append(parent_connection)
+        for worker_process in worker_processes:
+            worker_process.start()
+
+        self.registration_writer.start()
+        RegistrationService(parent_connections, self.process_request).start()
+        self.metrics.start_http_server(self.metrics_port)
+        logger.info('Started %d workers on %s:%d', self.workers, self.host, self.port)
+
+        # set after forking, so only the parent turns SIGTERM into an exit that takes the workers down with it
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+        try:
+            for worker_process in worker_processes:
+                worker_process.join()
+        finally:
+            for worker_process in worker_processes:
+                worker_process.terminate()
+
+    def run_worker(self, connection, worker_number):
+        """
+        The worker process entry point
+        :param connection: the worker's end of the pipe to the parent process
+        :param worker_number: the number of the worker process
+        """
+        self.registration_proxy = RegistrationProxy(connection)
+        self.registration_proxy.start()
+        self.add_admission_control()
+        self.dispatcher.add_middleware(self.forward_registration, REGISTRATION_REQUEST_CODES)
+        self.metrics.start_http_server(self.metrics_port, worker_number)
+        self.serve()
+
+    def load_clients(self):
+        """
+        Opens the clients store, converting the legacy clients text file on first run.
+        Only the id of every record is read here, clients are created lazily when first accessed.
+        """
+        if not is_file_exists(CLIENTS_STORE) and is_file_exists(CLIENTS):
+            count = convert_text_file(CLIENTS, CLIENTS_STORE, Client)
+            logger.info('Converted %d clients from "%s" file to "%s"', count, CLIENTS, CLIENTS_STORE)
+
+        self.clients_store = RecordStore(CLIENTS_STORE, Client.RECORD_STRUCT)
+        index_by_id = dict()
+        for index, (client_id,) in enumerate(self.clients_store.records(Client.ID_STRUCT)):
+            index_by_id[client_id.hex()] = index
+        self.clients = LazyRecordMapping(self.clients_store, Client.from_record, index_by_id)
+        logger.info('Loaded %d clients from "%s" file', len(self.clients), CLIENTS_STORE)
+
+    def load_client_names(self):
+        """
+        Indexes the names of the clients in the clients store. Called under the registration lock.
+        """
+        if self.client_names_loaded:
+            return
+        for client_id, name in self.clients_store.records(Client.ID_AND_NAME_STRUCT):
+            self.client_ids_by_name.setdefault(name.rstrip(b'\x00').decode('utf-8'), client_id.hex())
+        self.client_names_loaded = True
 
+    def refresh_clients(self):
+        """
+        Indexes the clients appended to the clients store by the parent process since the last refresh.
+        Used by worker processes.
+        :return: the number of new clients
+        """
+        with self.store_refresh_lock:
+            start = len(self.clients_store)
+            new_records = self.clients_store.refresh()
+            for index, (client_id,) in enumerate(self.clients_store.records(Client.ID_STRUCT, start), start=start):
+                self.clients.index_by_key.setdefault(client_id.hex(), index)
+        return new_records
+
+    def find_client(self, client_id_string):
+        """
+        :return: the client with the given id, or None. Worker processes look for clients registered through
+        other workers in the store before giving up.
+        """
+        client = self.clients.get(client_id_string)
+        if client is None and self.registration_proxy is not None and self.refresh_clients() > 0:
+            client = self.clients.get(client_id_string)
+        return client
+
+    def load_message_servers(self):
+        """
+        Opens the message servers store, converting the legacy servers text file on first run.
+        """
+        if not is_file_exists(SERVERS_STORE) and is_file_exists(SERVERS):
+            count = convert_text_file(SERVERS, SERVERS_STORE, MessageServer)
+            logger.info('Converted %d message servers from "%s" file to "%s"', count, SERVERS, SERVERS_STORE)
+
+        self.servers_store = RecordStore(SERVERS_STORE, MessageServer.RECORD_STRUCT)
+        for record in self.servers_store.records():
+            self.index_message_server(MessageServer.from_record(record))
+        logger.info('Loaded %d message servers from "%s" file', len(self.message_servers), SERVERS_STORE)
+
+    def refresh_message_servers(self):
+        """
+        Indexes the message servers appended to the servers store by the parent process since the last refresh.
+        Used by worker processes.
+        :return: the number of new message servers
+        """
+        with self.store_refresh_lock:
+            start = len(self.servers_store)
+            new_records = self.servers_store.refresh()
+            for record in self.servers_store.records(start=start):
+                self.index_message_server(MessageServer.from_record(record))
+        return new_records
+
+    def find_message_server(self, message_server_id_string):
+        """
+        :return: the message server with the given id, or None. Worker processes look for message servers
+        registered through other workers in the store before giving up.
+        """
+        server = self.message_servers.get(message_server_id_string)
+        if server is None and self.registration_proxy is not None and self.refresh_message_servers() > 0:
+            server = self.message_servers.get(message_server_id_string)
+        return server
+
+    def serve_threaded(self):
+        """
+        Accepts connections forever, handling each one on a new thread.
+        """
         # Create a socket server
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.workers > 1:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_socket.bind((self.host, self.port))
         server_socket.listen()
 
-        print(f'Server listening on {self.host}:{self.port}')
+        logger.info('Server listening on %s:%d', self.host, self.port)
 
         while True:
             client_socket, client_address = server_socket.accept()
             client_handler = threading.Thread(target=self.handle_client_request, args=(client_socket, client_address))
             client_handler.start()
 
-    def process_request(self, request, client_socket):
-        request_code = self.get_request_code(request)
-        if request_code == CLIENT_REGISTRATION_CODE:
-            return self.process_user_registration(request)
-        elif request_code == SERVER_REGISTRATION_CODE:
-            client_ip, client_port = client_socket.getpeername()
-            return self.process_server_registration(request, client_ip, client_port)
-        elif request_code == SERVER_LIST_REQUEST_CODE:
-            return self.process_server_list_request(request)
-        elif request_code == SESSION_KEY_AND_TICKET_REQUEST_CODE:
-            return self.process_session_key_and_ticket_request(request)
-        else:
-            return "unknown request"
+    async def serve_async(self):
+        """
+        Accepts connections forever on a single event loop. At most max_connections requests are processed at once,
+        the rest wait for a free slot.
+        """
+        self.connection_semaphore = asyncio.Semaphore(self.max_connections)
+        server = await asyncio.start_server(self.handle_client_request_async, self.host, self.port,
+                                            reuse_port=self.workers > 1)
+
+        logger.info('Server listening on %s:%d (max %d concurrent requests)', self.host, self.port,
+                    self.max_connections)
+
+        async with server:
+            await server.serve_forever()
+
+    def process_request(self, request, client_address):
+        """
+        Dispatches a raw request to the handler of its request code
+        :param request: the raw request bytes
+        :param client_address: the (ip, port) the request was received from
+        :return: the packed response
+        """
+        return self.dispatcher.dispatch(DispatchedRequest(request, client_address))
+
+    def reject_request(self, request, reason):
+        # rejections are logged on the sampled hot path and counted in the client error metrics, so a flood of bad
+        # requests can't flood the logs
+        request_logger.info("Rejected request %d from %s: %s", request.code, request.client_address, reason)
+        self.metrics.client_error(reason)
+        return ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None).pack()
+
+    def limit_ip_rate(self, request, call_next):
+        """
+        The middleware rate limiting the requests of each ip address
+        """
+        if self.ip_rate_limiter.allow(request.client_address[0]):
+            return call_next(request)
+        request_logger.info("Rejected request %d from %s: ip rate limited", request.code, request.client_address)
+        self.metrics.error('ip_rate_limited')
+        return self.rate_limited_response
+
+    def limit_client_rate(self, request, call_next):
+        """
+        The middleware rate limiting the tickets requested for each client id - a request takes a token per ticket
+        it asks for, so a batch can't issue more tickets than single requests could. A batch request takes the
+        tokens of every client id in it, and is rejected if any of them is over its limit.
+        """
+        try:
+            requested_tickets = self.count_requested_tickets(request)
+        except (ValueError, struct.error):
+            # left to the dispatcher, which rejects the malformed payload
+            return call_next(request)
+        if all(self.client_rate_limiter.allow(client_id, count) for client_id, count in requested_tickets.items()):
+            return call_next(request)
+        request_logger.info("Rejected request %d from %s: client rate limited", request.code,
+                            request.client_address)
+        self.metrics.error('client_rate_limited')
+        return self.rate_limited_response
 
     @staticmethod
-    def get_request_code(request):
-        bytes_18_19 = request[17:19]
-        return struct.unpack('<h', bytes_18_19)[0]
+    def count_requested_tickets(request):
+        """
+        :return: client id -> number of tickets the ticket request asks for. The records of a batch request are
+        unpacked into request.payload, so the dispatcher does not unpack them again.
+        """
+        if request.code == BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE:
+            request.payload = BatchSessionKeyAndTicketRequest.unpack_from(
+                request.data, ClientRequest.HEADER_STRUCT.size, request.payload_size)
+            return Counter(client_id for client_id, _, _ in request.payload.ticket_requests)
+        if request.code == MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE:
+            _, count = MultiServerSessionKeyAndTicketRequest.HEADER_STRUCT.unpack_from(
+                request.data, ClientRequest.HEADER_STRUCT.size)
+            return {request.client_id: count}
+        return {request.client_id: 1}
+
+    def limit_in_flight_requests(self, request, call_next):
+        """
+        The middleware rejecting requests while max_in_flight_requests requests are being processed
+        """
+        if not self.in_flight_limiter.try_acquire():
+            request_logger.info("Rejected request %d from %s: server busy", request.code, request.client_address)
+            self.metrics.error('overloaded')
+            return self.server_busy_response
+        try:
+            return call_next(request)
+        finally:
+            self.in_flight_limiter.release()
+
+    def forward_registration(self, request, call_next):
+        """
+        The middleware of the registration requests in worker processes, which forwards them to the parent process
+        instead of handling them
+        """
+        return self.registration_proxy.forward(request.data, request.client_address)
 
     def process_user_registration(self, request):
         try:
-            client_request = ClientRequest.unpack(request, payload_type=UserRegistrationRequest)
-            client_payload = client_request.payload
-
-            for client_val in self.clients.values():
-                if client_val.name == client_payload.name:
-                    raise RuntimeError("User already exists!")
+            client_payload = cast(UserRegistrationRequest, request.payload)
 
             client_id = uuid.uuid4()
             password_hash = sha256_hash(client_payload.password.encode('utf-8'))
-
             client = Client(client_id.bytes, client_payload.name, password_hash)
+
+            with self.registration_lock:
+                self.load_client_names()
+                if client.name in self.client_ids_by_name:
+                    raise RuntimeError("User already exists!")
+                # reserve the name while the client is being saved
+                self.client_ids_by_name[client.name] = client.get_id_string()
             self.add_client_to_file(client)
 
             user_registration_payload = UserRegistrationSuccessResponse(client_id.bytes)
             response = ServerResponse(VERSION, CLIENT_REGISTRATION_SUCCESS_CODE, user_registration_payload)
         except RuntimeError as e:
+            self.metrics.error('client_registration_failed')
             response = ServerResponse(VERSION, CLIENT_REGISTRATION_FAIL_CODE, None)
 
         return response.pack()
 
-    def add_client_to_file(self, client: Client):
+    def index_client(self, client: Client):
         self.clients[client.get_id_string()] = client
-        client_line = f'{client.client_id.hex()}:{client.name}:{client.password_hash.hex()}:{get_timestamp_string(client.last_seen)}'
-        write_line_to_file(CLIENTS, client_line)
+        self.client_ids_by_name[client.name] = client.get_id_string()
 
-    def process_server_registration(self, request, client_ip, client_port):
+    def add_client_to_file(self, client: Client):
+        """
+        Waits for the client record to be committed by the registration writer, then adds the client.
+        If the commit fails, the name reserved for the client is released.
+        """
         try:
-            server_request = ClientRequest.unpack(request, payload_type=ServerRegistrationRequest)
-            server_registration_payload = server_request.payload
+            self.registration_writer.submit(self.clients_store, client.to_record()).result()
+        except Exception as e:
+            with self.registration_lock:
+                del self.client_ids_by_name[client.name]
+            raise RuntimeError("Could not save the client!") from e
+        self.index_client(client)
 
-            for message_server in self.message_servers.values():
-                if message_server.name == server_registration_payload.name:
-                    raise RuntimeError("Message server name already exists!")
+    def process_server_registration(self, request):
+        try:
+            server_registration_payload = cast(ServerRegistrationRequest, request.payload)
 
             server_id = uuid.uuid4()
             server_name = server_registration_payload.name
             server_key = server_registration_payload.message_server_key
-            server_ip = client_ip
+            server_ip = request.client_address[0]
             server_port = server_registration_payload.port
 
             message_server = MessageServer(server_id.bytes, server_name, server_key, server_ip, server_port)
+            with self.registration_lock:
+                if message_server.name in self.message_server_ids_by_name:
+                    raise RuntimeError("Message server name already exists!")
+                # reserve the name while the message server is being saved
+                self.message_server_ids_by_name[message_server.name] = message_server.get_id_string()
             self.add_message_server_to_file(message_server)
 
             message_server_registration_payload = MessageServerRegistrationSuccessResponse(message_server.message_server_id)
             response = ServerResponse(VERSION, SERVER_REGISTRATION_SUCCESS_CODE, message_server_registration_payload)
         except RuntimeError as e:
+            self.metrics.error('server_registration_failed')
             response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None)
 
         return response.pack()
 
-    def add_message_server_to_file(self, server: MessageServer):
+    def index_message_server(self, server: MessageServer):
         self.message_servers[server.get_id_string()] = server
-        server_line = f'{server.message_server_id.hex()}:{server.name}:{server.key.hex()}:{server.ip_address}:{server.port}'
-        write_line_to_file(SERVERS, server_line)
+        self.message_server_ids_by_name[server.name] = server.get_id_string()
+        self.server_list_cache = OrderedDict()
 
-    def process_server_list_request(self, request):
+    def add_message_server_to_file(self, server: MessageServer):
+        """
+        Waits for the message server record to be committed by the registration writer, then adds the server.
+        If the commit fails, the name reserved for the server is released.
+        """
         try:
-            server_list = ''
-            i = 1
-            for message_server in self.message_servers.values():
-                server_list += f'{i}) {message_server.name} ID: {message_server.message_server_id.hex()} at: {message_server.ip_address}:{message_server.port}\n'
-                i = i + 1
-            response = ServerResponse(VERSION, MESSAGE_SERVER_LIST_RESPONSE_CODE, server_list.encode('utf-8'))
-        except RuntimeError as e:
-            response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None)
+            self.registration_writer.submit(self.servers_store, server.to_record()).result()
+        except Exception as e:
+            with self.registration_lock:
+                del self.message_server_ids_by_name[server.name]
+            raise RuntimeError("Could not save the message server!") from e
+        self.index_message_server(server)
 
-        return response.pack()
+    def process_server_list_request(self, request):
+        return self.get_server_list_response(False, 0, None, '')
+
+    def process_server_list_page_request(self, request):
+        page_request = cast(ServerListPageRequest, request.payload)
+        limit = min(page_request.limit, MAX_SERVER_LIST_PAGE_SIZE)
+        return self.get_server_list_response(False, page_request.offset, limit, page_request.name_filter)
+
+    def process_binary_server_list_request(self, request):
+        """
+        The binary list request may hold a ServerListPageRequest payload. Without one, all servers are returned.
+        """
+        if isinstance(request.payload, ServerListPageRequest):
+            page_request = request.payload
+            limit = min(page_request.limit, MAX_SERVER_LIST_PAGE_SIZE)
+            return self.get_server_list_response(True, page_request.offset, limit, page_request.name_filter)
+        return self.get_server_list_response(True, 0, None, '')
+
+    def get_server_list_response(self, binary, offset, limit, name_filter):
+        """
+        Returns the packed server list response for a page of the message servers whose name contains name_filter.
+        Responses are cached until the next message server registration. Only the MAX_CACHED_SERVER_LIST_PAGES most
+        recently used pages are kept, so pages of arbitrary name filters can't push the hot pages out for good.
+        :param binary: True for a MessageServerListResponse payload, False for the text list
+        :param offset: index of the first server in the page
+        :param limit: max number of servers in the page, None for all of them
+        :param name_filter: substring of the server names to return, empty for all servers
+        :return: packed ServerResponse
+        """
+        if self.registration_proxy is not None:
+            self.refresh_message_servers()
+        cache = self.server_list_cache
+        cache_key = (binary, offset, limit, name_filter)
+        with self.server_list_cache_lock:
+            response = cache.get(cache_key)
+            if response is not None:
+                cache.move_to_end(cache_key)
+                return response
+
+        servers = [server for server in list(self.message_servers.values()) if name_filter in server.name]
+        end = len(servers) if limit is None else offset + limit
+        if binary:
+            payload = MessageServerListResponse(
+                [(server.message_server_id, server.name, server.ip_address, server.port)
+                 for server in servers[offset:end]])
+            response = ServerResponse(VERSION, MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE, payload).pack()
+        else:
+            lines = [f'{i}) {server.name} ID: {server.message_server_id.hex()} at: {server.ip_address}:{server.port}\n'
+                     for i, server in enumerate(servers[offset:end], start=offset + 1)]
+            response = ServerResponse(VERSION, MESSAGE_SERVER_LIST_RESPONSE_CODE, ''.join(lines).encode('utf-8')).pack()
+        with self.server_list_cache_lock:
+            cache[cache_key] = response
+            if len(cache) > MAX_CACHED_SERVER_LIST_PAGES:
+                cache.popitem(last=False)
+        return response
 
     def process_session_key_and_ticket_request(self, request):
         response = None
         try:
-            client_request = ClientRequest.unpack(request, payload_type=SessionKeyAndTicketRequest)
-            session_key_and_ticket_request = cast(SessionKeyAndTicketRequest, client_request.payload)
-            server = self.message_servers[session_key_and_ticket_request.message_server_id.hex()]
+            session_key_and_ticket_request = cast(SessionKeyAndTicketRequest, request.payload)
+            server = self.find_message_server(session_key_and_ticket_request.message_server_id.hex())
             if server is None:
                 raise RuntimeError("Message server not found!")
 
             # Create the encrypted key field
-            client = self.clients[client_request.client_id.hex()]
+            client = self.find_client(request.client_id.hex())
+            if client is None:
+                raise RuntimeError("Client not found!")
             session_key = generate_aes_key()
-            print(f'Generated session key {session_key.hex()}')
-            encrypted_key, iv = encrypt_aes_cbc(client.password_hash, session_key, None)
-            encrypted_nonce, _ = encrypt_aes_cbc(client.password_hash, session_key_and_ticket_request.nonce, iv)
+            (encrypted_key, encrypted_nonce), iv = encrypt_aes_cbc_fields(
+                client.password_hash, [session_key, session_key_and_ticket_request.nonce], None)
 
             session_key_bytes = EncryptedSessionKey(iv, encrypted_nonce, encrypted_key).pack()
 
             # create the ticket field
             creation_time = datetime.now()
             creation_time_bytes = datetime_to_timestamp_bytes(creation_time)
-            expiration_time = creation_time + timedelta(minutes=5)
+            expiration_time = creation_time + timedelta(minutes=TICKET_LIFETIME_MINUTES)
             expiration_time_bytes = datetime_to_timestamp_bytes(expiration_time)
-            ticket_encrypted_session_key, ticket_iv = encrypt_aes_cbc(server.key, session_key, None)
-            ticket_encrypted_expiration_time, _ = encrypt_aes_cbc(server.key, expiration_time_bytes, ticket_iv)
-            ticket_bytes = Ticket(VERSION, client_request.client_id, server.message_server_id, creation_time_bytes, ticket_iv, ticket_encrypted_session_key, ticket_encrypted_expiration_time).pack()
+            (ticket_encrypted_session_key, ticket_encrypted_expiration_time), ticket_iv = encrypt_aes_cbc_fields(
+                server.key, [session_key, expiration_time_bytes], None)
+            ticket_bytes = Ticket(VERSION, request.client_id, server.message_server_id, creation_time_bytes, ticket_iv, ticket_encrypted_session_key, ticket_encrypted_expiration_time).pack()
 
             response_payload = KeyAndTokenResponse(client.client_id, session_key_bytes, ticket_bytes)
             response = ServerResponse(VERSION, SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, response_payload)
-        except Exception as e:
-            print(e)
+        except RuntimeError as e:
+            request_logger.info("Could not issue a session key and ticket to %s: %s", request.client_address, e)
+            self.metrics.client_error('ticket_failed')
+            response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None)
+        except Exception:
+            logger.exception("Error issuing a session key and ticket to %s", request.client_address)
+            self.metrics.error('internal_error')
             response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None)
         finally:
-            return response.pack()
\ No newline at end of file
+            return response.pack()
+
+    def process_batch_session_key_and_ticket_request(self, request):
+        """
+        Issues a session key and ticket for every (client id, message server id, nonce) in the request.
+        A ticket whose client or message server is unknown is returned as a failed record.
+        """
+        try:
+            ticket_requests = cast(BatchSessionKeyAndTicketRequest, request.payload).ticket_requests
+            response_payload = BatchKeyAndTokenResponse(self.issue_tickets(ticket_requests))
+            response = ServerResponse(VERSION, BATCH_SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, response_payload)
+        except RuntimeError as e:
+            request_logger.info("Could not issue a batch of session keys and tickets to %s: %s",
+                                request.client_address, e)
+            self.metrics.client_error('batch_ticket_failed')
+            response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None)
+        except Exception:
+            logger.exception("Error issuing a batch of session keys and tickets to %s", request.client_address)
+            self.metrics.error('internal_error')
+            response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None)
+
+        return response.pack()
+
+    def process_multi_server_session_key_and_ticket_request(self, request):
+        """
+        Issues the requesting client a session key and ticket for every message server in the request, all with the
+        request's nonce. A ticket for an unknown message server is returned as a failed record.
+        """
+        try:
+            multi_server_request = cast(MultiServerSessionKeyAndTicketRequest, request.payload)
+            if self.find_client(request.client_id.hex()) is None:
+                raise RuntimeError("Client not found!")
+            ticket_requests = [(request.client_id, message_server_id, multi_server_request.nonce)
+                               for message_server_id in multi_server_request.message_server_ids]
+            response_payload = BatchKeyAndTokenResponse(self.issue_tickets(ticket_requests))
+            response = ServerResponse(VERSION, BATCH_SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, response_payload)
+        except RuntimeError as e:
+            request_logger.info("Could not issue session keys and tickets for several servers to %s: %s",
+                                request.client_address, e)
+            self.metrics.client_error('multi_server_ticket_failed')
+            response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None)
+        except Exception:
+            logger.exception("Error issuing session keys and tickets for several servers to %s",
+                             request.client_address)
+            self.metrics.error('internal_error')
+            response = ServerResponse(VERSION, GENERAL_SERVER_ERROR_CODE, None)
+
+        return response.pack()
+
+    def issue_tickets(self, ticket_requests):
+        """
+        Issues a session key and ticket for every (client id, message server id, nonce).
+        The random session keys and ivs of all the tickets are generated at once, and the tickets of every message
+        server are encrypted together with encrypt_aes_cbc_batch.
+        :param ticket_requests: list of (client id, message server id, nonce) tuples
+        :return: list of KeyAndTokenResponse objects in the order of the requests, with None for a ticket whose
+        client or message server is unknown
+        """
+        if len(ticket_requests) > MAX_TICKET_BATCH_SIZE:
+            raise RuntimeError(f"Batch of {len(ticket_requests)} tickets is over {MAX_TICKET_BATCH_SIZE}!")
+
+        # 32 bytes session key, 16 bytes session key iv and 16 bytes ticket iv per ticket
+        random_bytes = get_random_bytes(64 * len(ticket_requests))
+        creation_time = datetime.now()
+        creation_time_bytes = datetime_to_timestamp_bytes(creation_time)
+        expiration_time_bytes = datetime_to_timestamp_bytes(
+            creation_time + timedelta(minutes=TICKET_LIFETIME_MINUTES))
+
+        issued = []
+        indexes_by_server_key = dict()
+        for i, (client_id, message_server_id, nonce) in enumerate(ticket_requests):
+            client = self.find_client(client_id.hex())
+            server = self.find_message_server(message_server_id.hex())
+            if client is None or server is None:
+                issued.append(None)
+                continue
+            ticket_random_bytes = random_bytes[i * 64:(i + 1) * 64]
+            issued.append((client, server, nonce, ticket_random_bytes[:32], ticket_random_bytes[32:48],
+                           ticket_random_bytes[48:]))
+            indexes_by_server_key.setdefault(server.key, []).append(i)
+
+        # encrypt the ticket fields of each message server in one batch
+        encrypted_tickets = dict()
+        for server_key, indexes in indexes_by_server_key.items():
+            fields = []
+            ivs = []
+            for i in indexes:
+                _, _, _, session_key, _, ticket_iv = issued[i]
+                fields += [session_key, expiration_time_bytes]
+                ivs += [ticket_iv, ticket_iv]
+            encrypted_fields = encrypt_aes_cbc_batch(server_key, fields, ivs)
+            for position, i in enumerate(indexes):
+                encrypted_tickets[i] = encrypted_fields[2 * position:2 * position + 2]
+
+        key_and_token_responses = []
+        for i, ticket in enumerate(issued):
+            if ticket is None:
+                key_and_token_responses.append(None)
+                continue
+            client, server, nonce, session_key, iv, ticket_iv = ticket
+            (encrypted_key, encrypted_nonce), _ = encrypt_aes_cbc_fields(
+                client.password_hash, [session_key, nonce], iv)
+            session_key_bytes = EncryptedSessionKey(iv, encrypted_nonce, encrypted_key).pack()
+            ticket_encrypted_session_key, ticket_encrypted_expiration_time = encrypted_tickets[i]
+            ticket_bytes = Ticket(VERSION, client.client_id, server.message_server_id, creation_time_bytes,
+                                  ticket_iv, ticket_encrypted_session_key, ticket_encrypted_expiration_time).pack()
+            key_and_token_responses.append(KeyAndTokenResponse(client.client_id, session_key_bytes, ticket_bytes))
+        return key_and_token_responses
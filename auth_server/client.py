@@ -1,3 +1,4 @@
+import struct
 import uuid
 from datetime import datetime
 
@@ -5,6 +6,12 @@ from common.date_utils import get_datetime_from_ts
 
 
 class Client:
+    # id, name, password hash, last seen timestamp
+    RECORD_STRUCT = struct.Struct('<16s255s32sQ')
+    # the id field of a record, the rest is skipped
+    ID_STRUCT = struct.Struct('<16s295x')
+    # the id and name fields of a record, the rest is skipped
+    ID_AND_NAME_STRUCT = struct.Struct('<16s255s40x')
 
     def __init__(self, client_id: bytes, name: str, password_hash: bytes, last_seen: datetime = None):
         """
@@ -54,3 +61,18 @@ class Client:
         client_id = uuid.UUID(parts[0]).bytes
 
         return cls(client_id, parts[1], bytes.fromhex(parts[2]), line_time)
+
+    def to_record(self):
+        """
+        :return: the client as a record tuple, packable with RECORD_STRUCT
+        """
+        return self.client_id, self.name.encode('utf-8'), self.password_hash, int(self.last_seen.timestamp())
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Creates a client from a record tuple unpacked with RECORD_STRUCT
+        :param record:
+        """
+        client_id, name, password_hash, last_seen = record
+        return cls(client_id, name.rstrip(b'\x00').decode('utf-8'), password_hash, datetime.fromtimestamp(last_seen))
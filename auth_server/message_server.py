@@ -1,10 +1,14 @@
+import struct
 import uuid
 from datetime import datetime
 
 from common.date_utils import get_datetime_from_ts
+from common.network_utils import ip_to_bytes, ip_from_bytes
 
 
 class MessageServer:
+    # id, name, key, ip address, port
+    RECORD_STRUCT = struct.Struct('<16s255s32s16sH')
 
     def __init__(self, message_server_id: bytes, name: str, key: bytes, ip_address: str, port: int):
         """
@@ -52,3 +56,18 @@ class MessageServer:
             raise ValueError("Illegal message server string was found!")
 
         return cls(bytes.fromhex(parts[0]), parts[1], bytes.fromhex(parts[2]), parts[3], int(parts[4]))
+
+    def to_record(self):
+        """
+        :return: the message server as a record tuple, packable with RECORD_STRUCT
+        """
+        return self.message_server_id, self.name.encode('utf-8'), self.key, ip_to_bytes(self.ip_address), self.port
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Creates a message server from a record tuple unpacked with RECORD_STRUCT
+        :param record:
+        """
+        message_server_id, name, key, ip_address, port = record
+        return cls(message_server_id, name.rstrip(b'\x00').decode('utf-8'), key, ip_from_bytes(ip_address), port)
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_BUCKETS = 65536
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate, burst, max_buckets=DEFAULT_MAX_BUCKETS):
+        """
+        Rate limits requests per key (a client id, an ip address) with a token bucket per key. A bucket holds up to
+        burst tokens and refills at rate tokens per second, and every allowed request takes a token.
+        At most max_buckets buckets are kept - adding one to a full limiter evicts the least recently used bucket.
+        A bucket that was not used for burst / rate seconds is full again, so evicting it loses nothing, and a
+        flood of new keys only makes the limiter forget the keys it saw least recently.
+        :param rate: tokens added to a bucket per second
+        :param burst: the capacity of a bucket, which is the number of requests a new key may send at once
+        :param max_buckets: max number of keys whose buckets are kept
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError('The rate must be positive and the burst at least 1')
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        # key -> [tokens, time of the last refill], least recently used first
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def allow(self, key, cost=1, now=None):
+        """
+        Takes cost tokens from the bucket of key. A request that costs more than the burst is never allowed.
+        :param cost: the number of tokens the request takes, e.g. the number of tickets it asks for
+        :param now: the time.monotonic() time, the current time by default
+        :return: True if the request is allowed, False if the key's bucket holds less than cost tokens
+        """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_buckets:
+                    self.buckets.popitem(last=False)
+                bucket = [self.burst, now]
+                self.buckets[key] = bucket
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < cost:
+                return False
+            bucket[0] -= cost
+            return True
+
+
+class InFlightLimiter:
+    def __init__(self, max_in_flight):
+        """
+        Caps the number of requests processed at once. Requests over the cap are not queued - try_acquire fails
+        right away, so they can be rejected before any work is done for them.
+        :param max_in_flight: max number of requests processed at once
+        """
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        :return: True if the request may be processed, in which case release must be called once it is done
+        """
+        with self.lock:
+            if self.in_flight >= self.max_in_flight:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
@@ -0,0 +1,153 @@
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+HEADER_STRUCT = struct.Struct('<4sHI6x')
+MAGIC = b'KRBS'
+STORE_FORMAT_VERSION = 1
+
+
+class RecordStore:
+    def __init__(self, file_path, record_struct: struct.Struct):
+        """
+        An append-only file of fixed size binary records, used by the auth server to persist clients and message
+        servers. The file starts with a 16 byte header (magic, format version, record size) followed by the packed
+        records. Records are read through a read-only memory map, so loading the store does not parse anything up
+        front - records are unpacked only when they are accessed.
+        :param file_path: path of the store file. Created if it does not exist.
+        :param record_struct: the struct.Struct every record is packed with
+        """
+        self.file_path = file_path
+        self.record_struct = record_struct
+        self.record_size = record_struct.size
+
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            with open(file_path, 'wb') as file:
+                file.write(HEADER_STRUCT.pack(MAGIC, STORE_FORMAT_VERSION, self.record_size))
+
+        with open(file_path, 'rb') as file:
+            magic, version, record_size = HEADER_STRUCT.unpack(file.read(HEADER_STRUCT.size))
+        if magic != MAGIC or version != STORE_FORMAT_VERSION:
+            raise ValueError(f'{file_path} is not a record store file!')
+        if record_size != self.record_size:
+            raise ValueError(f'{file_path} holds records of {record_size} bytes, expected {self.record_size}!')
+
+        # drop a partially written record left by a crash mid-append, so new records stay aligned
+        partial_record_size = (os.path.getsize(file_path) - HEADER_STRUCT.size) % self.record_size
+        if partial_record_size > 0:
+            os.truncate(file_path, os.path.getsize(file_path) - partial_record_size)
+
+        self.append_file = open(file_path, 'ab')
+        self.map = None
+        self.mapped_records = 0
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-maps the file if records were appended to it since it was last mapped.
+        A trailing partially written record (e.g. after a crash mid-append) is ignored.
+        The previous map is not closed explicitly, so readers still iterating over it are not affected - it is
+        closed once they release it.
+        :return: the number of records that became visible
+        """
+        file_size = os.path.getsize(self.file_path)
+        record_count = (file_size - HEADER_STRUCT.size) // self.record_size
+        if record_count == self.mapped_records and self.map is not None:
+            return 0
+
+        with open(self.file_path, 'rb') as file:
+            new_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.map = new_map
+        new_records = record_count - self.mapped_records
+        self.mapped_records = record_count
+        return new_records
+
+    def __len__(self):
+        return self.mapped_records
+
+    def record(self, index):
+        """
+        Unpacks a single record
+        :param index: record index
+        :return: the unpacked record tuple
+        """
+        if not 0 <= index < self.mapped_records:
+            raise IndexError(f'Record {index} is out of range')
+        return self.record_struct.unpack_from(self.map, HEADER_STRUCT.size + index * self.record_size)
+
+    def records(self, view_struct: struct.Struct = None, start=0):
+        """
+        Iterates over the mapped records in a single pass
+        :param view_struct: optional struct of the same size as the record struct, which unpacks only some of the
+        fields (the others are padding bytes). Defaults to the record struct.
+        :param start: index of the first record
+        :return: an iterator of unpacked record tuples
+        """
+        if view_struct is None:
+            view_struct = self.record_struct
+        if view_struct.size != self.record_size:
+            raise ValueError('The view struct size must match the record size')
+        begin = HEADER_STRUCT.size + start * self.record_size
+        end = HEADER_STRUCT.size + self.mapped_records * self.record_size
+        return view_struct.iter_unpack(memoryview(self.map)[begin:end])
+
+    def append(self, records):
+        """
+        Appends records to the end of the file.
+        The memory map is not refreshed - callers keep the objects they appended.
+        :param records: iterable of record tuples
+        """
+        self.append_file.write(b''.join(self.record_struct.pack(*record) for record in records))
+        self.append_file.flush()
+
+    def sync(self):
+        """
+        Forces the appended records to disk
+        """
+        os.fsync(self.append_file.fileno())
+
+    def close(self):
+        self.append_file.close()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class LazyRecordMapping(Mapping):
+    def __init__(self, store: RecordStore, factory, index_by_key: dict):
+        """
+        A read-mostly mapping of key -> object, backed by a RecordStore.
+        Objects are created from their record on first access and cached.
+        :param store: the backing store
+        :param factory: creates an object from an unpacked record tuple
+        :param index_by_key: key -> record index of the records in the store
+        """
+        self.store = store
+        self.factory = factory
+        self.index_by_key = index_by_key
+        self.cache = dict()
+
+    def __getitem__(self, key):
+        value = self.cache.get(key)
+        if value is None:
+            index = self.index_by_key[key]
+            value = self.factory(self.store.record(index))
+            self.cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        """
+        Adds an object that is not (yet) visible in the store's memory map.
+        """
+        self.cache[key] = value
+        self.index_by_key.setdefault(key, None)
+
+    def __contains__(self, key):
+        return key in self.index_by_key
+
+    def __iter__(self):
+        return iter(self.index_by_key)
+
+    def __len__(self):
+        return len(self.index_by_key)
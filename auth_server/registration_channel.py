@@ -0,0 +1,97 @@
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from common.logging_utils import get_logger
+
+logger = get_logger('auth_server.registration_channel')
+
+
+class RegistrationProxy:
+    def __init__(self, connection):
+        """
+        The worker process side of the registration channel. Forwards registration requests to the parent process
+        over a multiprocessing pipe connection, so all the registrations are checked and written by a single
+        process. Requests of several threads may be in flight at once - responses are matched by request id.
+        :param connection: the worker's end of the pipe to the parent process
+        """
+        self.connection = connection
+        self.send_lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.pending = dict()
+        self.closed = False
+        self.thread = threading.Thread(target=self.receive_responses, name='registration-proxy', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def forward(self, request, client_address):
+        """
+        Sends a registration request to the parent process and waits for its response
+        :param request: the raw request bytes
+        :param client_address: the (ip, port) the request was received from
+        :return: the packed response
+        """
+        future = Future()
+        with self.send_lock:
+            if self.closed:
+                raise RuntimeError("The registration channel is closed")
+            request_id = next(self.request_ids)
+            self.pending[request_id] = future
+            self.connection.send((request_id, request, client_address))
+        return future.result()
+
+    def receive_responses(self):
+        while True:
+            try:
+                request_id, response, error = self.connection.recv()
+            except EOFError:
+                with self.send_lock:
+                    self.closed = True
+                for future in self.pending.values():
+                    future.set_exception(RuntimeError("The parent process closed the registration channel"))
+                return
+            future = self.pending.pop(request_id)
+            if error is None:
+                future.set_result(response)
+            else:
+                future.set_exception(RuntimeError(error))
+
+
+class RegistrationService:
+    def __init__(self, connections, handler, max_concurrent_requests=64):
+        """
+        The parent process side of the registration channel. Receives the requests forwarded by the workers'
+        RegistrationProxy and runs them on a thread pool, so concurrent registrations of all the workers still
+        reach the registration writer together and share its group commits.
+        :param connections: the parent's ends of the pipes to the worker processes
+        :param handler: processes a (request, client_address) and returns the packed response
+        :param max_concurrent_requests: number of threads processing requests
+        """
+        self.connections = connections
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_concurrent_requests, thread_name_prefix='registration-service')
+
+    def start(self):
+        for number, connection in enumerate(self.connections):
+            send_lock = threading.Lock()
+            threading.Thread(target=self.receive_requests, args=(connection, send_lock),
+                             name=f'registration-service-{number}', daemon=True).start()
+
+    def receive_requests(self, connection, send_lock):
+        while True:
+            try:
+                request_id, request, client_address = connection.recv()
+            except EOFError:
+                return
+            self.executor.submit(self.process, connection, send_lock, request_id, request, client_address)
+
+    def process(self, connection, send_lock, request_id, request, client_address):
+        try:
+            response = self.handler(request, client_address)
+            message = (request_id, response, None)
+        except Exception as e:
+            logger.exception("Error handling a registration forwarded from %s", client_address)
+            message = (request_id, None, str(e))
+        with send_lock:
+            connection.send(message)
@@ -0,0 +1,97 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from common.logging_utils import get_logger
+
+FSYNC_BATCH = 'batch'
+FSYNC_NONE = 'none'
+FSYNC_POLICIES = (FSYNC_BATCH, FSYNC_NONE)
+
+logger = get_logger('auth_server.registration_writer')
+
+
+class RegistrationWriter:
+    def __init__(self, fsync_policy=FSYNC_BATCH, max_batch_size=1024, max_batch_delay_seconds=0.0):
+        """
+        Writes registration records to their record stores on a single background thread, in group commits.
+        Every record queued while the previous commit was being written is committed together - with one write and
+        one fsync per store - so the cost of an fsync is shared by all the registrations in the batch.
+        :param fsync_policy: 'batch' - fsync every batch before acknowledging it.
+        'none' - only flush the batch to the OS, a crash of the host may lose acknowledged registrations.
+        :param max_batch_size: max number of records committed together
+        :param max_batch_delay_seconds: how long to wait for more records before committing a batch that is not full
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy {fsync_policy}!')
+        self.fsync_policy = fsync_policy
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay_seconds = max_batch_delay_seconds
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='registration-writer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """
+        Commits the records that are already queued and stops the writer thread
+        """
+        self.pending.put(None)
+        self.thread.join()
+
+    def submit(self, store, record):
+        """
+        Queues a record to be appended to a store
+        :param store: a RecordStore
+        :param record: a record tuple
+        :return: a Future, resolved once the record was committed according to the fsync policy
+        """
+        future = Future()
+        self.pending.put((store, record, future))
+        return future
+
+    def next_batch(self):
+        """
+        Blocks until at least one record is queued, then takes up to max_batch_size queued records.
+        :return: a tuple of the batch and whether the writer was asked to stop
+        """
+        batch = []
+        item = self.pending.get()
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= self.max_batch_size:
+                break
+            try:
+                if self.max_batch_delay_seconds > 0:
+                    item = self.pending.get(timeout=self.max_batch_delay_seconds)
+                else:
+                    item = self.pending.get_nowait()
+            except queue.Empty:
+                break
+        return batch, item is None
+
+    def commit(self, batch):
+        records_by_store = dict()
+        for store, record, _ in batch:
+            records_by_store.setdefault(store, []).append(record)
+        for store, records in records_by_store.items():
+            store.append(records)
+            if self.fsync_policy == FSYNC_BATCH:
+                store.sync()
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self.next_batch()
+            if len(batch) == 0:
+                continue
+            try:
+                self.commit(batch)
+            except Exception as e:
+                logger.exception("Could not commit a batch of %d registrations", len(batch))
+                for _, _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, _, future in batch:
+                    future.set_result(None)
@@ -0,0 +1,47 @@
+import argparse
+
+from common.file_utils import read_file_lines, is_file_exists
+from .client import Client
+from .message_server import MessageServer
+from .record_store import RecordStore
+
+
+def convert_text_file(text_file_path, store_file_path, record_type):
+    """
+    Converts a colon delimited clients/servers text file to a binary record store.
+    Records are appended, so the store file should not exist yet.
+    :param text_file_path: the text file to read
+    :param store_file_path: the record store file to write
+    :param record_type: Client or MessageServer - a class with from_line, to_record and RECORD_STRUCT
+    :return: the number of converted records
+    """
+    lines = read_file_lines(text_file_path)
+    store = RecordStore(store_file_path, record_type.RECORD_STRUCT)
+    try:
+        store.append(record_type.from_line(line).to_record() for line in lines)
+    finally:
+        store.close()
+    return len(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converts the auth server text files to binary record stores')
+    parser.add_argument('--clients', default='clients', help='clients text file')
+    parser.add_argument('--clients-store', default='clients.db', help='clients store file to create')
+    parser.add_argument('--servers', default='servers', help='message servers text file')
+    parser.add_argument('--servers-store', default='servers.db', help='message servers store file to create')
+    args = parser.parse_args()
+
+    for text_file, store_file, record_type in ((args.clients, args.clients_store, Client),
+                                               (args.servers, args.servers_store, MessageServer)):
+        if not is_file_exists(text_file):
+            print(f'{text_file} does not exist, skipping')
+        elif is_file_exists(store_file):
+            print(f'{store_file} already exists, skipping')
+        else:
+            count = convert_text_file(text_file, store_file, record_type)
+            print(f'Converted {count} records from {text_file} to {store_file}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from auth_server.auth_server import SERVER_MODES, VERSION
+from common.framing_utils import read_server_response
+from common.protocol.client_request import ClientRequest
+from common.protocol.message_codes import SERVER_LIST_REQUEST_CODE
+
+RUN_AUTH_SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'run_auth_server.py')
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Auth server did not start listening on port {port}')
+
+
+def start_auth_server(mode, port, work_dir):
+    """
+    Starts an auth server subprocess in the given mode, in an empty working directory so the benchmark
+    does not touch the real clients and servers files.
+    """
+    with open(os.path.join(work_dir, 'port.info'), 'w') as file:
+        file.write(f'{port}\n')
+    process = subprocess.Popen([sys.executable, RUN_AUTH_SERVER, '--mode', mode], cwd=work_dir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+def send_server_list_request(port, packed_request):
+    with socket.create_connection(('127.0.0.1', port)) as client_socket:
+        client_socket.sendall(packed_request)
+        if read_server_response(client_socket) is None:
+            raise RuntimeError('The auth server closed the connection without a response')
+
+
+def run_load(port, connections, requests_per_connection):
+    """
+    Runs `connections` client threads, each sending requests_per_connection server list requests
+    on a new connection each, which is closed once the response is read - so every request pays for a connection
+    setup, as it did before the auth server kept connections open.
+    :return: a tuple of the elapsed wall time and the list of request latencies in seconds
+    """
+    packed_request = ClientRequest(bytes(16), VERSION, SERVER_LIST_REQUEST_CODE, None).pack()
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def worker():
+        local_latencies = []
+        for _ in range(requests_per_connection):
+            start = time.perf_counter()
+            send_server_list_request(port, packed_request)
+            local_latencies.append(time.perf_counter() - start)
+        with latencies_lock:
+            latencies.extend(local_latencies)
+
+    threads = [threading.Thread(target=worker) for _ in range(connections)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def benchmark_mode(mode, connections, requests_per_connection):
+    port = get_free_port()
+    with tempfile.TemporaryDirectory() as work_dir:
+        process = start_auth_server(mode, port, work_dir)
+        try:
+            elapsed, latencies = run_load(port, connections, requests_per_connection)
+        finally:
+            process.terminate()
+            process.wait()
+
+    latencies.sort()
+    print(f'{mode:>8}: {len(latencies) / elapsed:10.0f} req/s | '
+          f'mean {statistics.mean(latencies) * 1000:7.2f} ms | '
+          f'p50 {percentile(latencies, 0.50) * 1000:7.2f} ms | '
+          f'p95 {percentile(latencies, 0.95) * 1000:7.2f} ms | '
+          f'p99 {percentile(latencies, 0.99) * 1000:7.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the threaded and async auth server modes')
+    parser.add_argument('--connections', type=int, default=50, help='number of concurrent client threads')
+    parser.add_argument('--requests', type=int, default=200, help='requests sent by each client thread')
+    parser.add_argument('--modes', nargs='+', choices=SERVER_MODES, default=list(SERVER_MODES))
+    args = parser.parse_args()
+
+    print(f'{args.connections} concurrent clients x {args.requests} server list requests')
+    for mode in args.modes:
+        benchmark_mode(mode, args.connections, args.requests)
+
+
+if __name__ == "__main__":
+    main()
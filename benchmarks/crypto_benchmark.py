@@ -0,0 +1,99 @@
+import argparse
+import timeit
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from Crypto.Util.Padding import pad, unpad
+
+from common.cryptography_utils import encrypt_aes_cbc_fields, decrypt_aes_cbc_fields, generate_aes_key, \
+    encrypt_aes_cbc_batch
+
+
+def encrypt_with_new_cipher(key, plain_bytes, iv):
+    """
+    encrypt_aes_cbc before cipher caching - a new cipher (and key schedule) for every field
+    """
+    if iv is None:
+        iv = get_random_bytes(AES.block_size)
+    return AES.new(key, AES.MODE_CBC, iv).encrypt(pad(plain_bytes, AES.block_size)), iv
+
+
+def decrypt_with_new_cipher(key, encrypted_bytes, iv):
+    return unpad(AES.new(key, AES.MODE_CBC, iv).decrypt(encrypted_bytes), AES.block_size)
+
+
+def issue_ticket_uncached(password_hash, server_key, session_key, nonce, expiration_time):
+    encrypted_key, iv = encrypt_with_new_cipher(password_hash, session_key, None)
+    encrypted_nonce, _ = encrypt_with_new_cipher(password_hash, nonce, iv)
+    ticket_session_key, ticket_iv = encrypt_with_new_cipher(server_key, session_key, None)
+    ticket_expiration_time, _ = encrypt_with_new_cipher(server_key, expiration_time, ticket_iv)
+    return iv, encrypted_key, encrypted_nonce, ticket_iv, ticket_session_key, ticket_expiration_time
+
+
+def issue_ticket_cached(password_hash, server_key, session_key, nonce, expiration_time):
+    (encrypted_key, encrypted_nonce), iv = encrypt_aes_cbc_fields(password_hash, [session_key, nonce], None)
+    (ticket_session_key, ticket_expiration_time), ticket_iv = encrypt_aes_cbc_fields(
+        server_key, [session_key, expiration_time], None)
+    return iv, encrypted_key, encrypted_nonce, ticket_iv, ticket_session_key, ticket_expiration_time
+
+
+def validate_ticket_uncached(server_key, ticket_iv, ticket_session_key, ticket_expiration_time):
+    decrypt_with_new_cipher(server_key, ticket_expiration_time, ticket_iv)
+    return decrypt_with_new_cipher(server_key, ticket_session_key, ticket_iv)
+
+
+def validate_ticket_cached(server_key, ticket_iv, ticket_session_key, ticket_expiration_time):
+    return decrypt_aes_cbc_fields(server_key, [ticket_expiration_time, ticket_session_key], ticket_iv)[1]
+
+
+def encrypt_tickets_per_call(server_key, session_keys, expiration_time, ivs):
+    return [encrypt_aes_cbc_fields(server_key, [session_key, expiration_time], iv)[0]
+            for session_key, iv in zip(session_keys, ivs)]
+
+
+def encrypt_tickets_batch(server_key, session_keys, expiration_time, ivs):
+    fields = []
+    field_ivs = []
+    for session_key, iv in zip(session_keys, ivs):
+        fields += [session_key, expiration_time]
+        field_ivs += [iv, iv]
+    return encrypt_aes_cbc_batch(server_key, fields, field_ivs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per ticket AES cost with and without cached ciphers')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    password_hash = generate_aes_key()
+    server_key = generate_aes_key()
+    session_key = generate_aes_key()
+    nonce = get_random_bytes(8)
+    expiration_time = get_random_bytes(8)
+    _, _, _, ticket_iv, ticket_session_key, ticket_expiration_time = issue_ticket_cached(
+        password_hash, server_key, session_key, nonce, expiration_time)
+
+    benchmarks = [
+        ('issue ticket (auth server)', issue_ticket_uncached, issue_ticket_cached,
+         (password_hash, server_key, session_key, nonce, expiration_time)),
+        ('decrypt ticket (message server)', validate_ticket_uncached, validate_ticket_cached,
+         (server_key, ticket_iv, ticket_session_key, ticket_expiration_time)),
+    ]
+    for name, uncached, cached, arguments in benchmarks:
+        uncached_time = timeit.timeit(lambda: uncached(*arguments), number=args.iterations) / args.iterations
+        cached_time = timeit.timeit(lambda: cached(*arguments), number=args.iterations) / args.iterations
+        print(f'{name:>32}: new ciphers {uncached_time * 1e6:6.1f} us | cached ciphers {cached_time * 1e6:6.1f} us')
+
+    batch_size = 1000
+    session_keys = [generate_aes_key() for _ in range(batch_size)]
+    ivs = [get_random_bytes(16) for _ in range(batch_size)]
+    arguments = (server_key, session_keys, expiration_time, ivs)
+    repeat = max(1, args.iterations // batch_size)
+    per_call_time = timeit.timeit(lambda: encrypt_tickets_per_call(*arguments), number=repeat) / repeat / batch_size
+    batch_time = timeit.timeit(lambda: encrypt_tickets_batch(*arguments), number=repeat) / repeat / batch_size
+    print(f'{"encrypt ticket in a batch":>32}: per ticket {per_call_time * 1e6:6.1f} us | '
+          f'batched {batch_time * 1e6:6.1f} us')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import itertools
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from auth_server.auth_server import VERSION
+from benchmarks.auth_server_benchmark import get_free_port, wait_for_port, percentile
+from common.cryptography_utils import sha256_hash, generate_nonce_bytes, encrypt_aes_cbc, encrypt_aes_cbc_fields, \
+    decrypt_aes_cbc_fields
+from common.date_utils import datetime_to_timestamp_bytes
+from common.framing_utils import read_server_response
+from common.logging_utils import HOT_PATH_LOGS_ENV
+from common.protocol.authenticator import Authenticator
+from common.protocol.client_request import ClientRequest
+from common.protocol.encrypted_session_key import EncryptedSessionKey
+from common.protocol.message_codes import CLIENT_REGISTRATION_CODE, CLIENT_REGISTRATION_SUCCESS_CODE, \
+    SERVER_LIST_REQUEST_CODE, MESSAGE_SERVER_LIST_RESPONSE_CODE, BINARY_SERVER_LIST_REQUEST_CODE, \
+    MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE, SESSION_KEY_AND_TICKET_REQUEST_CODE, \
+    SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE, \
+    SESSION_KEY_ACCEPTED_RESPONSE_CODE, SEND_MESSAGE_REQUEST_CODE, MESSAGE_ACCEPTED_RESPONSE_CODE
+from common.protocol.request_1024_user_registration import UserRegistrationRequest
+from common.protocol.request_1027_session_key import SessionKeyAndTicketRequest
+from common.protocol.request_1028_send_session_key import SendSessionKeyRequest
+from common.protocol.request_1029_send_message import SendMessageRequest
+from common.protocol.response_1600_user_registration_success import UserRegistrationSuccessResponse
+from common.protocol.response_1603_key_and_token_success_response import KeyAndTokenResponse
+from common.protocol.response_1610_message_server_list import MessageServerListResponse
+from common.protocol.server_response import ServerResponse
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUN_AUTH_SERVER = os.path.join(REPOSITORY_ROOT, 'run_auth_server.py')
+RUN_MESSAGE_SERVER = os.path.join(REPOSITORY_ROOT, 'run_message_server.py')
+MESSAGE_SERVER_NAME = 'LoadTarget'
+
+REGISTER = 'register'
+LIST = 'list'
+TICKET = 'ticket'
+AUTHENTICATE = 'authenticate'
+MESSAGE = 'message'
+OPERATIONS = (REGISTER, LIST, TICKET, AUTHENTICATE, MESSAGE)
+DEFAULT_MIX = 'register=1,list=4,ticket=5,authenticate=5,message=85'
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def send_auth_server_request(port, packed_request, payload_type):
+    """
+    Sends a single request on a new connection, which is closed once the response is read. The auth server keeps
+    connections open, but virtual users contact it rarely, so each request pays for a connection setup like the
+    request of a client whose kept connection went idle.
+    :return: the unpacked ServerResponse
+    """
+    with socket.create_connection(('127.0.0.1', port)) as auth_socket:
+        auth_socket.sendall(packed_request)
+        response_bytes = read_server_response(auth_socket)
+    if response_bytes is None:
+        raise RequestFailed('The auth server closed the connection')
+    return ServerResponse.unpack(response_bytes, payload_type)
+
+
+class VirtualUser:
+    def __init__(self, number, auth_server_port, message_server_port, message_server_id, message):
+        """
+        A client that runs the Kerberos flow against the servers without any user interaction.
+        It keeps one connection to the message server, like the interactive client.
+        """
+        self.name = f'load-{os.getpid()}-{number}'
+        self.password = f'password-{number}'
+        self.password_hash = sha256_hash(self.password.encode('utf-8'))
+        self.registrations = itertools.count()
+        self.auth_server_port = auth_server_port
+        self.message_server_port = message_server_port
+        self.message_server_id = message_server_id
+        self.message = message
+        self.client_id = None
+        # the key of the last received ticket, and the key of the ticket the message server accepted
+        self.ticket_session_key = None
+        self.packed_ticket = None
+        self.session_key = None
+        self.message_server_socket = None
+
+    def register(self):
+        """
+        Registers the user on its first call, and a new throwaway user with a unique name on the next ones
+        """
+        registration = next(self.registrations)
+        name = self.name if registration == 0 else f'{self.name}-{registration}'
+        payload = UserRegistrationRequest(name, self.password)
+        request = ClientRequest(bytes(16), VERSION, CLIENT_REGISTRATION_CODE, payload).pack()
+        response = send_auth_server_request(self.auth_server_port, request, UserRegistrationSuccessResponse)
+        if response.code != CLIENT_REGISTRATION_SUCCESS_CODE:
+            raise RequestFailed(f'Registration failed with code {response.code}')
+        if self.client_id is None:
+            self.client_id = response.payload.client_id
+
+    def list_servers(self):
+        request = ClientRequest(bytes(16), VERSION, SERVER_LIST_REQUEST_CODE, None).pack()
+        response = send_auth_server_request(self.auth_server_port, request, bytes)
+        if response.code != MESSAGE_SERVER_LIST_RESPONSE_CODE:
+            raise RequestFailed(f'Server list failed with code {response.code}')
+
+    def get_ticket(self):
+        nonce = generate_nonce_bytes()
+        payload = SessionKeyAndTicketRequest(self.message_server_id, nonce)
+        request = ClientRequest(self.client_id, VERSION, SESSION_KEY_AND_TICKET_REQUEST_CODE, payload).pack()
+        response = send_auth_server_request(self.auth_server_port, request, KeyAndTokenResponse)
+        if response.code != SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE:
+            raise RequestFailed(f'Ticket request failed with code {response.code}')
+        encrypted_key = EncryptedSessionKey.unpack(response.payload.session_key)
+        session_key, received_nonce = decrypt_aes_cbc_fields(
+            self.password_hash, [encrypted_key.session_key, encrypted_key.nonce], encrypted_key.iv)
+        if received_nonce != nonce:
+            raise RequestFailed('Received nonce is incorrect')
+        self.ticket_session_key = session_key
+        self.packed_ticket = response.payload.ticket
+
+    def send_to_message_server(self, packed_request):
+        if self.message_server_socket is None:
+            self.message_server_socket = socket.create_connection(('127.0.0.1', self.message_server_port))
+        try:
+            self.message_server_socket.sendall(packed_request)
+            response_bytes = read_server_response(self.message_server_socket)
+        except OSError:
+            self.close()
+            raise
+        if response_bytes is None:
+            self.close()
+            raise RequestFailed('The message server closed the connection')
+        return ServerResponse.unpack(response_bytes, bytes)
+
+    def authenticate(self):
+        if self.ticket_session_key is None:
+            raise RequestFailed('No ticket to authenticate with')
+        creation_time_bytes = datetime_to_timestamp_bytes(datetime.now())
+        encrypted_fields, iv = encrypt_aes_cbc_fields(
+            self.ticket_session_key, [VERSION.to_bytes(), self.client_id, self.message_server_id, creation_time_bytes], None)
+        authenticator = Authenticator(iv, *encrypted_fields).pack()
+        payload = SendSessionKeyRequest(authenticator, self.packed_ticket)
+        request = ClientRequest(self.client_id, VERSION, SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE, payload).pack()
+        response = self.send_to_message_server(request)
+        if response.code != SESSION_KEY_ACCEPTED_RESPONSE_CODE:
+            raise RequestFailed(f'Authenticator was rejected with code {response.code}')
+        self.session_key = self.ticket_session_key
+
+    def send_message(self):
+        if self.session_key is None:
+            raise RequestFailed('Not authenticated with the message server')
+        encrypted_message, message_iv = encrypt_aes_cbc(self.session_key, self.message, None)
+        payload = SendMessageRequest(message_iv, encrypted_message)
+        request = ClientRequest(self.client_id, VERSION, SEND_MESSAGE_REQUEST_CODE, payload).pack()
+        response = self.send_to_message_server(request)
+        if response.code != MESSAGE_ACCEPTED_RESPONSE_CODE:
+            raise RequestFailed(f'Message was rejected with code {response.code}')
+
+    def run(self, operation):
+        {REGISTER: self.register, LIST: self.list_servers, TICKET: self.get_ticket,
+         AUTHENTICATE: self.authenticate, MESSAGE: self.send_message}[operation]()
+
+    def close(self):
+        if self.message_server_socket is not None:
+            self.message_server_socket.close()
+            self.message_server_socket = None
+
+
+def parse_mix(mix):
+    """
+    :param mix: comma separated operation=weight pairs, e.g. 'ticket=1,message=9'
+    :return: a dict of operation -> weight
+    """
+    weights = dict()
+    for item in mix.split(','):
+        operation, _, weight = item.partition('=')
+        if operation not in OPERATIONS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f'invalid mix item {item}')
+        weights[operation] = int(weight)
+    return weights
+
+
+def start_servers(work_dir, auth_server_args, message_server_args, hot_path_logs):
+    """
+    Starts an auth server and a message server that registers with it, in an empty working directory
+    :return: the auth server process, message server process, auth server port, message server port and message
+    server id
+    """
+    auth_server_port = get_free_port()
+    message_server_port = get_free_port()
+    with open(os.path.join(work_dir, 'port.info'), 'w') as file:
+        file.write(f'{auth_server_port}\n')
+    with open(os.path.join(work_dir, 'msg_server.info'), 'w') as file:
+        file.write(f'127.0.0.1:{message_server_port}\n{MESSAGE_SERVER_NAME}\n127.0.0.1:{auth_server_port}\n')
+
+    environment = dict(os.environ)
+    if not hot_path_logs:
+        environment[HOT_PATH_LOGS_ENV] = 'off'
+    auth_server = subprocess.Popen([sys.executable, RUN_AUTH_SERVER] + auth_server_args, cwd=work_dir,
+                                   env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(auth_server_port)
+    message_server = subprocess.Popen([sys.executable, RUN_MESSAGE_SERVER] + message_server_args, cwd=work_dir,
+                                      env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(message_server_port)
+
+    request = ClientRequest(bytes(16), VERSION, BINARY_SERVER_LIST_REQUEST_CODE, None).pack()
+    response = send_auth_server_request(auth_server_port, request, MessageServerListResponse)
+    if response.code != MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE:
+        raise RuntimeError('Could not find the message server id')
+    message_server_id = next(server_id for server_id, name, _, _ in response.payload.servers
+                             if name == MESSAGE_SERVER_NAME)
+    return auth_server, message_server, auth_server_port, message_server_port, message_server_id
+
+
+def run_load(users, requests_per_user, weights):
+    """
+    Runs every virtual user on its own thread. Each one registers, gets a ticket and authenticates with the message
+    server, then runs requests_per_user operations picked at random by their weights.
+    :return: a tuple of the elapsed wall time, a dict of operation -> latencies in seconds and a dict of
+    operation -> error count
+    """
+    operations = list(weights)
+    operation_weights = [weights[operation] for operation in operations]
+    results = []
+    results_lock = threading.Lock()
+
+    def user_thread(user):
+        latencies = {operation: [] for operation in OPERATIONS}
+        errors = {operation: 0 for operation in OPERATIONS}
+        schedule = [REGISTER, TICKET, AUTHENTICATE] + random.choices(operations, operation_weights,
+                                                                     k=requests_per_user)
+        for operation in schedule:
+            start = time.perf_counter()
+            try:
+                user.run(operation)
+                latencies[operation].append(time.perf_counter() - start)
+            except (RequestFailed, OSError, ValueError):
+                errors[operation] += 1
+                if user.client_id is None:
+                    break
+        user.close()
+        with results_lock:
+            results.append((latencies, errors))
+
+    threads = [threading.Thread(target=user_thread, args=(user,)) for user in users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = {operation: [] for operation in OPERATIONS}
+    errors = {operation: 0 for operation in OPERATIONS}
+    for user_latencies, user_errors in results:
+        for operation in OPERATIONS:
+            latencies[operation] += user_latencies[operation]
+            errors[operation] += user_errors[operation]
+    return elapsed, latencies, errors
+
+
+def print_report(elapsed, latencies, errors):
+    total = sum(len(operation_latencies) for operation_latencies in latencies.values())
+    print(f'{total} requests in {elapsed:.2f}s - {total / elapsed:.0f} req/s')
+    print(f'{"operation":>12} {"count":>8} {"errors":>7} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for operation in OPERATIONS:
+        operation_latencies = sorted(latencies[operation])
+        if len(operation_latencies) == 0 and errors[operation] == 0:
+            continue
+        if len(operation_latencies) == 0:
+            print(f'{operation:>12} {0:>8} {errors[operation]:>7}')
+            continue
+        print(f'{operation:>12} {len(operation_latencies):>8} {errors[operation]:>7} '
+              f'{len(operation_latencies) / elapsed:>9.0f} '
+              f'{percentile(operation_latencies, 0.50) * 1000:>8.2f} '
+              f'{percentile(operation_latencies, 0.95) * 1000:>8.2f} '
+              f'{percentile(operation_latencies, 0.99) * 1000:>8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drives the full Kerberos flow against locally started servers')
+    parser.add_argument('--users', type=int, default=20, help='number of concurrent virtual users')
+    parser.add_argument('--requests', type=int, default=200, help='operations run by each user after logging in')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f'operation weights, from {", ".join(OPERATIONS)} (default {DEFAULT_MIX})')
+    parser.add_argument('--message-size', type=int, default=64, help='size of the sent messages in bytes')
+    parser.add_argument('--auth-server-args', default='', help="extra run_auth_server.py arguments, e.g. '--mode async'")
+    parser.add_argument('--message-server-args', default='', help='extra run_message_server.py arguments')
+    parser.add_argument('--hot-path-logs', action='store_true', help='keep the per-request logs of the servers on')
+    args = parser.parse_args()
+    weights = args.mix
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        auth_server, message_server, auth_server_port, message_server_port, message_server_id = start_servers(
+            work_dir, args.auth_server_args.split(), args.message_server_args.split(), args.hot_path_logs)
+        try:
+            users = [VirtualUser(number, auth_server_port, message_server_port, message_server_id,
+                                 b'x' * args.message_size) for number in range(args.users)]
+            print(f'{args.users} users x {args.requests} operations, mix {weights}')
+            print_report(*run_load(users, args.requests, weights))
+        finally:
+            for process in (message_server, auth_server):
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
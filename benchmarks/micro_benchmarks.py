@@ -0,0 +1,295 @@
+import argparse
+import json
+import re
+import statistics
+import timeit
+from datetime import datetime
+
+from auth_server.auth_server import VERSION
+from common.cryptography_utils import generate_aes_key, generate_nonce_bytes, encrypt_aes_cbc, decrypt_aes_cbc, \
+    encrypt_aes_cbc_fields, decrypt_aes_cbc_fields, sha256_hash
+from common.date_utils import datetime_to_timestamp_bytes
+from common.protocol.authenticator import Authenticator
+from common.protocol.client_request import ClientRequest
+from common.protocol.encrypted_session_key import EncryptedSessionKey
+from common.protocol.message_codes import CLIENT_REGISTRATION_CODE, SERVER_REGISTRATION_CODE, \
+    SESSION_KEY_AND_TICKET_REQUEST_CODE, SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE, SEND_MESSAGE_REQUEST_CODE, \
+    SERVER_LIST_PAGE_REQUEST_CODE, BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE, \
+    MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE, CLIENT_REGISTRATION_SUCCESS_CODE, \
+    SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, SERVER_REGISTRATION_SUCCESS_CODE, \
+    MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE, BATCH_SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE
+from common.protocol.request_1024_user_registration import UserRegistrationRequest
+from common.protocol.request_1025_server_registration import ServerRegistrationRequest
+from common.protocol.request_1027_session_key import SessionKeyAndTicketRequest
+from common.protocol.request_1028_send_session_key import SendSessionKeyRequest
+from common.protocol.request_1029_send_message import SendMessageRequest
+from common.protocol.request_1030_server_list_page import ServerListPageRequest
+from common.protocol.request_1032_batch_session_key import BatchSessionKeyAndTicketRequest
+from common.protocol.request_1033_multi_server_session_key import MultiServerSessionKeyAndTicketRequest
+from common.protocol.response_1600_user_registration_success import UserRegistrationSuccessResponse
+from common.protocol.response_1603_key_and_token_success_response import KeyAndTokenResponse
+from common.protocol.response_1608_message_server_registration_success import \
+    MessageServerRegistrationSuccessResponse
+from common.protocol.response_1610_message_server_list import MessageServerListResponse
+from common.protocol.response_1611_batch_key_and_token import BatchKeyAndTokenResponse
+from common.protocol.server_response import ServerResponse
+from common.protocol.ticket import Ticket
+
+BENCHMARKS = dict()
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function does the setup and returns the callable that is timed.
+    """
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def make_ticket(server_key, session_key):
+    client_id = generate_nonce_bytes() * 2
+    server_id = generate_nonce_bytes() * 2
+    (encrypted_session_key, encrypted_expiration_time), iv = encrypt_aes_cbc_fields(
+        server_key, [session_key, datetime_to_timestamp_bytes(datetime.now())], None)
+    return Ticket(VERSION, client_id, server_id, datetime_to_timestamp_bytes(datetime.now()), iv,
+                  encrypted_session_key, encrypted_expiration_time)
+
+
+def make_authenticator(session_key, client_id, server_id):
+    encrypted_fields, iv = encrypt_aes_cbc_fields(
+        session_key, [VERSION.to_bytes(), client_id, server_id, datetime_to_timestamp_bytes(datetime.now())], None)
+    return Authenticator(iv, *encrypted_fields)
+
+
+@benchmark('pack ticket')
+def bench_pack_ticket():
+    ticket = make_ticket(generate_aes_key(), generate_aes_key())
+    return ticket.pack
+
+
+@benchmark('unpack ticket')
+def bench_unpack_ticket():
+    packed_ticket = make_ticket(generate_aes_key(), generate_aes_key()).pack()
+    return lambda: Ticket.unpack(packed_ticket)
+
+
+@benchmark('pack authenticator')
+def bench_pack_authenticator():
+    return make_authenticator(generate_aes_key(), bytes(16), bytes(16)).pack
+
+
+@benchmark('unpack authenticator')
+def bench_unpack_authenticator():
+    packed_authenticator = make_authenticator(generate_aes_key(), bytes(16), bytes(16)).pack()
+    return lambda: Authenticator.unpack(packed_authenticator)
+
+
+@benchmark('pack 1028 request')
+def bench_pack_send_session_key_request():
+    session_key = generate_aes_key()
+    ticket = make_ticket(generate_aes_key(), session_key)
+    authenticator = make_authenticator(session_key, ticket.client_id, ticket.server_id)
+
+    def pack():
+        payload = SendSessionKeyRequest(authenticator.pack(), ticket.pack())
+        return ClientRequest(ticket.client_id, VERSION, SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE, payload).pack()
+    return pack
+
+
+@benchmark('unpack 1028 request')
+def bench_unpack_send_session_key_request():
+    session_key = generate_aes_key()
+    ticket = make_ticket(generate_aes_key(), session_key)
+    authenticator = make_authenticator(session_key, ticket.client_id, ticket.server_id)
+    payload = SendSessionKeyRequest(authenticator.pack(), ticket.pack())
+    packed_request = ClientRequest(ticket.client_id, VERSION, SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE,
+                                   payload).pack()
+
+    def unpack():
+        request = ClientRequest.unpack(packed_request, SendSessionKeyRequest)
+        return Authenticator.unpack(request.payload.authenticator), Ticket.unpack(request.payload.ticket)
+    return unpack
+
+
+@benchmark('pack 1029 request')
+def bench_pack_send_message_request():
+    encrypted_message, iv = encrypt_aes_cbc(generate_aes_key(), b'x' * 64, None)
+    payload = SendMessageRequest(iv, encrypted_message)
+    return lambda: ClientRequest(bytes(16), VERSION, SEND_MESSAGE_REQUEST_CODE, payload).pack()
+
+
+@benchmark('unpack 1029 request')
+def bench_unpack_send_message_request():
+    encrypted_message, iv = encrypt_aes_cbc(generate_aes_key(), b'x' * 64, None)
+    packed_request = ClientRequest(bytes(16), VERSION, SEND_MESSAGE_REQUEST_CODE,
+                                   SendMessageRequest(iv, encrypted_message)).pack()
+    return lambda: ClientRequest.unpack(packed_request, SendMessageRequest)
+
+
+@benchmark('pack 100 server list')
+def bench_pack_server_list():
+    servers = [(generate_nonce_bytes() * 2, f'server {number}', '127.0.0.1', 1256 + number) for number in range(100)]
+    payload = MessageServerListResponse(servers)
+    return lambda: ServerResponse(VERSION, MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE, payload).pack()
+
+
+@benchmark('unpack 100 server list')
+def bench_unpack_server_list():
+    servers = [(generate_nonce_bytes() * 2, f'server {number}', '127.0.0.1', 1256 + number) for number in range(100)]
+    packed_response = ServerResponse(VERSION, MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE,
+                                     MessageServerListResponse(servers)).pack()
+    return lambda: ServerResponse.unpack(packed_response, MessageServerListResponse)
+
+
+def sample_frames():
+    """
+    :return: a (code, payload) tuple per request and response message type, with a representative payload
+    """
+    session_key = generate_aes_key()
+    ticket = make_ticket(generate_aes_key(), session_key).pack()
+    authenticator = make_authenticator(session_key, bytes(16), bytes(16)).pack()
+    nonce = generate_nonce_bytes()
+    encrypted_message, iv = encrypt_aes_cbc(session_key, b'x' * 64, None)
+    key_and_token = KeyAndTokenResponse(bytes(16), EncryptedSessionKey(iv, iv, bytes(48)).pack(), ticket)
+    server_ids = [generate_nonce_bytes() * 2 for _ in range(10)]
+    requests = [
+        (CLIENT_REGISTRATION_CODE, UserRegistrationRequest('alice', 'password')),
+        (SERVER_REGISTRATION_CODE, ServerRegistrationRequest('printer', session_key, 1256)),
+        (SESSION_KEY_AND_TICKET_REQUEST_CODE, SessionKeyAndTicketRequest(server_ids[0], nonce)),
+        (SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE, SendSessionKeyRequest(authenticator, ticket)),
+        (SEND_MESSAGE_REQUEST_CODE, SendMessageRequest(iv, encrypted_message)),
+        (SERVER_LIST_PAGE_REQUEST_CODE, ServerListPageRequest(0, 100, 'print')),
+        (BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE,
+         BatchSessionKeyAndTicketRequest([(bytes(16), server_id, nonce) for server_id in server_ids])),
+        (MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE, MultiServerSessionKeyAndTicketRequest(server_ids, nonce)),
+    ]
+    responses = [
+        (CLIENT_REGISTRATION_SUCCESS_CODE, UserRegistrationSuccessResponse(bytes(16))),
+        (SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, key_and_token),
+        (SERVER_REGISTRATION_SUCCESS_CODE, MessageServerRegistrationSuccessResponse(server_ids[0])),
+        (MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE,
+         MessageServerListResponse([(server_id, 'printer', '127.0.0.1', 1256) for server_id in server_ids])),
+        (BATCH_SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE,
+         BatchKeyAndTokenResponse([key_and_token] * 9 + [None])),
+    ]
+    return requests, responses
+
+
+def register_frame_benchmarks():
+    """
+    Registers a pack and an unpack benchmark of the whole frame - header and payload - of every message type
+    """
+    requests, responses = sample_frames()
+    for code, payload in requests:
+        packed_request = ClientRequest(bytes(16), VERSION, code, payload).pack()
+        benchmark(f'pack {code} frame')(
+            lambda code=code, payload=payload: lambda: ClientRequest(bytes(16), VERSION, code, payload).pack())
+        benchmark(f'unpack {code} frame')(
+            lambda packed_request=packed_request, payload_type=type(payload):
+            lambda: ClientRequest.unpack(packed_request, payload_type))
+    for code, payload in responses:
+        packed_response = ServerResponse(VERSION, code, payload).pack()
+        benchmark(f'pack {code} frame')(
+            lambda code=code, payload=payload: lambda: ServerResponse(VERSION, code, payload).pack())
+        benchmark(f'unpack {code} frame')(
+            lambda packed_response=packed_response, payload_type=type(payload):
+            lambda: ServerResponse.unpack(packed_response, payload_type))
+
+
+register_frame_benchmarks()
+
+
+@benchmark('sha256 password')
+def bench_sha256():
+    password = b'correct horse battery staple'
+    return lambda: sha256_hash(password)
+
+
+@benchmark('encrypt ticket fields')
+def bench_encrypt_ticket_fields():
+    server_key = generate_aes_key()
+    fields = [generate_aes_key(), datetime_to_timestamp_bytes(datetime.now())]
+    return lambda: encrypt_aes_cbc_fields(server_key, fields, None)
+
+
+@benchmark('decrypt ticket fields')
+def bench_decrypt_ticket_fields():
+    server_key = generate_aes_key()
+    encrypted_fields, iv = encrypt_aes_cbc_fields(
+        server_key, [generate_aes_key(), datetime_to_timestamp_bytes(datetime.now())], None)
+    return lambda: decrypt_aes_cbc_fields(server_key, encrypted_fields, iv)
+
+
+@benchmark('encrypt authenticator')
+def bench_encrypt_authenticator():
+    session_key = generate_aes_key()
+    return lambda: make_authenticator(session_key, bytes(16), bytes(16)).pack()
+
+
+@benchmark('decrypt authenticator')
+def bench_decrypt_authenticator():
+    session_key = generate_aes_key()
+    authenticator = make_authenticator(session_key, bytes(16), bytes(16))
+    encrypted_fields = [authenticator.encrypted_version, authenticator.encrypted_client_id,
+                        authenticator.encrypted_server_id, authenticator.encrypted_creation_time]
+    return lambda: decrypt_aes_cbc_fields(session_key, encrypted_fields, authenticator.iv)
+
+
+@benchmark('encrypt 1KB message')
+def bench_encrypt_message():
+    session_key = generate_aes_key()
+    message = b'x' * 1024
+    return lambda: encrypt_aes_cbc(session_key, message, None)
+
+
+@benchmark('decrypt 1KB message')
+def bench_decrypt_message():
+    session_key = generate_aes_key()
+    encrypted_message, iv = encrypt_aes_cbc(session_key, b'x' * 1024, None)
+    return lambda: decrypt_aes_cbc(session_key, encrypted_message, iv)
+
+
+def run_benchmark(function, rounds):
+    """
+    Times function like timeit's command line: the number of calls per round is calibrated to take at least
+    0.2 seconds, then rounds rounds are run
+    :return: the per call time of every round, in seconds
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return [round_time / number for round_time in timer.repeat(rounds, number)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the protocol pack/unpack and crypto paths')
+    parser.add_argument('--filter', default='', help='only run the benchmarks whose name matches this regex')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--save', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='compare the median times with the ones saved in this JSON file')
+    args = parser.parse_args()
+
+    baseline = dict()
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    results = dict()
+    print(f'{"benchmark":>24} {"ops/s":>10} {"min us":>9} {"median us":>10} {"vs saved":>9}')
+    for name, setup in BENCHMARKS.items():
+        if not re.search(args.filter, name):
+            continue
+        times = run_benchmark(setup(), args.rounds)
+        median = statistics.median(times)
+        results[name] = {'min': min(times), 'median': median}
+        comparison = f'{median / baseline[name]["median"]:>8.2f}x' if name in baseline else ''
+        print(f'{name:>24} {1 / median:>10.0f} {min(times) * 1e6:>9.2f} {median * 1e6:>10.2f} {comparison:>9}')
+
+    if args.save is not None:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from auth_server.client import Client
+from auth_server.record_store import RecordStore, LazyRecordMapping
+from auth_server.store_converter import convert_text_file
+from common.date_utils import get_timestamp_string
+from common.file_utils import read_file_lines
+
+
+def write_clients_text_file(file_path, count):
+    now = get_timestamp_string(datetime.now())
+    with open(file_path, 'w') as file:
+        for i in range(count):
+            file.write(f'{uuid.uuid4().hex}:user {i}:{os.urandom(32).hex()}:{now}\n')
+
+
+def load_text_file(file_path):
+    """
+    The way the auth server used to load the clients file
+    """
+    clients = dict()
+    for line in read_file_lines(file_path):
+        client = Client.from_line(line)
+        clients[client.get_id_string()] = client
+    return clients
+
+
+def load_store(file_path):
+    """
+    The way the auth server loads the clients store - an id index, clients created lazily
+    """
+    store = RecordStore(file_path, Client.RECORD_STRUCT)
+    index_by_id = dict()
+    for index, (client_id,) in enumerate(store.records(Client.ID_STRUCT)):
+        index_by_id[client_id.hex()] = index
+    return store, LazyRecordMapping(store, Client.from_record, index_by_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares loading the clients text file and the clients store')
+    parser.add_argument('--clients', type=int, default=200000, help='number of clients to generate')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        text_path = os.path.join(work_dir, 'clients')
+        store_path = os.path.join(work_dir, 'clients.db')
+        write_clients_text_file(text_path, args.clients)
+        convert_text_file(text_path, store_path, Client)
+
+        start = time.perf_counter()
+        load_text_file(text_path)
+        text_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store, clients = load_store(store_path)
+        store_time = time.perf_counter() - start
+        store.close()
+
+    print(f'{args.clients} clients: text file {text_time:.2f}s | record store {store_time:.2f}s')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import asyncio
+from collections import deque
+
+from client.client import Client, decrypt_session_key, create_authenticator_request, create_message_request
+from common.cryptography_utils import sha256_hash, generate_nonce_bytes
+from common.framing_utils import read_server_response_async
+from common.logging_utils import get_logger, get_hot_path_logger
+from common.protocol.client_request import ClientRequest
+from common.protocol.message_codes import CLIENT_REGISTRATION_CODE, CLIENT_REGISTRATION_SUCCESS_CODE, \
+    SERVER_LIST_REQUEST_CODE, MESSAGE_SERVER_LIST_RESPONSE_CODE, BINARY_SERVER_LIST_REQUEST_CODE, \
+    MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE, SESSION_KEY_AND_TICKET_REQUEST_CODE, \
+    SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, SESSION_KEY_ACCEPTED_RESPONSE_CODE, MESSAGE_ACCEPTED_RESPONSE_CODE, \
+    GENERAL_SERVER_ERROR_CODE
+from common.protocol.request_1024_user_registration import UserRegistrationRequest
+from common.protocol.request_1027_session_key import SessionKeyAndTicketRequest
+from common.protocol.request_1030_server_list_page import ServerListPageRequest
+from common.protocol.response_1600_user_registration_success import UserRegistrationSuccessResponse
+from common.protocol.response_1603_key_and_token_success_response import KeyAndTokenResponse
+from common.protocol.response_1610_message_server_list import MessageServerListResponse
+from common.protocol.server_response import ServerResponse
+
+logger = get_logger('client.async_client')
+# per-request logs, which may be sampled or turned off
+request_logger = get_hot_path_logger('client')
+
+
+class PooledConnection:
+    def __init__(self, reader, writer, max_pipelined_requests):
+        """
+        A connection that carries the requests of any number of coroutines. The servers answer the requests of a
+        connection in order, so requests are written as they come and every response completes the oldest waiting
+        request. Up to max_pipelined_requests requests wait for their responses at once.
+        :param reader: asyncio StreamReader of the connection
+        :param writer: asyncio StreamWriter of the connection
+        """
+        self.reader = reader
+        self.writer = writer
+        # futures of the requests waiting for their responses, oldest first
+        self.pending = deque()
+        self.slots = asyncio.Semaphore(max_pipelined_requests)
+        self.closed = False
+        self.receiver = asyncio.get_running_loop().create_task(self.receive_responses())
+
+    @property
+    def load(self):
+        return len(self.pending)
+
+    async def request(self, packed_request):
+        """
+        :param packed_request: packed ClientRequest bytes
+        :return: the raw response bytes
+        """
+        async with self.slots:
+            if self.closed:
+                raise ConnectionError('The connection is closed')
+            future = asyncio.get_running_loop().create_future()
+            self.pending.append(future)
+            self.writer.write(packed_request)
+            try:
+                await self.writer.drain()
+            except ConnectionError as e:
+                self.close(e)
+            return await future
+
+    async def receive_responses(self):
+        try:
+            while True:
+                response_bytes = await read_server_response_async(self.reader)
+                if response_bytes is None:
+                    raise ConnectionError('The server closed the connection')
+                if len(self.pending) == 0:
+                    raise ConnectionError('Received a response to no request')
+                future = self.pending.popleft()
+                # the future is done if its request timed out or was cancelled
+                if not future.done():
+                    future.set_result(response_bytes)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            self.close(e)
+
+    def close(self, error=None):
+        """
+        Closes the connection, failing the requests that wait for their responses with a ConnectionError
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.close()
+        if self.receiver is not asyncio.current_task():
+            self.receiver.cancel()
+        while len(self.pending) > 0:
+            future = self.pending.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError(f'The connection closed before a response was received: {error}'))
+
+
+class ConnectionPool:
+    def __init__(self, max_connections_per_address=4, max_pipelined_requests=64, request_timeout=None):
+        """
+        Keeps connections to the auth and message servers open and shares them among all the clients using the
+        pool. A request goes to the least loaded connection to its (host, port), and a new connection is opened
+        only when all of them are busy and there are fewer than max_connections_per_address.
+        :param max_connections_per_address: max number of connections kept to every (host, port)
+        :param max_pipelined_requests: max number of requests waiting for responses on a connection
+        :param request_timeout: seconds to wait for a response, None to wait forever
+        """
+        self.max_connections_per_address = max_connections_per_address
+        self.max_pipelined_requests = max_pipelined_requests
+        self.request_timeout = request_timeout
+        # (host, port) -> list of PooledConnection
+        self.connections = dict()
+        # (host, port) -> lock serializing opening connections to the address
+        self.connect_locks = dict()
+
+    def find_connection(self, address):
+        """
+        :return: an idle connection, or the least loaded one if no more connections may be opened, otherwise None
+        """
+        connections = [connection for connection in self.connections.get(address, []) if not connection.closed]
+        self.connections[address] = connections
+        connection = min(connections, key=lambda pooled_connection: pooled_connection.load, default=None)
+        if connection is not None and (connection.load == 0 or
+                                       len(connections) >= self.max_connections_per_address):
+            return connection
+        return None
+
+    async def get_connection(self, address):
+        connection = self.find_connection(address)
+        if connection is not None:
+            return connection
+        connect_lock = self.connect_locks.setdefault(address, asyncio.Lock())
+        async with connect_lock:
+            # another coroutine may have opened a connection while this one waited for the lock
+            connection = self.find_connection(address)
+            if connection is None:
+                reader, writer = await asyncio.open_connection(*address)
+                connection = PooledConnection(reader, writer, self.max_pipelined_requests)
+                self.connections[address].append(connection)
+                request_logger.info('Opened connection %d to %s:%d', len(self.connections[address]), *address)
+        return connection
+
+    async def request(self, host, port, packed_request, idempotent=False):
+        """
+        Sends a request and waits for its response. If the connection was closed (e.g. by the server after being
+        idle), an idempotent request is sent once more on a new connection. Other requests may have been handled
+        before the connection closed, so they fail with the ConnectionError instead.
+        :param packed_request: packed ClientRequest bytes
+        :param idempotent: whether the request may be handled twice, e.g. a servers list or ticket request
+        :return: the raw response bytes
+        """
+        for attempt in range(2):
+            connection = await self.get_connection((host, port))
+            try:
+                return await asyncio.wait_for(connection.request(packed_request), self.request_timeout)
+            except ConnectionError:
+                if attempt > 0 or not idempotent:
+                    raise
+
+    async def close(self):
+        for connections in self.connections.values():
+            for connection in connections:
+                connection.close()
+                try:
+                    await connection.writer.wait_closed()
+                except ConnectionError:
+                    pass
+        self.connections.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class AsyncClient:
+    VERSION = Client.VERSION
+    MAX_SERVER_LIST_PAGE_SIZE = Client.MAX_SERVER_LIST_PAGE_SIZE
+
+    def __init__(self, pool: ConnectionPool, auth_server_ip=Client.DEFAULT_AUTH_SERVER_IP,
+                 auth_server_port=Client.DEFAULT_AUTH_SERVER_PORT):
+        """
+        The asyncio counterpart of Client - a single identity that sends its requests through a shared
+        ConnectionPool, so thousands of identities can run the register -> list -> ticket -> authenticator -> send
+        flow concurrently over a few connections:
+            async with ConnectionPool() as pool:
+                clients = [AsyncClient(pool, ip, port) for _ in range(1000)]
+                await asyncio.gather(*(client.register(f'user {i}', password) for i, client in enumerate(clients)))
+                server = (await clients[0].get_message_servers())[0]
+                await asyncio.gather(*(client.open_session(server) for client in clients))
+                await asyncio.gather(*(client.send_messages_to_server(messages) for client in clients))
+        Failed requests raise RuntimeError, or ConnectionError for network errors.
+        :param pool: the ConnectionPool the requests are sent through
+        :param auth_server_ip: the auth server address
+        :param auth_server_port: the auth server port
+        """
+        self.pool = pool
+        self.auth_server_ip = auth_server_ip
+        self.auth_server_port = auth_server_port
+        self.client_id = None
+        self.password_hash = None
+        self.name = None
+        self.message_server_name = None
+        self.message_server_id = None
+        self.message_server_ip = None
+        self.message_server_port = None
+        self.session_key = None
+        self.packed_ticket = None
+        # serializes the session changes of coroutines sharing the client
+        self.session_lock = asyncio.Lock()
+
+    def log_in(self, name, client_id, password):
+        """
+        Sets the credentials of an already registered client
+        :param client_id: the client id bytes the auth server assigned on registration
+        """
+        self.name = name
+        self.client_id = client_id
+        self.password_hash = sha256_hash(password.encode('utf-8'))
+
+    async def send_auth_server_request(self, request, payload_type, idempotent=False):
+        response_bytes = await self.pool.request(self.auth_server_ip, self.auth_server_port, request.pack(),
+                                                 idempotent)
+        return ServerResponse.unpack(response_bytes, payload_type)
+
+    async def send_message_server_request(self, request):
+        response_bytes = await self.pool.request(self.message_server_ip, self.message_server_port, request.pack())
+        return ServerResponse.unpack(response_bytes, bytes)
+
+    async def register(self, name, password):
+        """
+        Registers a new client with the auth server and logs in as it
+        :return: the client id assigned by the auth server
+        """
+        request = ClientRequest(bytes(16), self.VERSION, CLIENT_REGISTRATION_CODE,
+                                UserRegistrationRequest(name, password))
+        response = await self.send_auth_server_request(request, UserRegistrationSuccessResponse)
+        if response.code != CLIENT_REGISTRATION_SUCCESS_CODE:
+            raise RuntimeError(f'Error {response.code} - User creation failed!')
+        request_logger.info('User created - ID: %s', response.payload.client_id.hex())
+        self.log_in(name, response.payload.client_id, password)
+        return self.client_id
+
+    async def get_message_servers(self):
+        """
+        Fetches the message servers list, in the binary format if the auth server supports it. The binary list is
+        fetched a page of MAX_SERVER_LIST_PAGE_SIZE servers at a time. Like Client.get_message_servers, it falls back
+        to the text list if the auth server answers the binary list request with an error or closes the connection.
+        :return: list of (server_id bytes, name, ip address, port) tuples
+        """
+        servers = []
+        while True:
+            payload = ServerListPageRequest(len(servers), self.MAX_SERVER_LIST_PAGE_SIZE, '')
+            request = ClientRequest(bytes(16), self.VERSION, BINARY_SERVER_LIST_REQUEST_CODE, payload)
+            try:
+                response = await self.send_auth_server_request(request, MessageServerListResponse, True)
+            except ConnectionError:
+                logger.info('The auth server closed the connection - it does not support the binary servers list')
+                break
+            if response.code == GENERAL_SERVER_ERROR_CODE:
+                logger.info('Error %d - the auth server does not support the binary servers list', response.code)
+                break
+            if response.code != MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE:
+                raise RuntimeError(f'Error {response.code} - Could not fetch servers list!')
+            page = [] if response.payload is None else response.payload.servers
+            servers.extend(page)
+            if len(page) < self.MAX_SERVER_LIST_PAGE_SIZE:
+                return servers
+
+        request = ClientRequest(bytes(16), self.VERSION, SERVER_LIST_REQUEST_CODE, None)
+        response = await self.send_auth_server_request(request, bytes, True)
+        if response.code != MESSAGE_SERVER_LIST_RESPONSE_CODE:
+            raise RuntimeError(f'Error {response.code} - Could not fetch servers list!')
+        return Client.parse_message_servers_text('' if response.payload is None else response.payload.decode('utf-8'))
+
+    def select_message_server(self, server):
+        """
+        :param server: a (server_id bytes, name, ip address, port) tuple, as returned by get_message_servers
+        """
+        self.message_server_id, self.message_server_name, self.message_server_ip, self.message_server_port = server
+        self.session_key = None
+        self.packed_ticket = None
+
+    async def open_session(self, server=None):
+        """
+        Gets a session key and ticket for a message server and authenticates with it
+        :param server: the (server_id bytes, name, ip address, port) tuple of the server, or None for the selected one
+        """
+        async with self.session_lock:
+            if server is not None:
+                self.select_message_server(server)
+            await self.get_key_and_ticket()
+            await self.send_ticket_to_message_server()
+
+    async def get_key_and_ticket(self):
+        if self.client_id is None:
+            raise RuntimeError('The client is not registered or logged in!')
+        if self.message_server_id is None:
+            raise RuntimeError('No message server is selected!')
+        nonce = generate_nonce_bytes()
+        request = ClientRequest(self.client_id, self.VERSION, SESSION_KEY_AND_TICKET_REQUEST_CODE,
+                                SessionKeyAndTicketRequest(self.message_server_id, nonce))
+        response = await self.send_auth_server_request(request, KeyAndTokenResponse, True)
+        if response.code != SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE:
+            raise RuntimeError(f'Error {response.code} - Could not get session key!')
+        self.session_key = decrypt_session_key(self.password_hash, response.payload, nonce)
+        self.packed_ticket = response.payload.ticket
+
+    async def send_ticket_to_message_server(self):
+        if self.packed_ticket is None:
+            raise RuntimeError('There is no ticket for the message server - call get_key_and_ticket first!')
+        request = create_authenticator_request(self.client_id, self.message_server_id, self.session_key,
+                                               self.packed_ticket)
+        response = await self.send_message_server_request(request)
+        if response.code != SESSION_KEY_ACCEPTED_RESPONSE_CODE:
+            raise RuntimeError(f'{self.message_server_name} did not respond with a success message!')
+
+    async def send_message_to_server(self, message):
+        await self.send_messages_to_server([message])
+
+    async def send_messages_to_server(self, messages):
+        """
+        Sends several messages to the selected message server. They are pipelined over the pooled connections,
+        so they may be delivered out of order.
+        :param messages: list of message strings
+        """
+        if self.session_key is None:
+            raise RuntimeError('There is no session with a message server - call open_session first!')
+        responses = await asyncio.gather(*(
+            self.send_message_server_request(create_message_request(self.client_id, self.session_key, message))
+            for message in messages))
+        for response in responses:
+            if response.code != MESSAGE_ACCEPTED_RESPONSE_CODE:
+                raise RuntimeError(f'{self.message_server_name} did not respond with a success message!')
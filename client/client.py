@@ -1,277 +1,591 @@
 import socket
+import threading
 from datetime import datetime
-from typing import cast
 
-from auth_server.auth_server import CLIENT_REGISTRATION_SUCCESS_CODE
-from common.cryptography_utils import sha256_hash, generate_nonce_bytes, decrypt_aes_cbc, encrypt_aes_cbc
+from common.cryptography_utils import sha256_hash, generate_nonce_bytes, encrypt_aes_cbc, encrypt_aes_cbc_fields, \
+    decrypt_aes_cbc_fields
 from common.date_utils import datetime_to_timestamp_bytes
-from common.file_utils import is_file_exists, read_file_lines, write_lines_to_file
+from common.framing_utils import read_server_response
+from common.logging_utils import get_logger, get_hot_path_logger
 from common.protocol.authenticator import Authenticator
 from common.protocol.client_request import ClientRequest
 from common.protocol.encrypted_session_key import EncryptedSessionKey
-from common.protocol.message_codes import CLIENT_REGISTRATION_CODE, SERVER_LIST_REQUEST_CODE, \
-    MESSAGE_SERVER_LIST_RESPONSE_CODE, SESSION_KEY_AND_TICKET_REQUEST_CODE, \
+from common.protocol.message_codes import CLIENT_REGISTRATION_CODE, CLIENT_REGISTRATION_SUCCESS_CODE, \
+    SERVER_LIST_REQUEST_CODE, MESSAGE_SERVER_LIST_RESPONSE_CODE, SESSION_KEY_AND_TICKET_REQUEST_CODE, \
     SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE, \
-    SESSION_KEY_ACCEPTED_RESPONSE_CODE, SEND_MESSAGE_REQUEST_CODE, MESSAGE_ACCEPTED_RESPONSE_CODE
+    SESSION_KEY_ACCEPTED_RESPONSE_CODE, SEND_MESSAGE_REQUEST_CODE, MESSAGE_ACCEPTED_RESPONSE_CODE, \
+    SERVER_LIST_PAGE_REQUEST_CODE, BINARY_SERVER_LIST_REQUEST_CODE, MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE, \
+    MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE, BATCH_SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, \
+    GENERAL_SERVER_ERROR_CODE
 from common.protocol.request_1024_user_registration import UserRegistrationRequest
 from common.protocol.request_1027_session_key import SessionKeyAndTicketRequest
 from common.protocol.request_1028_send_session_key import SendSessionKeyRequest
 from common.protocol.request_1029_send_message import SendMessageRequest
+from common.protocol.request_1030_server_list_page import ServerListPageRequest
+from common.protocol.request_1033_multi_server_session_key import MultiServerSessionKeyAndTicketRequest
 from common.protocol.response_1600_user_registration_success import UserRegistrationSuccessResponse
 from common.protocol.response_1603_key_and_token_success_response import KeyAndTokenResponse
+from common.protocol.response_1610_message_server_list import MessageServerListResponse
+from common.protocol.response_1611_batch_key_and_token import BatchKeyAndTokenResponse
 from common.protocol.server_response import ServerResponse
 from common.protocol.ticket import Ticket
 from common.string_utils import extract_substring_between
+from .ticket_cache import TicketCache
+
+logger = get_logger('client')
+# per-request logs, which may be sampled or turned off
+request_logger = get_hot_path_logger('client')
 
 
 class Client:
-    CONFIG_FILE = "me.info"
     VERSION = 24
-
-    def __init__(self):
+    DEFAULT_AUTH_SERVER_IP = '127.0.0.1'
+    DEFAULT_AUTH_SERVER_PORT = 1234
+    MAX_PIPELINED_REQUESTS = 64
+    # tickets are renewed this long before they expire
+    DEFAULT_RENEW_BEFORE_SECONDS = 60
+    # the renewal thread checks the ticket at least this often, in case the selected server changed
+    MAX_RENEWAL_CHECK_INTERVAL_SECONDS = 10
+    # the auth server's max server list page size
+    MAX_SERVER_LIST_PAGE_SIZE = 1000
+
+    def __init__(self, auth_server_ip=DEFAULT_AUTH_SERVER_IP, auth_server_port=DEFAULT_AUTH_SERVER_PORT,
+                 timeout=None, ticket_cache=None, renew_before_seconds=DEFAULT_RENEW_BEFORE_SECONDS):
+        """
+        The Kerberos client library. It does not interact with the user - the interactive client (ClientCli) and
+        services embedding the client call it the same way:
+            client = Client('127.0.0.1', 1234)
+            client.register(name, password)    # or client.log_in(name, client_id, password)
+            client.open_session(client.get_message_servers()[0])
+            client.send_messages_to_server(['hello', 'world'])
+            client.close()
+        Failed requests raise RuntimeError, or OSError for network errors.
+        A client is a single identity talking to one message server at a time. Its methods may be called from
+        several threads - the session with the message server is guarded by a lock, so concurrent sends share its
+        connection one at a time. Use a client per thread (or asyncio.to_thread) to send in parallel.
+        The tickets are kept in a TicketCache by message server, so switching back to a server reuses its ticket
+        and session. Once a session is open, a background thread renews the selected server's ticket
+        renew_before_seconds before it expires, so sending needs no requests to the auth server.
+        :param auth_server_ip: the auth server address
+        :param auth_server_port: the auth server port
+        :param timeout: socket timeout in seconds, None to block
+        :param ticket_cache: the TicketCache, a new in-memory one by default. Pass one with a file path to keep the
+        tickets across runs.
+        :param renew_before_seconds: how long before the ticket expires it is renewed, None to not renew tickets in
+        the background
+        """
         self.nonce = None
         self.client_id = None
         self.password_hash = None
         self.name = None
-        self.auth_server_ip = None
-        self.auth_server_port = None
+        self.auth_server_ip = auth_server_ip
+        self.auth_server_port = auth_server_port
+        self.timeout = timeout
         self.message_server_name = None
         self.message_server_id = None
         self.message_server_ip = None
         self.message_server_port = None
         self.session_key = None
         self.packed_ticket = None
-
-        self.start_client()
-
-    def initialize_without_config(self):
-        name = input("Please enter your name (or 'exit' to quit): ")
-        if name == 'exit':
-            print('Exiting the client.')
-            exit(0)
+        self.message_server_socket = None
+        self.auth_server_socket = None
+        # guards the auth server connection, which the ticket renewal thread shares
+        self.auth_server_lock = threading.RLock()
+        self.ticket_cache = ticket_cache if ticket_cache is not None else TicketCache()
+        if renew_before_seconds is not None and renew_before_seconds >= self.ticket_cache.ticket_lifetime_seconds:
+            raise ValueError('Tickets must be renewed less than their lifetime before they expire!')
+        self.renew_before_seconds = renew_before_seconds
+        self.renewal_thread = None
+        self.renewal_stopped = threading.Event()
+        # guards the message server selection, session key and connection
+        self.session_lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_auth_server(self, auth_server_ip, auth_server_port):
+        self.close_auth_server_connection()
+        self.auth_server_ip = auth_server_ip
+        self.auth_server_port = auth_server_port
+
+    def log_in(self, name, client_id, password):
+        """
+        Sets the credentials of an already registered client
+        :param name: the client name
+        :param client_id: the client id bytes the auth server assigned on registration
+        :param password: the client password
+        """
         self.name = name
-        password = input("Please enter a password (or 'exit' to quit): ")
-        if password == 'exit':
-            print('Exiting the client.')
-            exit(0)
-        self.password_hash = sha256_hash(password.encode('utf-8'))
-        self.register_client(name, password)
-
-    def initialize_with_me_info_file(self):
-        lines = read_file_lines(self.CONFIG_FILE)
-        if len(lines) != 2:
-            raise RuntimeError('me.info does not contain 2 lines!')
-        self.name = lines[0]
-        self.client_id = bytes.fromhex(lines[1])
-        password = input(f"Hello {self.name}!\nPlease enter a password (or 'exit' to quit): ")
-        if password == 'exit':
-            print('Exiting the client.')
-            exit(0)
+        self.client_id = client_id
         self.password_hash = sha256_hash(password.encode('utf-8'))
-
-    def start_client(self):
-        self.set_auth_server()
-
-        if is_file_exists(self.CONFIG_FILE):
-            self.initialize_with_me_info_file()
+        self.ticket_cache.load(client_id, self.password_hash)
+
+    def send_auth_server_request(self, request):
+        """
+        Sends a request to the auth server over the auth server connection, which is kept open and reused by the
+        next requests. If the server closed the connection (e.g. after being idle), the client reconnects once and
+        resends the request.
+        :param request: a ClientRequest
+        :return: the raw response bytes, or None if the auth server closed the connection without responding
+        """
+        packed_request = request.pack()
+        with self.auth_server_lock:
+            for reconnected in (False, True):
+                if self.auth_server_socket is None:
+                    self.auth_server_socket = socket.create_connection(
+                        (self.auth_server_ip, self.auth_server_port), self.timeout)
+                try:
+                    self.auth_server_socket.sendall(packed_request)
+                    response_bytes = read_server_response(self.auth_server_socket)
+                except OSError as e:
+                    self.close_auth_server_connection()
+                    if reconnected or not isinstance(e, ConnectionError):
+                        raise
+                    continue
+                if response_bytes is not None:
+                    return response_bytes
+                self.close_auth_server_connection()
+            return None
+
+    def close_auth_server_connection(self):
+        with self.auth_server_lock:
+            if self.auth_server_socket is not None:
+                request_logger.info("Closing the auth server connection from client side")
+                self.auth_server_socket.close()
+                self.auth_server_socket = None
+
+    def register(self, name, password):
+        """
+        Registers a new client with the auth server and logs in as it
+        :return: the client id assigned by the auth server
+        """
+        payload = UserRegistrationRequest(name, password)
+        request = ClientRequest(bytes(16), self.VERSION, CLIENT_REGISTRATION_CODE, payload)
+        request_logger.info('Client registration request sent!')
+        response_bytes = self.send_auth_server_request(request)
+        if response_bytes is None:
+            raise RuntimeError('The auth server closed the connection - user creation failed!')
+
+        response = ServerResponse.unpack(response_bytes, UserRegistrationSuccessResponse)
+        if response.code != CLIENT_REGISTRATION_SUCCESS_CODE:
+            raise RuntimeError(f'Error {response.code} - User creation failed!')
+        logger.info('User created - ID: %s', response.payload.client_id.hex())
+        self.log_in(name, response.payload.client_id, password)
+        return self.client_id
+
+    def list_message_servers(self, offset=None, limit=None, name_filter=''):
+        """
+        Fetches the message servers list from the auth server.
+        If offset and limit are passed, only that page of the servers whose name contains name_filter is fetched.
+        :return: the servers list text
+        """
+        if offset is None and limit is None and not name_filter:
+            request = ClientRequest(bytes(16), self.VERSION, SERVER_LIST_REQUEST_CODE, bytes(0))
         else:
-            self.initialize_without_config()
-
-        self.select_message_server()
-        self.get_key_and_ticket()
-        self.send_ticket_to_message_server()
-
+            payload = ServerListPageRequest(offset or 0, limit or self.MAX_SERVER_LIST_PAGE_SIZE, name_filter)
+            request = ClientRequest(bytes(16), self.VERSION, SERVER_LIST_PAGE_REQUEST_CODE, payload)
+        request_logger.info('Message servers list request sent!')
+        response_bytes = self.send_auth_server_request(request)
+        if response_bytes is None:
+            raise RuntimeError('The auth server closed the connection - could not fetch servers list!')
+
+        response = ServerResponse.unpack(response_bytes, bytes)
+        if response.code != MESSAGE_SERVER_LIST_RESPONSE_CODE:
+            raise RuntimeError(f'Error {response.code} - Could not fetch servers list!')
+        if response.payload is None:
+            return ''
+        return response.payload.decode('utf-8')
+
+    def list_message_servers_binary(self, offset=None, limit=None, name_filter=''):
+        """
+        Fetches the message servers list in the binary records format.
+        If offset and limit are passed, only that page of the servers whose name contains name_filter is fetched.
+        Otherwise the whole list is fetched a page of MAX_SERVER_LIST_PAGE_SIZE servers at a time, so a large fleet
+        never needs a response frame over the max payload size.
+        :return: list of (server_id bytes, name, ip address, port) tuples,
+        or None if the auth server does not support the binary list
+        """
+        if offset is not None or limit is not None:
+            return self.request_message_servers_page(offset or 0, limit or self.MAX_SERVER_LIST_PAGE_SIZE,
+                                                     name_filter)
+        servers = []
         while True:
-            print('\nSelect an action:\n1) Send message to server\n2) Select another server\n3) Exit program')
-            actions = int(input())
-
-            if actions == 1:
-                print('Enter your message:\n')
-                message = input()
-                self.send_message_to_server(message)
-
-            elif actions == 2:
-                self.select_message_server()
-                self.get_key_and_ticket()
-                self.send_ticket_to_message_server()
-            elif actions == 3:
-                print('Exiting the client.')
-                break
-
-            # Process the user input (add your logic here)
-            # TODO    process_command(message)
-
-    def set_auth_server(self):
-        self.auth_server_ip = '127.0.0.1'
-        self.auth_server_port = 1234
-
-    def register_client(self, name, password):
-        # Create a socket object
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((self.auth_server_ip, self.auth_server_port))
-
-        try:
-            payload = UserRegistrationRequest(name, password)
-            request = ClientRequest(bytearray(16), 24, CLIENT_REGISTRATION_CODE, payload)
-            client_socket.send(request.pack())
-            print('Client registration request sent!')
-            # Receive and print the response
-            response_bytes = client_socket.recv(1024)
-
-            response = ServerResponse.unpack(response_bytes, UserRegistrationSuccessResponse)
-            if response.code == CLIENT_REGISTRATION_SUCCESS_CODE:
-                print(f'User created - ID: {response.payload.client_id.hex()}')
-                self.client_id = response.payload.client_id
-                write_lines_to_file(self.CONFIG_FILE, [self.name, self.client_id.hex()])
-            else:
-                print(f'Error {response.code} - User creation failed!')
-
-        finally:
-            # Close the socket
-            print('Closing the connection from client side')
-            client_socket.close()
-
-    def list_message_servers(self):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((self.auth_server_ip, self.auth_server_port))
-        message_servers = ''
-        try:
-            payload = bytes(0)
-            request = ClientRequest(bytearray(16), 24, SERVER_LIST_REQUEST_CODE, payload)
-            client_socket.send(request.pack())
-            print('Message servers list request sent!')
-            # Receive and the response (which can be long)
-            received_data_bytes = b''
-            while True:
-                chunk = client_socket.recv(1024)
-                received_data_bytes += chunk
-                if len(chunk) < 1024:
-                    break
-
-            response = ServerResponse.unpack(received_data_bytes, bytes)
-            if response.code == MESSAGE_SERVER_LIST_RESPONSE_CODE:
-                message_servers = response.payload.decode('utf-8')
-
-            else:
-                print(f'Error {response.code} - Could not fetch servers list!')
-
-        finally:
-            # Close the socket
-            print("Closing the connection from client side")
-            client_socket.close()
-            return message_servers
-
-    def select_message_server(self):
-        message_servers = self.list_message_servers()
-
-        if len(message_servers) == 0:
-            print('There are no registered message servers!')
-            exit(1)
-        else:
-            print('Message servers:\n')
-            print(message_servers)
-
-        lines = message_servers.split('\n')
+            page = self.request_message_servers_page(len(servers), self.MAX_SERVER_LIST_PAGE_SIZE, name_filter)
+            if page is None:
+                return None
+            servers.extend(page)
+            if len(page) < self.MAX_SERVER_LIST_PAGE_SIZE:
+                return servers
+
+    def request_message_servers_page(self, offset, limit, name_filter):
+        """
+        :return: a page of the binary servers list, or None if the auth server does not support the binary list
+        """
+        payload = ServerListPageRequest(offset, limit, name_filter)
+        request = ClientRequest(bytes(16), self.VERSION, BINARY_SERVER_LIST_REQUEST_CODE, payload)
+        request_logger.info('Message servers binary list request sent!')
+        response_bytes = self.send_auth_server_request(request)
+        if response_bytes is None:
+            logger.info('The auth server closed the connection - it does not support the binary servers list')
+            return None
+        response = ServerResponse.unpack(response_bytes, MessageServerListResponse)
+        if response.code == GENERAL_SERVER_ERROR_CODE:
+            logger.info('Error %d - the auth server does not support the binary servers list', response.code)
+            return None
+        if response.code != MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE:
+            raise RuntimeError(f'Error {response.code} - Could not fetch servers list!')
+        if response.payload is None:
+            return []
+        return response.payload.servers
+
+    def get_message_servers(self, offset=None, limit=None, name_filter=''):
+        """
+        Fetches the message servers list, in the binary format if the auth server supports it
+        :return: list of (server_id bytes, name, ip address, port) tuples
+        """
+        servers = self.list_message_servers_binary(offset, limit, name_filter)
+        if servers is None:
+            servers = self.parse_message_servers_text(self.list_message_servers(offset, limit, name_filter))
+        return servers
+
+    @staticmethod
+    def parse_message_servers_text(message_servers):
+        """
+        Parses the text servers list returned by auth servers that do not support the binary list
+        :return: list of (server_id bytes, name, ip address, port) tuples
+        """
         servers = []
-        for line in lines:
+        for line in message_servers.split('\n'):
             if not bool(line):
                 break
             name = extract_substring_between(line, ') ', ' ID:')
             server_id = extract_substring_between(line, 'ID: ', " at:")
             ip_address = extract_substring_between(line, ' at: ', ':')
             port = int((line[line.rfind(':') + 1:len(line)]))
-            servers.append((name, server_id, ip_address, port))
-
-        server_index = int(input("Please select a server from the list: "))
-        server = servers[server_index - 1]
-        self.message_server_name = server[0]
-        self.message_server_id = bytes.fromhex(server[1])
-        self.message_server_ip = server[2]
-        self.message_server_port = server[3]
-        print(f'Selected {self.message_server_name}')
-
-    def get_key_and_ticket(self):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((self.auth_server_ip, self.auth_server_port))
-        try:
-            self.nonce = generate_nonce_bytes()
-            payload = SessionKeyAndTicketRequest(self.message_server_id, self.nonce)
-            request = ClientRequest(self.client_id, 24, SESSION_KEY_AND_TICKET_REQUEST_CODE, payload)
-            client_socket.send(request.pack())
-            print(f'Session key and ticket request for communication with {self.message_server_name} sent!')
-            response_bytes = client_socket.recv(1024)
-
-            response = ServerResponse.unpack(response_bytes, KeyAndTokenResponse)
-            if response.code != SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE:
-                raise RuntimeError(f'Error {response.code} - Could not get session key!')
-
-            response_payload = cast(KeyAndTokenResponse, response.payload)
-            encrypted_key = EncryptedSessionKey.unpack(response_payload.session_key)
-            packed_ticket = response_payload.ticket
-            iv = encrypted_key.iv
-            self.session_key = decrypt_aes_cbc(self.password_hash, encrypted_key.session_key, iv)
-            nonce = decrypt_aes_cbc(self.password_hash, encrypted_key.nonce, iv)
-            if self.nonce != nonce:
-                raise RuntimeError(f'Received nonce is incorrect')
+            servers.append((bytes.fromhex(server_id), name, ip_address, port))
+        return servers
+
+    def select_message_server(self, server):
+        """
+        Selects the message server the next sessions are opened with, closing the connection to the previous one
+        :param server: a (server_id bytes, name, ip address, port) tuple, as returned by get_message_servers
+        """
+        server_id, name, ip_address, port = server
+        with self.session_lock:
+            self.close_message_server_connection()
+            self.message_server_name = name
+            self.message_server_id = server_id
+            self.message_server_ip = ip_address
+            self.message_server_port = port
+            self.session_key = None
+            self.packed_ticket = None
+        logger.info('Selected %s', name)
+
+    def open_session(self, server=None):
+        """
+        Opens a session with a message server. A cached ticket that is not about to expire is reused - if the
+        server already accepted it, no request is sent at all. Otherwise a new session key and ticket are
+        requested from the auth server, and the ticket is sent to the message server.
+        :param server: the (server_id bytes, name, ip address, port) tuple of the server, or None for the selected one
+        """
+        with self.session_lock:
+            if server is not None:
+                self.select_message_server(server)
+            ticket = self.ticket_cache.get(self.message_server_id, self.renew_before_seconds or 0)
+            if ticket is None:
+                self.get_key_and_ticket()
+                self.send_ticket_to_message_server()
             else:
-                print(f'Nonce verified!')
+                request_logger.info('Reusing the cached ticket for %s', self.message_server_name)
+                self.session_key = ticket.session_key
+                self.packed_ticket = ticket.packed_ticket
+                if not ticket.authenticated:
+                    try:
+                        self.send_ticket_to_message_server()
+                    except RuntimeError:
+                        # the server does not accept the cached ticket anymore, e.g. as it got a new key
+                        self.get_key_and_ticket()
+                        self.send_ticket_to_message_server()
+        self.start_ticket_renewal()
+
+    def request_key_and_ticket(self, message_server_id):
+        """
+        Requests a session key and ticket for a message server from the auth server
+        :return: a tuple of the session key and the packed ticket
+        """
+        if self.client_id is None:
+            raise RuntimeError('The client is not registered or logged in!')
+        nonce = generate_nonce_bytes()
+        payload = SessionKeyAndTicketRequest(message_server_id, nonce)
+        request = ClientRequest(self.client_id, self.VERSION, SESSION_KEY_AND_TICKET_REQUEST_CODE, payload)
+        request_logger.info('Session key and ticket request for communication with %s sent!', message_server_id.hex())
+        response_bytes = self.send_auth_server_request(request)
+        if response_bytes is None:
+            raise RuntimeError('The auth server closed the connection - could not get session key!')
+
+        response = ServerResponse.unpack(response_bytes, KeyAndTokenResponse)
+        if response.code != SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE:
+            raise RuntimeError(f'Error {response.code} - Could not get session key!')
+
+        session_key = decrypt_session_key(self.password_hash, response.payload, nonce)
+        request_logger.info('Nonce verified!')
+        return session_key, response.payload.ticket
+
+    def prefetch_tickets(self, servers):
+        """
+        Gets session keys and tickets for several message servers in a single request to the auth server, and adds
+        them to the ticket cache, so opening sessions with the servers only sends them the tickets. Servers with a
+        cached ticket that is not about to expire are skipped.
+        :param servers: list of (server_id bytes, name, ip address, port) tuples
+        :return: the servers the auth server could not issue a ticket for, e.g. as they are unknown to it
+        """
+        servers = [server for server in servers
+                   if self.ticket_cache.get(server[0], self.renew_before_seconds or 0) is None]
+        if len(servers) == 0:
+            return []
+        if self.client_id is None:
+            raise RuntimeError('The client is not registered or logged in!')
+        nonce = generate_nonce_bytes()
+        payload = MultiServerSessionKeyAndTicketRequest([server_id for server_id, _, _, _ in servers], nonce)
+        request = ClientRequest(self.client_id, self.VERSION, MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE,
+                                payload)
+        request_logger.info('Session key and ticket request for %d message servers sent!', len(servers))
+        response_bytes = self.send_auth_server_request(request)
+        if response_bytes is None:
+            raise RuntimeError('The auth server closed the connection - could not get session keys!')
+
+        response = ServerResponse.unpack(response_bytes, BatchKeyAndTokenResponse)
+        if response.code != BATCH_SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE:
+            raise RuntimeError(f'Error {response.code} - Could not get session keys!')
+        key_and_token_responses = response.payload.key_and_token_responses
+        if len(key_and_token_responses) != len(servers):
+            raise RuntimeError(f'Received {len(key_and_token_responses)} tickets for {len(servers)} servers!')
+
+        failed_servers = []
+        tickets = []
+        for server, key_and_token_response in zip(servers, key_and_token_responses):
+            if key_and_token_response is None:
+                failed_servers.append(server)
+                continue
+            session_key = decrypt_session_key(self.password_hash, key_and_token_response, nonce)
+            tickets.append((server, session_key, key_and_token_response.ticket))
+        self.ticket_cache.put_many(tickets)
+        logger.info('Received session keys and tickets for %d message servers from the auth server!',
+                    len(servers) - len(failed_servers))
+        return failed_servers
 
+    def get_key_and_ticket(self):
+        """
+        Gets a new session key and ticket for the selected message server, and adds them to the ticket cache
+        """
+        with self.session_lock:
+            if self.message_server_id is None:
+                raise RuntimeError('No message server is selected!')
+            self.session_key, self.packed_ticket = self.request_key_and_ticket(self.message_server_id)
+            self.ticket_cache.put(self.selected_message_server(), self.session_key, self.packed_ticket)
+            logger.info('Received a session key and ticket from the auth server!')
+
+    def selected_message_server(self):
+        return self.message_server_id, self.message_server_name, self.message_server_ip, self.message_server_port
+
+    def start_ticket_renewal(self):
+        if self.renew_before_seconds is None or self.renewal_thread is not None:
+            return
+        self.renewal_thread = threading.Thread(target=self.renew_tickets, name='ticket-renewal', daemon=True)
+        self.renewal_thread.start()
+
+    def renew_tickets(self):
+        """
+        Renews the selected message server's ticket renew_before_seconds before it expires, until the client is
+        closed. The tickets of the other servers are renewed when they are selected again.
+        """
+        while True:
+            wait_seconds = self.MAX_RENEWAL_CHECK_INTERVAL_SECONDS
+            ticket = None
+            if self.session_key is not None:
+                ticket = self.ticket_cache.get(self.message_server_id)
+            if ticket is not None:
+                wait_seconds = min(wait_seconds, max(0, ticket.remaining_seconds() - self.renew_before_seconds))
+            if self.renewal_stopped.wait(wait_seconds):
+                return
+            try:
+                self.renew_ticket()
+            except (RuntimeError, OSError) as e:
+                logger.warning('Could not renew the ticket for %s: %s', self.message_server_name, e)
+                if self.renewal_stopped.wait(self.MAX_RENEWAL_CHECK_INTERVAL_SECONDS):
+                    return
+
+    def renew_ticket(self):
+        """
+        Replaces the selected server's ticket with a new one and authenticates with it, if the ticket expires
+        within renew_before_seconds
+        """
+        server = self.selected_message_server()
+        ticket = self.ticket_cache.get(server[0], self.renew_before_seconds)
+        if server[0] is None or self.session_key is None or ticket is not None:
+            return
+        # requested before taking the lock, so sending is not blocked on the auth server
+        session_key, packed_ticket = self.request_key_and_ticket(server[0])
+        with self.session_lock:
+            if self.selected_message_server() != server:
+                return
+            self.ticket_cache.put(server, session_key, packed_ticket)
+            self.session_key = session_key
             self.packed_ticket = packed_ticket
-            print(f'Received a session key {self.session_key.hex()} and ticket from the auth server!')
-        except ValueError as e:
-            print(f'{type(e)} {e} - are you sure you typed the correct password?')
-        finally:
-            # Close the socket
-            print("Closing the connection from client side")
-            client_socket.close()
+            self.send_ticket_to_message_server()
+        logger.info('Renewed the ticket for %s', server[1])
+
+    def connect_to_message_server(self):
+        """
+        Returns the open connection to the selected message server, connecting if there is none.
+        The connection is kept open and reused by all the requests sent to that server.
+        :return: a connected socket
+        """
+        if self.message_server_socket is None:
+            self.message_server_socket = socket.create_connection((self.message_server_ip, self.message_server_port),
+                                                                  self.timeout)
+        return self.message_server_socket
+
+    def close_message_server_connection(self):
+        with self.session_lock:
+            if self.message_server_socket is not None:
+                request_logger.info("Closing the connection from client side")
+                self.message_server_socket.close()
+                self.message_server_socket = None
+
+    def close(self):
+        self.renewal_stopped.set()
+        self.close_message_server_connection()
+        self.close_auth_server_connection()
+
+    def send_requests_to_message_server(self, packed_requests):
+        """
+        Sends the requests over the message server connection and returns the responses in the same order.
+        Up to MAX_PIPELINED_REQUESTS requests are sent before waiting for their responses.
+        If the server closed the connection (e.g. after being idle), the client reconnects once and resends the
+        requests that were not answered.
+        :param packed_requests: list of packed ClientRequest bytes
+        :return: list of ServerResponse objects with raw bytes payloads
+        """
+        responses = []
+        reconnected = False
+        with self.session_lock:
+            while len(responses) < len(packed_requests):
+                client_socket = self.connect_to_message_server()
+                try:
+                    pending = 0
+                    next_request = len(responses)
+                    while len(responses) < len(packed_requests):
+                        while next_request < len(packed_requests) and pending < self.MAX_PIPELINED_REQUESTS:
+                            client_socket.sendall(packed_requests[next_request])
+                            next_request += 1
+                            pending += 1
+
+                        response_bytes = read_server_response(client_socket)
+                        if response_bytes is None:
+                            raise ConnectionError('The message server closed the connection')
+                        responses.append(ServerResponse.unpack(response_bytes, bytes))
+                        pending -= 1
+
+                except ConnectionError:
+                    self.close_message_server_connection()
+                    if reconnected:
+                        raise
+                    reconnected = True
+
+        return responses
 
     def send_ticket_to_message_server(self):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((self.message_server_ip, self.message_server_port))
-        try:
-            encrypted_version, iv = encrypt_aes_cbc(self.session_key, self.VERSION.to_bytes(), None)
-            encrypted_client_id, _ = encrypt_aes_cbc(self.session_key, self.client_id, iv)
-            encrypted_server_id, _ = encrypt_aes_cbc(self.session_key, self.message_server_id, iv)
-            now = datetime.now()
-            creation_time_bytes = datetime_to_timestamp_bytes(now)
-            encrypted_creation_time, _ = encrypt_aes_cbc(self.session_key, creation_time_bytes, iv)
-            authenticator_bytes = Authenticator(iv, encrypted_version, encrypted_client_id, encrypted_server_id,
-                                                encrypted_creation_time).pack()
-            print(f'Authenticator created at {now}.')
-            payload = SendSessionKeyRequest(authenticator_bytes, self.packed_ticket)
-            request = ClientRequest(self.client_id, self.VERSION, SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE, payload)
-            client_socket.send(request.pack())
-            print(
-                f'Sent ticket to message server {self.message_server_name} at {self.message_server_ip}:{self.message_server_port}!')
-            response_bytes = client_socket.recv(1024)
-            response = ServerResponse.unpack(response_bytes, bytes)
-            if response.code == SESSION_KEY_ACCEPTED_RESPONSE_CODE:
-                print(f'{self.message_server_name} approved receiving the session key!')
-            else:
+        with self.session_lock:
+            if self.packed_ticket is None:
+                raise RuntimeError('There is no ticket for the message server - call get_key_and_ticket first!')
+            request = create_authenticator_request(self.client_id, self.message_server_id, self.session_key,
+                                                   self.packed_ticket)
+            response = self.send_requests_to_message_server([request.pack()])[0]
+            request_logger.info('Sent ticket to message server %s at %s:%d!', self.message_server_name,
+                                self.message_server_ip, self.message_server_port)
+            if response.code != SESSION_KEY_ACCEPTED_RESPONSE_CODE:
+                self.ticket_cache.remove(self.message_server_id)
                 raise RuntimeError(f'{self.message_server_name} did not respond with a success message!')
-        finally:
-            # Close the socket
-            print("Closing the connection from client side")
-            client_socket.close()
+            ticket = self.ticket_cache.get(self.message_server_id)
+            if ticket is not None and ticket.packed_ticket == self.packed_ticket:
+                ticket.authenticated = True
+            logger.info('%s approved receiving the session key!', self.message_server_name)
 
     def send_message_to_server(self, message):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((self.message_server_ip, self.message_server_port))
-        try:
-            print(f'Sending message to {self.message_server_name}')
-            encrypted_message, message_iv = encrypt_aes_cbc(self.session_key, message.encode('utf-8'), None)
-            payload = SendMessageRequest(message_iv, encrypted_message)
-            request = ClientRequest(self.client_id, self.VERSION, SEND_MESSAGE_REQUEST_CODE, payload)
-            client_socket.send(request.pack())
-
-            response_bytes = client_socket.recv(1024)
-            response = ServerResponse.unpack(response_bytes, bytes)
-            if response.code == MESSAGE_ACCEPTED_RESPONSE_CODE:
-                print(f'{self.message_server_name} approved receiving, decrypting and printing the message!')
-            else:
+        self.send_messages_to_server([message])
+
+    def send_messages_to_server(self, messages):
+        """
+        Sends several messages to the selected message server, pipelined over a single connection.
+        If the server rejects messages because it no longer holds the session (e.g. it was restarted, or the session
+        was evicted), the client authenticates again with its ticket - or a new one if it expired - and resends them.
+        :param messages: list of message strings
+        """
+        with self.session_lock:
+            if self.session_key is None:
+                raise RuntimeError('There is no session with a message server - call open_session first!')
+            request_logger.info('Sending %d message(s) to %s', len(messages), self.message_server_name)
+            responses = self.send_requests_to_message_server(
+                [create_message_request(self.client_id, self.session_key, message).pack() for message in messages])
+            rejected_messages = [message for message, response in zip(messages, responses)
+                                 if response.code != MESSAGE_ACCEPTED_RESPONSE_CODE]
+            if len(rejected_messages) > 0:
+                request_logger.info('%s rejected %d message(s), authenticating again', self.message_server_name,
+                                    len(rejected_messages))
+                ticket = self.ticket_cache.get(self.message_server_id)
+                if ticket is not None:
+                    ticket.authenticated = False
+                self.open_session()
+                responses = self.send_requests_to_message_server(
+                    [create_message_request(self.client_id, self.session_key, message).pack()
+                     for message in rejected_messages])
+        for response in responses:
+            if response.code != MESSAGE_ACCEPTED_RESPONSE_CODE:
                 raise RuntimeError(f'{self.message_server_name} did not respond with a success message!')
-
-        finally:
-            # Close the socket
-            print("Closing the connection from client side")
-            client_socket.close()
+        logger.info('%s approved receiving, decrypting and printing the message!', self.message_server_name)
+
+
+def decrypt_session_key(password_hash, key_and_token_response, nonce):
+    """
+    Decrypts the session key the auth server encrypted with the client's password hash
+    :param password_hash: the client's password hash
+    :param key_and_token_response: the KeyAndTokenResponse of the session key and ticket request
+    :param nonce: the nonce sent in the request
+    :return: the session key
+    """
+    encrypted_key = EncryptedSessionKey.unpack(key_and_token_response.session_key)
+    try:
+        session_key, received_nonce = decrypt_aes_cbc_fields(
+            password_hash, [encrypted_key.session_key, encrypted_key.nonce], encrypted_key.iv)
+    except ValueError as e:
+        raise RuntimeError('Could not decrypt the session key - is the password correct?') from e
+    if received_nonce != nonce:
+        raise RuntimeError(f'Received nonce is incorrect')
+    return session_key
+
+
+def create_authenticator_request(client_id, message_server_id, session_key, packed_ticket):
+    """
+    :return: the ClientRequest that sends the ticket and a new authenticator to the message server
+    """
+    now = datetime.now()
+    encrypted_fields, iv = encrypt_aes_cbc_fields(
+        session_key, [Client.VERSION.to_bytes(), client_id, message_server_id, datetime_to_timestamp_bytes(now)], None)
+    authenticator_bytes = Authenticator(iv, *encrypted_fields).pack()
+    request_logger.info('Authenticator created at %s.', now)
+    payload = SendSessionKeyRequest(authenticator_bytes, packed_ticket)
+    return ClientRequest(client_id, Client.VERSION, SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE, payload)
+
+
+def create_message_request(client_id, session_key, message):
+    """
+    :param message: the message string
+    :return: the ClientRequest that sends the message encrypted with the session key
+    """
+    encrypted_message, message_iv = encrypt_aes_cbc(session_key, message.encode('utf-8'), None)
+    return ClientRequest(client_id, Client.VERSION, SEND_MESSAGE_REQUEST_CODE,
+                         SendMessageRequest(message_iv, encrypted_message))
@@ -0,0 +1,93 @@
+from client.client import Client
+from common.file_utils import is_file_exists, read_file_lines, write_lines_to_file
+from common.logging_utils import get_logger
+
+logger = get_logger('client')
+
+
+class ClientCli:
+    CONFIG_FILE = "me.info"
+
+    def __init__(self, client: Client, config_file=CONFIG_FILE):
+        """
+        The interactive client. Prompts the user for their credentials, the message server and the messages, and
+        runs them through the Client library.
+        :param client: the Client that talks to the servers
+        :param config_file: the file the client's name and id are saved in after registering
+        """
+        self.client = client
+        self.config_file = config_file
+
+    @staticmethod
+    def prompt(text):
+        """
+        :return: the user's input, or None if the user entered 'exit'
+        """
+        answer = input(text)
+        if answer == 'exit':
+            print('Exiting the client.')
+            return None
+        return answer
+
+    def initialize_without_config(self):
+        name = self.prompt("Please enter your name (or 'exit' to quit): ")
+        if name is None:
+            return False
+        password = self.prompt("Please enter a password (or 'exit' to quit): ")
+        if password is None:
+            return False
+        self.client.register(name, password)
+        write_lines_to_file(self.config_file, [name, self.client.client_id.hex()])
+        return True
+
+    def initialize_with_me_info_file(self):
+        lines = read_file_lines(self.config_file)
+        if len(lines) != 2:
+            raise RuntimeError(f'{self.config_file} does not contain 2 lines!')
+        name = lines[0]
+        password = self.prompt(f"Hello {name}!\nPlease enter a password (or 'exit' to quit): ")
+        if password is None:
+            return False
+        self.client.log_in(name, bytes.fromhex(lines[1]), password)
+        return True
+
+    def select_message_server(self):
+        servers = self.client.get_message_servers()
+        if len(servers) == 0:
+            print('There are no registered message servers!')
+            return False
+
+        print('Message servers:\n')
+        for i, (server_id, name, ip_address, port) in enumerate(servers, start=1):
+            print(f'{i}) {name} ID: {server_id.hex()} at: {ip_address}:{port}')
+        server_index = int(input("Please select a server from the list: "))
+        self.client.open_session(servers[server_index - 1])
+        return True
+
+    def run(self):
+        try:
+            if is_file_exists(self.config_file):
+                initialized = self.initialize_with_me_info_file()
+            else:
+                initialized = self.initialize_without_config()
+            if not initialized or not self.select_message_server():
+                return
+
+            while True:
+                print('\nSelect an action:\n1) Send message to server\n2) Select another server\n3) Exit program')
+                actions = int(input())
+
+                if actions == 1:
+                    print('Enter your message:\n')
+                    message = input()
+                    self.client.send_message_to_server(message)
+                elif actions == 2:
+                    if not self.select_message_server():
+                        return
+                elif actions == 3:
+                    print('Exiting the client.')
+                    break
+        except RuntimeError as e:
+            logger.error('%s', e)
+        finally:
+            self.client.close()
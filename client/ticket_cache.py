@@ -0,0 +1,160 @@
+import os
+import struct
+import threading
+import time
+
+from common.cryptography_utils import encrypt_aes_cbc, decrypt_aes_cbc
+from common.date_utils import get_datetime_from_ts_bytes
+from common.logging_utils import get_logger
+from common.network_utils import ip_to_bytes, ip_from_bytes
+from common.protocol.ticket import Ticket, TICKET_LIFETIME_MINUTES
+
+DEFAULT_TICKET_LIFETIME_SECONDS = TICKET_LIFETIME_MINUTES * 60
+
+logger = get_logger('client.ticket_cache')
+
+
+class CachedTicket:
+    __slots__ = ('server', 'session_key', 'packed_ticket', 'expiration_timestamp', 'authenticated')
+
+    def __init__(self, server, session_key, packed_ticket, expiration_timestamp, authenticated=False):
+        """
+        A ticket for a message server and its session key
+        :param server: the (server_id bytes, name, ip address, port) tuple of the message server
+        :param session_key: the session key
+        :param packed_ticket: the packed Ticket, encrypted with the message server's key
+        :param expiration_timestamp: the time the ticket expires at
+        :param authenticated: whether the message server accepted the ticket, so it holds a session for it
+        """
+        self.server = server
+        self.session_key = session_key
+        self.packed_ticket = packed_ticket
+        self.expiration_timestamp = expiration_timestamp
+        self.authenticated = authenticated
+
+    def remaining_seconds(self, now=None):
+        return self.expiration_timestamp - (time.time() if now is None else now)
+
+
+class TicketCache:
+    # client id, then a record per ticket
+    HEADER_STRUCT = struct.Struct('<16s')
+    # server id, name, ip address, port, session key, ticket, expiration timestamp
+    RECORD_STRUCT = struct.Struct('<16s255s16sH32s121sd')
+
+    def __init__(self, file_path=None, ticket_lifetime_seconds=DEFAULT_TICKET_LIFETIME_SECONDS):
+        """
+        Holds a client's tickets by message server id, so switching back to a server reuses its ticket - and the
+        session the server holds for it - instead of requesting a new one.
+        If file_path is set, the tickets are kept in that file across runs, encrypted with the client's password
+        hash, and rewritten whenever tickets are added.
+        :param file_path: the file the tickets are persisted in, None to keep them in memory only
+        :param ticket_lifetime_seconds: the lifetime of the tickets issued by the auth server
+        """
+        self.file_path = file_path
+        self.ticket_lifetime_seconds = ticket_lifetime_seconds
+        # server id -> CachedTicket
+        self.tickets = dict()
+        self.lock = threading.Lock()
+        self.client_id = None
+        self.password_hash = None
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def load(self, client_id, password_hash):
+        """
+        Switches the cache to a client, loading its unexpired tickets from the file. Tickets of the previous client
+        are dropped. Tickets loaded from the file are not marked authenticated, as the message servers may have
+        dropped their sessions meanwhile.
+        """
+        with self.lock:
+            if client_id != self.client_id:
+                self.tickets.clear()
+            self.client_id = client_id
+            self.password_hash = password_hash
+            if self.file_path is None or not os.path.exists(self.file_path):
+                return
+            with open(self.file_path, 'rb') as file:
+                data = file.read()
+            try:
+                records = decrypt_aes_cbc(password_hash, data[16:], data[:16])
+            except ValueError:
+                logger.info('The tickets in %s are not of this client, ignoring them', self.file_path)
+                return
+            if records[:self.HEADER_STRUCT.size] != self.HEADER_STRUCT.pack(client_id):
+                logger.info('The tickets in %s are not of this client, ignoring them', self.file_path)
+                return
+
+            now = time.time()
+            for server_id, name, ip_address, port, session_key, packed_ticket, expiration_timestamp in \
+                    self.RECORD_STRUCT.iter_unpack(records[self.HEADER_STRUCT.size:]):
+                if expiration_timestamp > now:
+                    server = (server_id, name.rstrip(b'\x00').decode('utf-8'), ip_from_bytes(ip_address), port)
+                    self.tickets[server_id] = CachedTicket(server, session_key, packed_ticket, expiration_timestamp)
+            logger.info('Loaded %d tickets from %s', len(self.tickets), self.file_path)
+
+    def save(self):
+        """
+        Writes the unexpired tickets to the file, replacing it atomically. Called under the lock.
+        """
+        if self.file_path is None or self.password_hash is None:
+            return
+        now = time.time()
+        records = self.HEADER_STRUCT.pack(self.client_id) + b''.join(
+            self.RECORD_STRUCT.pack(server_id, name.encode('utf-8'), ip_to_bytes(ip_address), port,
+                                    ticket.session_key, ticket.packed_ticket, ticket.expiration_timestamp)
+            for ticket in self.tickets.values() if ticket.expiration_timestamp > now
+            for server_id, name, ip_address, port in (ticket.server,))
+        encrypted_records, iv = encrypt_aes_cbc(self.password_hash, records, None)
+        temporary_path = f'{self.file_path}.tmp'
+        file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, 'wb') as file:
+            file.write(iv + encrypted_records)
+        os.replace(temporary_path, self.file_path)
+
+    def put(self, server, session_key, packed_ticket):
+        """
+        Adds a new ticket, replacing the previous ticket of the server. Its expiration time is computed from the
+        creation time the auth server set in the ticket.
+        :return: the CachedTicket
+        """
+        return self.put_many([(server, session_key, packed_ticket)])[0]
+
+    def put_many(self, tickets):
+        """
+        Adds several new tickets like put, rewriting the file once for all of them
+        :param tickets: list of (server, session key, packed ticket) tuples
+        :return: the CachedTickets, in the order of tickets
+        """
+        cached_tickets = []
+        for server, session_key, packed_ticket in tickets:
+            creation_time = get_datetime_from_ts_bytes(Ticket.unpack(packed_ticket).creation_time)
+            cached_tickets.append(CachedTicket(server, session_key, packed_ticket,
+                                               creation_time.timestamp() + self.ticket_lifetime_seconds))
+        with self.lock:
+            for ticket in cached_tickets:
+                self.tickets[ticket.server[0]] = ticket
+            self.save()
+        return cached_tickets
+
+    def get(self, server_id, min_remaining_seconds=0, now=None):
+        """
+        :param min_remaining_seconds: tickets that expire sooner are not returned
+        :return: the CachedTicket of the server, or None if there is none that is valid long enough
+        """
+        with self.lock:
+            ticket = self.tickets.get(server_id)
+            if ticket is None:
+                return None
+            remaining_seconds = ticket.remaining_seconds(now)
+            if remaining_seconds <= 0:
+                del self.tickets[server_id]
+            if remaining_seconds <= min_remaining_seconds:
+                return None
+            return ticket
+
+    def remove(self, server_id):
+        with self.lock:
+            if self.tickets.pop(server_id, None) is not None:
+                self.save()
@@ -1,11 +1,142 @@
 import secrets
+import threading
 import traceback
+from collections import OrderedDict
 
 from Crypto.Cipher import AES
 from Crypto.Hash import SHA256
 from Crypto.Util.Padding import pad, unpad
 from Crypto.Random import get_random_bytes
 
+DEFAULT_MAX_CACHED_KEYS = 10000
+
+
+def xor_bytes(a, b):
+    """
+    XORs two equal length byte strings in a single big integer operation
+    """
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+
+class KeyCiphers:
+    def __init__(self, key):
+        """
+        A key-expanded AES-CBC encryptor and decryptor for a single key, reused for every IV.
+        A CBC cipher object continues the chain from the last ciphertext block it handled, so to start a field from
+        another IV the first block is XORed with (last block XOR IV) - which gives exactly the output of a new
+        AES.new(key, AES.MODE_CBC, iv), without expanding the key again.
+        :param key: the key bytes
+        """
+        self.lock = threading.Lock()
+        self.encryptor = AES.new(key, AES.MODE_CBC, bytes(AES.block_size))
+        self.encryptor_last_block = bytes(AES.block_size)
+        self.decryptor = AES.new(key, AES.MODE_CBC, bytes(AES.block_size))
+        self.decryptor_last_block = bytes(AES.block_size)
+        # ECB is stateless, so it is shared without locking
+        self.block_encryptor = AES.new(key, AES.MODE_ECB)
+
+    def encrypt(self, plain_fields, iv):
+        encrypted_fields = []
+        with self.lock:
+            for plain_bytes in plain_fields:
+                padded_data = pad(plain_bytes, AES.block_size)
+                first_block = xor_bytes(padded_data[:AES.block_size], xor_bytes(iv, self.encryptor_last_block))
+                encrypted_bytes = self.encryptor.encrypt(first_block + padded_data[AES.block_size:])
+                self.encryptor_last_block = encrypted_bytes[-AES.block_size:]
+                encrypted_fields.append(encrypted_bytes)
+        return encrypted_fields
+
+    def encrypt_batch(self, plain_fields, ivs):
+        """
+        Encrypts many fields, each with its own iv. CBC chains the blocks of a field, but the n-th blocks of
+        different fields are independent, so every round encrypts the n-th block of all the fields in one ECB call.
+        """
+        padded_fields = [pad(plain_bytes, AES.block_size) for plain_bytes in plain_fields]
+        chain_blocks = list(ivs)
+        encrypted_blocks = [[] for _ in padded_fields]
+        offset = 0
+        while True:
+            active = [i for i, padded_data in enumerate(padded_fields) if len(padded_data) > offset]
+            if len(active) == 0:
+                break
+            plain_blocks = b''.join(padded_fields[i][offset:offset + AES.block_size] for i in active)
+            encrypted = self.block_encryptor.encrypt(
+                xor_bytes(plain_blocks, b''.join(chain_blocks[i] for i in active)))
+            for position, i in enumerate(active):
+                block = encrypted[position * AES.block_size:(position + 1) * AES.block_size]
+                encrypted_blocks[i].append(block)
+                chain_blocks[i] = block
+            offset += AES.block_size
+        return [b''.join(blocks) for blocks in encrypted_blocks]
+
+    def decrypt(self, encrypted_fields, iv):
+        # all fields are decrypted in one call. The first block of every field was chained to the last block before
+        # it in the joined stream, instead of to the IV, so it is corrected after decryption
+        for encrypted_bytes in encrypted_fields:
+            if len(encrypted_bytes) == 0 or len(encrypted_bytes) % AES.block_size != 0:
+                raise ValueError('Data must be padded to 16 byte boundary in CBC mode')
+        joined = b''.join(encrypted_fields)
+        with self.lock:
+            previous_block = self.decryptor_last_block
+            decrypted = self.decryptor.decrypt(joined)
+            self.decryptor_last_block = joined[-AES.block_size:]
+
+        decrypted_fields = []
+        offset = 0
+        for encrypted_bytes in encrypted_fields:
+            first_block = xor_bytes(decrypted[offset:offset + AES.block_size], xor_bytes(previous_block, iv))
+            decrypted_field = first_block + decrypted[offset + AES.block_size:offset + len(encrypted_bytes)]
+            decrypted_fields.append(unpad(decrypted_field, AES.block_size))
+            offset += len(encrypted_bytes)
+            previous_block = encrypted_bytes[-AES.block_size:]
+        return decrypted_fields
+
+
+class CipherCache:
+    def __init__(self, max_keys=DEFAULT_MAX_CACHED_KEYS):
+        """
+        A bounded LRU cache of key -> KeyCiphers, so the AES key schedule of a key is computed once and not for
+        every field encrypted or decrypted with it.
+        :param max_keys: max number of keys kept. The least recently used key is evicted when it is exceeded.
+        """
+        self.max_keys = max_keys
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        key = bytes(key)
+        with self.lock:
+            ciphers = self.entries.get(key)
+            if ciphers is not None:
+                self.entries.move_to_end(key)
+                return ciphers
+
+        # expanding the key is done outside the lock. If two threads race, one of the instances is dropped
+        ciphers = KeyCiphers(key)
+        with self.lock:
+            ciphers = self.entries.setdefault(key, ciphers)
+            if len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+        return ciphers
+
+    def evict(self, key):
+        with self.lock:
+            self.entries.pop(bytes(key), None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+cipher_cache = CipherCache()
+
+
+def evict_cipher_key(key):
+    """
+    Drops the cached cipher state of a key, e.g. when the session using it expired
+    :param key: The key bytes
+    """
+    cipher_cache.evict(key)
+
 
 def encrypt_aes_cbc(key, plain_bytes, iv):
     """
@@ -15,13 +146,37 @@ def encrypt_aes_cbc(key, plain_bytes, iv):
     :param iv: an iv byte array to start the encryption with. In None, a random iv will be generated
     :return: A tuple of the encrypted bytes and the iv bytes
     """
+    encrypted_fields, iv = encrypt_aes_cbc_fields(key, [plain_bytes], iv)
+    return encrypted_fields[0], iv
+
+
+def encrypt_aes_cbc_fields(key, plain_fields, iv):
+    """
+    Encrypts several fields with the given key using AES-CBC. Every field is encrypted separately, starting from
+    the same iv - the same as calling encrypt_aes_cbc for each of them with that iv.
+    :param key: The encryption key bytes
+    :param plain_fields: list of bytes to encrypt
+    :param iv: an iv byte array to start the encryption of every field with. In None, a random iv will be generated
+    :return: A tuple of the list of encrypted fields and the iv bytes
+    """
     # Generate a random IV (Initialization Vector)
     if iv is None:
         iv = get_random_bytes(AES.block_size)
-    cipher = AES.new(key, AES.MODE_CBC, iv)
-    padded_data = pad(plain_bytes, AES.block_size)
-    encrypted_bytes = cipher.encrypt(padded_data)
-    return encrypted_bytes, iv
+    return cipher_cache.get(key).encrypt(plain_fields, iv), iv
+
+
+def encrypt_aes_cbc_batch(key, plain_fields, ivs):
+    """
+    Encrypts many fields with the given key using AES-CBC, each field with its own iv - the same as calling
+    encrypt_aes_cbc for every field, but with one AES call per block position instead of one per field.
+    :param key: The encryption key bytes
+    :param plain_fields: list of bytes to encrypt
+    :param ivs: list of iv bytes, one per field
+    :return: list of encrypted fields
+    """
+    if len(plain_fields) != len(ivs):
+        raise ValueError('Every field needs an iv')
+    return cipher_cache.get(key).encrypt_batch(plain_fields, ivs)
 
 
 def decrypt_aes_cbc(key, encrypted_bytes, iv):
@@ -32,11 +187,18 @@ def decrypt_aes_cbc(key, encrypted_bytes, iv):
     :param iv: iv bytes
     :return: decrypted bytes
     """
-    cipher = AES.new(key, AES.MODE_CBC, iv)
-    decrypted_bytes = unpad(cipher.decrypt(encrypted_bytes), AES.block_size)
-    return decrypted_bytes
+    return decrypt_aes_cbc_fields(key, [encrypted_bytes], iv)[0]
+
 
-    return None
+def decrypt_aes_cbc_fields(key, encrypted_fields, iv):
+    """
+    Decrypts several fields that were encrypted separately with the same key and iv
+    :param key: The key bytes
+    :param encrypted_fields: list of encrypted bytes
+    :param iv: iv bytes
+    :return: list of decrypted bytes
+    """
+    return cipher_cache.get(key).decrypt(encrypted_fields, iv)
 
 
 def sha256_hash(input_bytes: bytes):
@@ -1,5 +1,9 @@
 import os
 
+from common.logging_utils import get_logger
+
+logger = get_logger('file_utils')
+
 
 def read_file_lines(file_path):
     lines = []
@@ -10,9 +14,9 @@ def read_file_lines(file_path):
                     lines.append(line.strip())
 
     except FileNotFoundError:
-        print(f"File not found: {file_path}")
+        logger.warning("File not found: %s", file_path)
     except Exception as e:
-        print(f"Error reading file: {e}")
+        logger.error("Error reading file: %s", e)
 
     return lines
 
@@ -0,0 +1,112 @@
+import struct
+
+CLIENT_REQUEST_HEADER_SIZE = 23
+CLIENT_REQUEST_PAYLOAD_SIZE_OFFSET = 19
+SERVER_RESPONSE_HEADER_SIZE = 7
+SERVER_RESPONSE_PAYLOAD_SIZE_OFFSET = 3
+PAYLOAD_SIZE_STRUCT = struct.Struct('<I')
+
+# Upper bound on a single frame payload, so a corrupted or malicious header can't make us allocate gigabytes
+MAX_PAYLOAD_SIZE = 16 * 1024 * 1024
+
+
+def recv_exactly_into(sock, view):
+    """
+    Fills the passed buffer from the socket, looping over partial reads.
+    :param sock: a connected socket
+    :param view: a writable memoryview to fill
+    :return: the number of bytes received - less than len(view) only if the peer closed the connection
+    """
+    received = 0
+    size = len(view)
+    while received < size:
+        chunk_size = sock.recv_into(view[received:], size - received)
+        if chunk_size == 0:
+            break
+        received += chunk_size
+    return received
+
+
+def read_frame(sock, header_size, payload_size_offset):
+    """
+    Reads a single length prefixed frame (header + payload) from the socket.
+    The header is read first, then exactly payload_size bytes are read into a preallocated buffer.
+    :param sock: a connected socket
+    :param header_size: size of the frame header in bytes
+    :param payload_size_offset: offset of the 4 byte little endian payload size field in the header
+    :return: a bytearray with the header and payload, or None if the peer closed the connection before sending
+    anything
+    """
+    header = bytearray(header_size)
+    received = recv_exactly_into(sock, memoryview(header))
+    if received == 0:
+        return None
+    if received < header_size:
+        raise ConnectionError(f'Connection closed after {received} of {header_size} header bytes')
+
+    payload_size = PAYLOAD_SIZE_STRUCT.unpack_from(header, payload_size_offset)[0]
+    if payload_size > MAX_PAYLOAD_SIZE:
+        raise ValueError(f'Payload size {payload_size} exceeds the max payload size {MAX_PAYLOAD_SIZE}')
+
+    frame = bytearray(header_size + payload_size)
+    frame[:header_size] = header
+    received = recv_exactly_into(sock, memoryview(frame)[header_size:])
+    if received < payload_size:
+        raise ConnectionError(f'Connection closed after {received} of {payload_size} payload bytes')
+    return frame
+
+
+def read_client_request(sock):
+    """
+    Reads a single ClientRequest frame from the socket
+    :param sock: a connected socket
+    :return: the raw request bytes, or None if the peer closed the connection
+    """
+    return read_frame(sock, CLIENT_REQUEST_HEADER_SIZE, CLIENT_REQUEST_PAYLOAD_SIZE_OFFSET)
+
+
+def read_server_response(sock):
+    """
+    Reads a single ServerResponse frame from the socket
+    :param sock: a connected socket
+    :return: the raw response bytes, or None if the peer closed the connection
+    """
+    return read_frame(sock, SERVER_RESPONSE_HEADER_SIZE, SERVER_RESPONSE_PAYLOAD_SIZE_OFFSET)
+
+
+async def read_frame_async(reader, header_size, payload_size_offset):
+    """
+    The asyncio stream counterpart of read_frame
+    :param reader: asyncio StreamReader
+    :param header_size: size of the frame header in bytes
+    :param payload_size_offset: offset of the 4 byte little endian payload size field in the header
+    :return: the header and payload bytes, or None if the peer closed the connection before sending anything
+    """
+    header = await reader.read(header_size)
+    if len(header) == 0:
+        return None
+    if len(header) < header_size:
+        header += await reader.readexactly(header_size - len(header))
+
+    payload_size = PAYLOAD_SIZE_STRUCT.unpack_from(header, payload_size_offset)[0]
+    if payload_size > MAX_PAYLOAD_SIZE:
+        raise ValueError(f'Payload size {payload_size} exceeds the max payload size {MAX_PAYLOAD_SIZE}')
+    return header + await reader.readexactly(payload_size)
+
+
+async def read_client_request_async(reader):
+    """
+    Reads a single ClientRequest frame from an asyncio stream
+    :param reader: asyncio StreamReader
+    :return: the raw request bytes, or None if the peer closed the connection before sending anything
+    """
+    return await read_frame_async(reader, CLIENT_REQUEST_HEADER_SIZE, CLIENT_REQUEST_PAYLOAD_SIZE_OFFSET)
+
+
+async def read_server_response_async(reader):
+    """
+    Reads a single ServerResponse frame from an asyncio stream
+    :param reader: asyncio StreamReader
+    :return: the raw response bytes, or None if the peer closed the connection before sending anything
+    """
+    return await read_frame_async(reader, SERVER_RESPONSE_HEADER_SIZE, SERVER_RESPONSE_PAYLOAD_SIZE_OFFSET)
@@ -0,0 +1,125 @@
+import atexit
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# environment variables that configure the logs without code changes
+LOG_LEVEL_ENV = 'KERBEROS_LOG_LEVEL'
+# 'off' disables the per-connection and per-request logs
+HOT_PATH_LOGS_ENV = 'KERBEROS_HOT_PATH_LOGS'
+# keep 1 of every N per-connection and per-request logs
+HOT_PATH_SAMPLE_RATE_ENV = 'KERBEROS_HOT_PATH_SAMPLE_RATE'
+
+DEFAULT_FORMAT = '%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s'
+# the logger name suffix of the per-connection and per-request logs
+HOT_PATH_LOGGER_SUFFIX = 'requests'
+# above the highest level, so disabled loggers return before creating a record
+DISABLED_LEVEL = logging.CRITICAL + 1
+
+queue_handler = None
+queue_listener = None
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rate):
+        """
+        Passes 1 of every sample_rate records. Warnings and errors always pass.
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or next(self.counter) % self.sample_rate == 0
+
+
+def get_logger(component):
+    """
+    :param component: the component name, e.g. 'auth_server'
+    :return: the logger of the component's lifecycle and error logs
+    """
+    return logging.getLogger(component)
+
+
+def get_hot_path_logger(component):
+    """
+    :param component: the component name, e.g. 'auth_server'
+    :return: the logger of the component's per-connection and per-request logs, which configure_logging may sample
+    or disable
+    """
+    return logging.getLogger(f'{component}.{HOT_PATH_LOGGER_SUFFIX}')
+
+
+def configure_logging(components, level=None, log_format=DEFAULT_FORMAT, stream=None, hot_path_enabled=None,
+                      hot_path_sample_rate=None, background=True):
+    """
+    Sends the logs to a stream through a queue, so the logging threads only enqueue records and a background
+    listener thread formats and writes them. Unset arguments are taken from the environment.
+    :param components: names of the components whose hot path loggers are sampled or disabled
+    :param level: the root log level name, defaults to $KERBEROS_LOG_LEVEL or INFO
+    :param log_format: the logging format string
+    :param stream: the stream logs are written to, defaults to stdout
+    :param hot_path_enabled: False disables the hot path logs, defaults to $KERBEROS_HOT_PATH_LOGS != 'off'
+    :param hot_path_sample_rate: keep 1 of every N hot path logs, defaults to $KERBEROS_HOT_PATH_SAMPLE_RATE or 1
+    :param background: False writes the logs on the logging thread, keeping them in order with other output of an
+    interactive program
+    """
+    global queue_handler, queue_listener
+    if level is None:
+        level = os.environ.get(LOG_LEVEL_ENV, 'INFO')
+    if hot_path_enabled is None:
+        hot_path_enabled = os.environ.get(HOT_PATH_LOGS_ENV, 'on').lower() != 'off'
+    if hot_path_sample_rate is None:
+        hot_path_sample_rate = int(os.environ.get(HOT_PATH_SAMPLE_RATE_ENV, '1'))
+
+    stream_handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(log_format))
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.setLevel(level.upper())
+
+    for component in components:
+        hot_path_logger = get_hot_path_logger(component)
+        hot_path_logger.filters.clear()
+        hot_path_logger.setLevel(logging.NOTSET if hot_path_enabled else DISABLED_LEVEL)
+        if hot_path_sample_rate > 1:
+            hot_path_logger.addFilter(SamplingFilter(hot_path_sample_rate))
+
+    stop_logging()
+    if not background:
+        root_logger.addHandler(stream_handler)
+        return
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    root_logger.addHandler(queue_handler)
+    queue_listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    queue_listener.start()
+
+
+def restart_listener_in_child():
+    """
+    The listener thread does not survive a fork, so a forked process gets a queue and listener of its own
+    """
+    global queue_listener
+    if queue_listener is None:
+        return
+    queue_handler.queue = queue.SimpleQueue()
+    queue_listener = logging.handlers.QueueListener(queue_handler.queue, *queue_listener.handlers)
+    queue_listener.start()
+
+
+def stop_logging():
+    """
+    Writes the queued records and stops the listener thread
+    """
+    global queue_listener
+    if queue_listener is not None:
+        queue_listener.stop()
+        queue_listener = None
+
+
+os.register_at_fork(after_in_child=restart_listener_in_child)
+atexit.register(stop_logging)
@@ -0,0 +1,259 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+DEFAULT_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                           2.5, 5.0, 10.0)
+
+
+class MetricsShard:
+    __slots__ = ('values', 'histograms')
+
+    def __init__(self):
+        """
+        The metric values recorded by a single thread
+        """
+        # (name, labels) -> counter or gauge value
+        self.values = dict()
+        # (name, labels) -> [count of every bucket..., count above the last bucket, sum of the observations]
+        self.histograms = dict()
+
+    def merge(self, other):
+        for key, value in other.values.items():
+            self.values[key] = self.values.get(key, 0) + value
+        for key, histogram in other.histograms.items():
+            merged = self.histograms.get(key)
+            if merged is None:
+                self.histograms[key] = list(histogram)
+            else:
+                for i, value in enumerate(histogram):
+                    merged[i] += value
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        Collects counters, gauges and histograms and renders them in the Prometheus text format.
+        Every thread records into a shard of its own, so recording takes no lock - the shards are only summed when
+        the metrics are rendered. The shards of threads that ended are folded into a single retired shard.
+        :param buckets: upper bounds of the histogram buckets
+        """
+        self.buckets = buckets
+        # name -> (type, help)
+        self.descriptions = dict()
+        # name -> function returning the current value of a gauge that is computed when rendered
+        self.gauge_functions = dict()
+        self.local = threading.local()
+        self.shards_lock = threading.Lock()
+        # (thread, shard) of every thread that recorded a metric and was not retired yet
+        self.shards = []
+        self.retired_shard = MetricsShard()
+        self.next_retirement = 64
+
+    def describe(self, name, metric_type, help_text):
+        self.descriptions[name] = (metric_type, help_text)
+
+    def gauge_function(self, name, function, help_text):
+        """
+        Registers a gauge whose value is computed by function when the metrics are rendered
+        """
+        self.describe(name, GAUGE, help_text)
+        self.gauge_functions[name] = function
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = MetricsShard()
+            self.local.shard = shard
+            with self.shards_lock:
+                self.shards.append((threading.current_thread(), shard))
+                if len(self.shards) >= self.next_retirement:
+                    self.retire_shards()
+                    self.next_retirement = 2 * len(self.shards) + 64
+        return shard
+
+    def retire_shards(self):
+        """
+        Folds the shards of the threads that ended into the retired shard. Called under the shards lock.
+        """
+        live_shards = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                live_shards.append((thread, shard))
+            else:
+                self.retired_shard.merge(shard)
+        self.shards = live_shards
+
+    def add(self, name, value=1, labels=()):
+        """
+        Adds value to a counter, or to a gauge that is moved up and down (e.g. active connections)
+        :param labels: tuple of (label name, label value) pairs
+        """
+        values = self.shard().values
+        key = (name, labels)
+        values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        """
+        Records an observation in a histogram
+        """
+        histograms = self.shard().histograms
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = [0] * (len(self.buckets) + 2)
+            histograms[key] = histogram
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def collect(self):
+        """
+        :return: a MetricsShard with the sum of all the shards
+        """
+        total = MetricsShard()
+        with self.shards_lock:
+            self.retire_shards()
+            total.merge(self.retired_shard)
+            shards = [shard for _, shard in self.shards]
+        for shard in shards:
+            # copies, as the owning threads keep recording while the shard is summed
+            snapshot = MetricsShard()
+            snapshot.values = dict(shard.values)
+            snapshot.histograms = {key: list(histogram) for key, histogram in list(shard.histograms.items())}
+            total.merge(snapshot)
+        return total
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        total = self.collect()
+        for name, function in self.gauge_functions.items():
+            total.values[(name, ())] = function()
+
+        lines = []
+        for name in sorted(self.descriptions):
+            metric_type, help_text = self.descriptions[name]
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == HISTOGRAM:
+                for (histogram_name, labels), histogram in sorted(total.histograms.items()):
+                    if histogram_name == name:
+                        lines += self.render_histogram(name, labels, histogram)
+            else:
+                for (value_name, labels), value in sorted(total.values.items()):
+                    if value_name == name:
+                        lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def render_histogram(self, name, labels, histogram):
+        lines = []
+        cumulative_count = 0
+        for bound, count in zip(self.buckets + (float('inf'),), histogram):
+            cumulative_count += count
+            bound_label = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", bound_label),))} {cumulative_count}')
+        lines.append(f'{name}_sum{format_labels(labels)} {histogram[-1]}')
+        lines.append(f'{name}_count{format_labels(labels)} {cumulative_count}')
+        return lines
+
+    def start_http_server(self, port, host='127.0.0.1'):
+        """
+        Serves the metrics on http://host:port/metrics from a daemon thread
+        :return: the HTTP server
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=http_server.serve_forever, name='metrics-http', daemon=True).start()
+        return http_server
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class ServerMetrics:
+    def __init__(self, component, registry=None):
+        """
+        The metrics every server records: requests and their latency per request code, active connections,
+        bytes in and out, errors per failure reason and requests rejected for client errors per reason.
+        :param component: the metric names prefix, e.g. 'auth_server'
+        :param registry: the MetricsRegistry to record into, a new one by default
+        """
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.requests_name = f'{component}_requests_total'
+        self.duration_name = f'{component}_request_duration_seconds'
+        self.connections_name = f'{component}_active_connections'
+        self.received_name = f'{component}_received_bytes_total'
+        self.sent_name = f'{component}_sent_bytes_total'
+        self.errors_name = f'{component}_errors_total'
+        self.client_errors_name = f'{component}_client_errors_total'
+        self.registry.describe(self.requests_name, COUNTER, 'Requests handled, by request code')
+        self.registry.describe(self.duration_name, HISTOGRAM, 'Request processing time, by request code')
+        self.registry.describe(self.connections_name, GAUGE, 'Connections currently open')
+        self.registry.describe(self.received_name, COUNTER, 'Request bytes received')
+        self.registry.describe(self.sent_name, COUNTER, 'Response bytes sent')
+        self.registry.describe(self.errors_name, COUNTER, 'Errors, by failure reason')
+        self.registry.describe(self.client_errors_name, COUNTER,
+                               'Requests rejected for client errors, e.g. unknown ids or replays, by reason')
+        self.registry.gauge_function(f'{component}_threads', threading.active_count, 'Threads of the process')
+
+    def connection_opened(self):
+        self.registry.add(self.connections_name, 1)
+
+    def connection_closed(self):
+        self.registry.add(self.connections_name, -1)
+
+    def request_handled(self, request_code, start_time, received_bytes, sent_bytes):
+        """
+        :param request_code: the request code
+        :param start_time: the time.perf_counter() the request processing started at
+        :param received_bytes: size of the request
+        :param sent_bytes: size of the response
+        """
+        labels = (('code', request_code),)
+        shard = self.registry.shard()
+        values = shard.values
+        for key, value in (((self.requests_name, labels), 1), ((self.received_name, ()), received_bytes),
+                           ((self.sent_name, ()), sent_bytes)):
+            values[key] = values.get(key, 0) + value
+        self.registry.observe(self.duration_name, time.perf_counter() - start_time, labels)
+
+    def error(self, reason):
+        self.registry.add(self.errors_name, 1, (('reason', reason),))
+
+    def client_error(self, reason):
+        self.registry.add(self.client_errors_name, 1, (('reason', reason),))
+
+    def start_http_server(self, metrics_port, worker_number=None):
+        """
+        Serves the metrics of this process over HTTP. In multi-process mode the parent process serves on
+        metrics_port and worker n on metrics_port + n + 1.
+        :param metrics_port: the metrics port, None to not serve the metrics
+        :param worker_number: the number of the worker process, None for the parent or single process
+        """
+        if metrics_port is None:
+            return None
+        return self.registry.start_http_server(metrics_port if worker_number is None else metrics_port + worker_number + 1)
@@ -1,4 +1,7 @@
 import ipaddress
+import socket
+
+IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
 
 
 def is_valid_port(port_str: str) -> bool:
@@ -15,3 +18,34 @@ def is_valid_ip(ip_str: str) -> bool:
         return True
     except ValueError:
         return False
+
+
+def ip_to_bytes(ip_str: str) -> bytes:
+    """
+    Packs an IPv4 or IPv6 address string into 16 bytes. IPv4 addresses are stored as IPv4-mapped IPv6 addresses.
+    :param ip_str: ip address string
+    :return: 16 bytes
+    """
+    try:
+        # fast path for the common case, which skips building an ipaddress object
+        return IPV4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, ip_str)
+    except OSError:
+        pass
+    ip = ipaddress.ip_address(ip_str)
+    if ip.version == 4:
+        ip = ipaddress.IPv6Address(IPV4_MAPPED_PREFIX + ip.packed)
+    return ip.packed
+
+
+def ip_from_bytes(ip_bytes: bytes) -> str:
+    """
+    Unpacks 16 bytes packed by ip_to_bytes back to an ip address string
+    :param ip_bytes: 16 bytes
+    :return: ip address string
+    """
+    if ip_bytes[:12] == IPV4_MAPPED_PREFIX:
+        return socket.inet_ntop(socket.AF_INET, ip_bytes[12:16])
+    ip = ipaddress.IPv6Address(bytes(ip_bytes))
+    if ip.ipv4_mapped is not None:
+        return str(ip.ipv4_mapped)
+    return str(ip)
@@ -5,6 +5,8 @@ from common.date_utils import get_datetime_from_ts_bytes, datetime_to_timestamp_
 
 
 class Authenticator:
+    STRUCT = struct.Struct('<16s16s32s32s16s')
+
     def __init__(self, iv: bytes, encrypted_version: bytes, encrypted_client_id: bytes, encrypted_server_id: bytes, encrypted_creation_time: bytes):
         self.iv = iv
         self.encrypted_version = encrypted_version
@@ -12,12 +14,24 @@ class Authenticator:
         self.encrypted_server_id = encrypted_server_id
         self.encrypted_creation_time = encrypted_creation_time
 
+    def replay_key(self):
+        """
+        :return: the bytes the replay caches tell authenticators apart by - the iv and the fields the message server
+        decrypts and checks. The version is not checked, so it is left out: altering it must not make a replayed
+        authenticator look new.
+        """
+        return self.iv + self.encrypted_client_id + self.encrypted_server_id + self.encrypted_creation_time
+
     def pack(self):
-        format_string = '<16s16s32s32s16s'
-        return struct.pack(format_string, self.iv, self.encrypted_version, self.encrypted_client_id, self.encrypted_server_id, self.encrypted_creation_time)
+        return self.STRUCT.pack(self.iv, self.encrypted_version, self.encrypted_client_id,
+                                self.encrypted_server_id, self.encrypted_creation_time)
 
     @classmethod
     def unpack(cls, packed_data):
-        unpacked_data = struct.unpack('<16s16s32s32s16s', packed_data)
-        iv, encrypted_version, encrypted_client_id, encrypted_server_id, encrypted_creation_time = unpacked_data
-        return cls(iv, encrypted_version, encrypted_client_id, encrypted_server_id, encrypted_creation_time)
\ No newline at end of file
+        return cls(*cls.STRUCT.unpack(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        return cls(*cls.STRUCT.unpack_from(buffer, offset))
@@ -2,6 +2,9 @@ import struct
 
 
 class ClientRequest:
+    # client id, version, code, payload size
+    HEADER_STRUCT = struct.Struct('<16sBHI')
+
     def __init__(self, client_id, version, code, payload):
         """
         This class represents a client request. It encapsulates the header struct, and assumes the payload
@@ -29,24 +32,32 @@ class ClientRequest:
             payload_data = self.payload.pack()  # convert to bytes if it is not already
         else:
             payload_data = self.payload
-        format_string = '<16sBHI' + str(len(payload_data)) + 's'
         self.payload_size = len(payload_data)
-        return struct.pack(format_string, self.client_id, self.version, self.code, self.payload_size,
-                           payload_data)
+        return self.HEADER_STRUCT.pack(self.client_id, self.version, self.code, self.payload_size) + payload_data
 
     @classmethod
     def unpack(cls, packed_data, payload_type):
         """
         This method gets the packed data and payload type, and unpacks it into an object based on the passed
-        payload type
-        :param packed_data:
-        :param payload_type:
+        payload type. The payload is unpacked in place, from its offset in packed_data, instead of from a copy.
+        :param packed_data: raw source bytes of the request
+        :param payload_type: bytes - for raw data. Any other type that has an unpack_from method to create a data
+        class
         :return:
         """
-        client_id, version, code, payload_size = struct.unpack('<16sBHI', packed_data[:23])
-        payload_data = packed_data[23:23 + payload_size]
-        if payload_size > 0:
-            payload = payload_type.unpack(payload_data)
-        else:
-            payload = bytes(0)
-        return cls(client_id, version, code, payload)
+        client_id, version, code, payload_size = cls.HEADER_STRUCT.unpack_from(packed_data)
+        return cls(client_id, version, code, cls.unpack_payload(packed_data, payload_size, payload_type))
+
+    @classmethod
+    def unpack_payload(cls, packed_data, payload_size, payload_type):
+        """
+        Unpacks the payload of a packed request whose header was already unpacked. A payload type is unpacked even
+        when the payload is empty, so an empty or short payload raises instead of reaching the handler.
+        :param payload_size: the payload size in the header
+        :return: the payload, or empty bytes for a raw payload when there is none
+        """
+        if payload_type is bytes:  # treat payload as raw bytes
+            if payload_size == 0:
+                return bytes(0)
+            return packed_data[cls.HEADER_STRUCT.size:cls.HEADER_STRUCT.size + payload_size]
+        return payload_type.unpack_from(packed_data, cls.HEADER_STRUCT.size, payload_size)
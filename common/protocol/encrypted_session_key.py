@@ -2,17 +2,22 @@ import struct
 
 
 class EncryptedSessionKey:
+    STRUCT = struct.Struct('<16s16s48s')
+
     def __init__(self, iv: bytes, nonce: bytes, session_key: bytes):
         self.iv = iv
         self.nonce = nonce
         self.session_key = session_key
 
     def pack(self):
-        format_string = '<16s16s48s'
-        return struct.pack(format_string, self.iv, self.nonce, self.session_key)
+        return self.STRUCT.pack(self.iv, self.nonce, self.session_key)
 
     @classmethod
     def unpack(cls, packed_data):
-        unpacked_data = struct.unpack('<16s16s48s', packed_data)
-        iv, nonce, session_key = unpacked_data
-        return cls(iv, nonce, session_key)
\ No newline at end of file
+        return cls(*cls.STRUCT.unpack(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        return cls(*cls.STRUCT.unpack_from(buffer, offset))
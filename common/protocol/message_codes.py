@@ -4,6 +4,11 @@ SERVER_LIST_REQUEST_CODE = 1026
 SESSION_KEY_AND_TICKET_REQUEST_CODE = 1027
 SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE = 1028
 SEND_MESSAGE_REQUEST_CODE = 1029
+SERVER_LIST_PAGE_REQUEST_CODE = 1030
+BINARY_SERVER_LIST_REQUEST_CODE = 1031
+BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE = 1032
+# answered with BATCH_SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE
+MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE = 1033
 
 CLIENT_REGISTRATION_SUCCESS_CODE = 1600
 MESSAGE_SERVER_LIST_RESPONSE_CODE = 1602
@@ -11,6 +16,12 @@ SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE = 1603
 SESSION_KEY_ACCEPTED_RESPONSE_CODE = 1604
 MESSAGE_ACCEPTED_RESPONSE_CODE = 1605
 SERVER_REGISTRATION_SUCCESS_CODE = 1608
+MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE = 1610
+BATCH_SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE = 1611
 
 CLIENT_REGISTRATION_FAIL_CODE = 1601
-GENERAL_SERVER_ERROR_CODE = 1609
\ No newline at end of file
+GENERAL_SERVER_ERROR_CODE = 1609
+# the request was rejected before it was processed: the client or its ip address sent too many requests
+RATE_LIMITED_RESPONSE_CODE = 1612
+# the request was rejected before it was processed: the server is processing too many requests
+SERVER_BUSY_RESPONSE_CODE = 1613
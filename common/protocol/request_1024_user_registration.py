@@ -2,6 +2,8 @@ import struct
 
 
 class UserRegistrationRequest:
+    STRUCT = struct.Struct('<255s255s')
+
     def __init__(self, name, password):
         """
         This class represents the body of a user registration request. 
@@ -12,11 +14,15 @@ class UserRegistrationRequest:
         self.password = password
 
     def pack(self):
-        format_string = '<255s255s'
-        return struct.pack(format_string, self.name.encode('utf-8'), self.password.encode('utf-8'))
+        return self.STRUCT.pack(self.name.encode('utf-8'), self.password.encode('utf-8'))
 
     @classmethod
     def unpack(cls, packed_data):
-        unpacked_data = struct.unpack('<255s255s', packed_data)
-        name, password = unpacked_data
-        return cls(name.decode('utf-8').rstrip('\x00'), password.decode('utf-8').rstrip('\x00'))
\ No newline at end of file
+        return cls.unpack_from(packed_data, 0, len(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        name, password = cls.STRUCT.unpack_from(buffer, offset)
+        return cls(name.rstrip(b'\x00').decode('utf-8'), password.rstrip(b'\x00').decode('utf-8'))
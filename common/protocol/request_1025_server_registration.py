@@ -2,6 +2,8 @@ import struct
 
 
 class ServerRegistrationRequest:
+    STRUCT = struct.Struct('<255s32sI')
+
     def __init__(self, name, key, port):
         """
         This class represents the body of a user registration request. 
@@ -13,11 +15,15 @@ class ServerRegistrationRequest:
         self.port = int(port)
 
     def pack(self):
-        format_string = '<255s32sI'
-        return struct.pack(format_string, self.name.encode('utf-8'), self.message_server_key, self.port)
+        return self.STRUCT.pack(self.name.encode('utf-8'), self.message_server_key, self.port)
 
     @classmethod
     def unpack(cls, packed_data):
-        unpacked_data = struct.unpack('<255s32sI', packed_data)
-        name, message_server_key, port = unpacked_data
-        return cls(name.decode('utf-8').rstrip('\x00'), message_server_key, port)
\ No newline at end of file
+        return cls.unpack_from(packed_data, 0, len(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        name, message_server_key, port = cls.STRUCT.unpack_from(buffer, offset)
+        return cls(name.rstrip(b'\x00').decode('utf-8'), message_server_key, port)
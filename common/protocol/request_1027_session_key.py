@@ -2,16 +2,21 @@ import struct
 
 
 class SessionKeyAndTicketRequest:
+    STRUCT = struct.Struct('<16s8s')
+
     def __init__(self, message_server_id: str, nonce: bytes):
         self.message_server_id = message_server_id
         self.nonce = nonce
 
     def pack(self):
-        format_string = '<16s8s'
-        return struct.pack(format_string, self.message_server_id, self.nonce)
+        return self.STRUCT.pack(self.message_server_id, self.nonce)
 
     @classmethod
     def unpack(cls, packed_data):
-        unpacked_data = struct.unpack('<16s8s', packed_data)
-        message_server_id, nonce = unpacked_data
-        return cls(message_server_id, nonce)
\ No newline at end of file
+        return cls(*cls.STRUCT.unpack(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        return cls(*cls.STRUCT.unpack_from(buffer, offset))
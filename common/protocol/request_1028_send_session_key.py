@@ -2,16 +2,21 @@ import struct
 
 
 class SendSessionKeyRequest:
+    STRUCT = struct.Struct('<112s121s')
+
     def __init__(self, authenticator_bytes: bytes, ticket: bytes):
         self.authenticator = authenticator_bytes
         self.ticket = ticket
 
     def pack(self):
-        format_string = '<112s121s'
-        return struct.pack(format_string, self.authenticator, self.ticket)
+        return self.STRUCT.pack(self.authenticator, self.ticket)
 
     @classmethod
     def unpack(cls, packed_data):
-        unpacked_data = struct.unpack('<112s121s', packed_data)
-        authenticator_bytes, ticket = unpacked_data
-        return cls(authenticator_bytes, ticket)
\ No newline at end of file
+        return cls(*cls.STRUCT.unpack(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        return cls(*cls.STRUCT.unpack_from(buffer, offset))
@@ -2,17 +2,30 @@ import struct
 
 
 class SendMessageRequest:
+    # message size and iv, followed by the encrypted message
+    HEADER_STRUCT = struct.Struct('<I16s')
+
     def __init__(self, message_iv: bytes, encrypted_message: bytes):
         self.message_iv = message_iv
         self.encrypted_message = encrypted_message
         self.message_size = len(encrypted_message)
 
     def pack(self):
-        format_string = f'<I16s{self.message_size}s'
-        return struct.pack(format_string, self.message_size, self.message_iv, self.encrypted_message)
+        return self.HEADER_STRUCT.pack(self.message_size, self.message_iv) + self.encrypted_message
 
     @classmethod
     def unpack(cls, packed_data):
-        message_size, message_iv = struct.unpack('<I16s', packed_data[:20])
-        payload_data = packed_data[20:20 + message_size]
-        return cls(message_iv, payload_data)
\ No newline at end of file
+        return cls.unpack_from(packed_data, 0, len(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        """
+        The encrypted message is a memoryview of buffer, so messages of any size are not copied
+        """
+        if size < cls.HEADER_STRUCT.size:
+            raise ValueError(f'Expected at least {cls.HEADER_STRUCT.size} bytes, got {size}')
+        message_size, message_iv = cls.HEADER_STRUCT.unpack_from(buffer, offset)
+        message_offset = offset + cls.HEADER_STRUCT.size
+        if message_size > size - cls.HEADER_STRUCT.size:
+            raise ValueError(f'Expected a {message_size} bytes message')
+        return cls(message_iv, memoryview(buffer)[message_offset:message_offset + message_size])
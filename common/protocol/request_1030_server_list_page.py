@@ -0,0 +1,30 @@
+import struct
+
+
+class ServerListPageRequest:
+    STRUCT = struct.Struct('<II255s')
+
+    def __init__(self, offset: int, limit: int, name_filter: str = ''):
+        """
+        This class represents the body of a paginated and filtered message servers list request.
+        :param offset: index of the first server to return, among the servers matching the filter
+        :param limit: max number of servers to return
+        :param name_filter: only servers whose name contains this string are returned. Empty matches all servers.
+        """
+        self.offset = offset
+        self.limit = limit
+        self.name_filter = name_filter
+
+    def pack(self):
+        return self.STRUCT.pack(self.offset, self.limit, self.name_filter.encode('utf-8'))
+
+    @classmethod
+    def unpack(cls, packed_data):
+        return cls.unpack_from(packed_data, 0, len(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        page_offset, limit, name_filter = cls.STRUCT.unpack_from(buffer, offset)
+        return cls(page_offset, limit, name_filter.rstrip(b'\x00').decode('utf-8'))
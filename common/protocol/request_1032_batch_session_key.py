@@ -0,0 +1,36 @@
+import struct
+
+
+class BatchSessionKeyAndTicketRequest:
+    COUNT_STRUCT = struct.Struct('<I')
+    RECORD_STRUCT = struct.Struct('<16s16s8s')
+
+    def __init__(self, ticket_requests: list):
+        """
+        This class represents the body of a batch session key and ticket request - a ticket count followed by a
+        fixed size record per requested ticket.
+        :param ticket_requests: list of (client_id, message_server_id, nonce) tuples
+        """
+        self.ticket_requests = ticket_requests
+
+    def pack(self):
+        record = self.RECORD_STRUCT
+        return self.COUNT_STRUCT.pack(len(self.ticket_requests)) + b''.join(
+            [record.pack(client_id, message_server_id, nonce) for client_id, message_server_id, nonce in
+             self.ticket_requests])
+
+    @classmethod
+    def unpack(cls, packed_data):
+        return cls.unpack_from(packed_data, 0, len(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size < cls.COUNT_STRUCT.size:
+            raise ValueError(f'Expected at least {cls.COUNT_STRUCT.size} bytes, got {size}')
+        count = cls.COUNT_STRUCT.unpack_from(buffer, offset)[0]
+        records_size = count * cls.RECORD_STRUCT.size
+        if size - cls.COUNT_STRUCT.size != records_size:
+            raise ValueError(f'Expected {count} ticket requests')
+        records_offset = offset + cls.COUNT_STRUCT.size
+        records = memoryview(buffer)[records_offset:records_offset + records_size]
+        return cls(list(cls.RECORD_STRUCT.iter_unpack(records)))
@@ -0,0 +1,37 @@
+import struct
+
+
+class MultiServerSessionKeyAndTicketRequest:
+    HEADER_STRUCT = struct.Struct('<8sI')
+    RECORD_STRUCT = struct.Struct('<16s')
+
+    def __init__(self, message_server_ids: list, nonce: bytes):
+        """
+        This class represents the body of a session key and ticket request for several message servers at once -
+        the nonce and a server count, followed by the id of every requested message server. The auth server answers
+        with a BatchKeyAndTokenResponse, with a record per server in the order of the request.
+        :param message_server_ids: list of message server ids
+        :param nonce: the nonce, encrypted with every session key of the response
+        """
+        self.message_server_ids = message_server_ids
+        self.nonce = nonce
+
+    def pack(self):
+        return self.HEADER_STRUCT.pack(self.nonce, len(self.message_server_ids)) + b''.join(
+            [self.RECORD_STRUCT.pack(message_server_id) for message_server_id in self.message_server_ids])
+
+    @classmethod
+    def unpack(cls, packed_data):
+        return cls.unpack_from(packed_data, 0, len(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size < cls.HEADER_STRUCT.size:
+            raise ValueError(f'Expected at least {cls.HEADER_STRUCT.size} bytes, got {size}')
+        nonce, count = cls.HEADER_STRUCT.unpack_from(buffer, offset)
+        records_size = count * cls.RECORD_STRUCT.size
+        if size - cls.HEADER_STRUCT.size != records_size:
+            raise ValueError(f'Expected {count} message server ids')
+        records_offset = offset + cls.HEADER_STRUCT.size
+        records = memoryview(buffer)[records_offset:records_offset + records_size]
+        return cls([message_server_id for message_server_id, in cls.RECORD_STRUCT.iter_unpack(records)], nonce)
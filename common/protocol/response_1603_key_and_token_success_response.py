@@ -2,6 +2,8 @@ import struct
 
 
 class KeyAndTokenResponse:
+    STRUCT = struct.Struct('<16s80s121s')
+
     def __init__(self, client_id: bytes, session_key: bytes, ticket: bytes):
         """
         This class contains the sesstion key and ticket fields. both are typed objects.
@@ -14,12 +16,14 @@ class KeyAndTokenResponse:
         self.ticket = ticket
 
     def pack(self):
-        format_string = f'<16s80s121s'
-        return struct.pack(format_string, self.client_id, self.session_key, self.ticket)
+        return self.STRUCT.pack(self.client_id, self.session_key, self.ticket)
 
     @classmethod
     def unpack(cls, packed_data):
-        unpacked_data = struct.unpack('<16s80s121s', packed_data)
-        client_id, session_key, ticket = unpacked_data
-        return cls(client_id, session_key, ticket)
+        return cls(*cls.STRUCT.unpack(packed_data))
 
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        return cls(*cls.STRUCT.unpack_from(buffer, offset))
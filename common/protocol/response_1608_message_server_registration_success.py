@@ -2,6 +2,8 @@ import struct
 
 
 class MessageServerRegistrationSuccessResponse:
+    STRUCT = struct.Struct('<16s')
+
     def __init__(self, server_id: bytes):
         """
         This class represents the body of a user registration success response.
@@ -10,11 +12,14 @@ class MessageServerRegistrationSuccessResponse:
         self.server_id = server_id
 
     def pack(self):
-        format_string = '<16s'
-        return struct.pack(format_string, self.server_id)
+        return self.STRUCT.pack(self.server_id)
 
     @classmethod
     def unpack(cls, packed_data):
-        unpacked_data = struct.unpack('<16s', packed_data)
-        server_id = unpacked_data[0]
-        return cls(server_id)
\ No newline at end of file
+        return cls(*cls.STRUCT.unpack(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        return cls(*cls.STRUCT.unpack_from(buffer, offset))
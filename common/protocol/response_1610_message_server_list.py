@@ -0,0 +1,31 @@
+import struct
+
+from common.network_utils import ip_to_bytes, ip_from_bytes
+
+
+class MessageServerListResponse:
+    # server id, name, ip address (IPv4 addresses are IPv4-mapped IPv6), port
+    RECORD_STRUCT = struct.Struct('<16s255s16sH')
+
+    def __init__(self, servers: list):
+        """
+        This class represents the body of a binary message servers list response - a sequence of fixed size
+        records, one per message server.
+        :param servers: list of (server_id bytes, name, ip address string, port) tuples
+        """
+        self.servers = servers
+
+    def pack(self):
+        record = self.RECORD_STRUCT
+        return b''.join([record.pack(server_id, name.encode('utf-8'), ip_to_bytes(ip_address), port)
+                         for server_id, name, ip_address, port in self.servers])
+
+    @classmethod
+    def unpack(cls, packed_data):
+        return cls.unpack_from(packed_data, 0, len(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        return cls([(server_id, name.rstrip(b'\x00').decode('utf-8'), ip_from_bytes(ip_address), port)
+                    for server_id, name, ip_address, port in
+                    cls.RECORD_STRUCT.iter_unpack(memoryview(buffer)[offset:offset + size])])
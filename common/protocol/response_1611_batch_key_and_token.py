@@ -0,0 +1,44 @@
+import struct
+
+from .response_1603_key_and_token_success_response import KeyAndTokenResponse
+
+
+class BatchKeyAndTokenResponse:
+    COUNT_STRUCT = struct.Struct('<I')
+    # success flag, followed by the packed KeyAndTokenResponse
+    RECORD_STRUCT = struct.Struct('<B217s')
+    FAILED_RECORD = RECORD_STRUCT.pack(0, b'')
+
+    def __init__(self, key_and_token_responses: list):
+        """
+        This class represents the body of a batch session key and ticket response - a count followed by a record
+        per requested ticket, in the order of the request. A record is a success flag and a packed
+        KeyAndTokenResponse, which is all zeros if the ticket could not be issued.
+        :param key_and_token_responses: list of KeyAndTokenResponse objects, or None for a failed ticket
+        """
+        self.key_and_token_responses = key_and_token_responses
+
+    def pack(self):
+        record = self.RECORD_STRUCT
+        return self.COUNT_STRUCT.pack(len(self.key_and_token_responses)) + b''.join(
+            [self.FAILED_RECORD if response is None else record.pack(1, response.pack())
+             for response in self.key_and_token_responses])
+
+    @classmethod
+    def unpack(cls, packed_data):
+        return cls.unpack_from(packed_data, 0, len(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        """
+        The responses are unpacked in place, from the offset of every record in buffer
+        """
+        count = cls.COUNT_STRUCT.unpack_from(buffer, offset)[0]
+        if size - cls.COUNT_STRUCT.size < count * cls.RECORD_STRUCT.size:
+            raise ValueError(f'Expected {count} key and token records')
+        records_offset = offset + cls.COUNT_STRUCT.size
+        response_size = cls.RECORD_STRUCT.size - 1
+        return cls([KeyAndTokenResponse.unpack_from(buffer, record_offset + 1, response_size)
+                    if buffer[record_offset] else None
+                    for record_offset in range(records_offset, records_offset + count * cls.RECORD_STRUCT.size,
+                                               cls.RECORD_STRUCT.size)])
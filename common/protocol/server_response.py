@@ -2,6 +2,9 @@ import struct
 
 
 class ServerResponse:
+    # version, code, payload size
+    HEADER_STRUCT = struct.Struct('<BHI')
+
     def __init__(self, version, code, payload):
         """
         This class represents a server response. It encapsulates the header struct, and assumes the payload
@@ -29,27 +32,24 @@ class ServerResponse:
             payload_data = self.payload.pack()
 
         self.payload_size = len(payload_data)
-
-        format_string = '<BHI' + str(self.payload_size) + 's'
-        return struct.pack(format_string, self.version, self.code, self.payload_size,
-                           payload_data)
+        return self.HEADER_STRUCT.pack(self.version, self.code, self.payload_size) + payload_data
 
     @classmethod
     def unpack(cls, packed_data, payload_type):
         """
         This method gets the packed data and payload type, and unpacks it into an object based on the passed
-        payload type
+        payload type. The payload is unpacked in place, from its offset in packed_data, instead of from a copy.
         :param packed_data: raw source bytes of the response
-        :param payload_type: bytes - for raw data. Any other type that has an unpack method to create a data class
+        :param payload_type: bytes - for raw data. Any other type that has an unpack_from method to create a data
+        class
         :return:
         """
-        version, code, payload_size = struct.unpack('<BHI', packed_data[:7])
+        version, code, payload_size = cls.HEADER_STRUCT.unpack_from(packed_data)
         if payload_size > 0:
-            payload_data = packed_data[7:7 + payload_size]
             if payload_type is bytes:  # treat payload as raw bytes
-                payload = payload_data
+                payload = packed_data[cls.HEADER_STRUCT.size:cls.HEADER_STRUCT.size + payload_size]
             else:
-                payload = payload_type.unpack(payload_data)
+                payload = payload_type.unpack_from(packed_data, cls.HEADER_STRUCT.size, payload_size)
         else:
             payload = None
         return cls(version, code, payload)
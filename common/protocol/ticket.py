@@ -3,8 +3,14 @@ from datetime import datetime
 
 from common.date_utils import get_datetime_from_ts_bytes, datetime_to_timestamp_bytes
 
+# the time from a ticket's creation to its expiration. The expiration time is encrypted with the message server's key,
+# so clients compute it from the creation time.
+TICKET_LIFETIME_MINUTES = 5
+
 
 class Ticket:
+    STRUCT = struct.Struct('<B16s16s8s16s48s16s')
+
     def __init__(self, version: bytes, client_id: bytes, server_id: bytes, creation_time: bytes, iv: bytes, encrypted_session_key: bytes, encrypted_expiration_time: bytes):
         self.version = version
         self.client_id = client_id
@@ -15,11 +21,15 @@ class Ticket:
         self.encrypted_expiration_time = encrypted_expiration_time
 
     def pack(self):
-        format_string = '<B16s16s8s16s48s16s'
-        return struct.pack(format_string, self.version, self.client_id, self.server_id, self.creation_time, self.iv, self.encrypted_session_key, self.encrypted_expiration_time)
+        return self.STRUCT.pack(self.version, self.client_id, self.server_id, self.creation_time, self.iv,
+                                self.encrypted_session_key, self.encrypted_expiration_time)
 
     @classmethod
     def unpack(cls, packed_data):
-        unpacked_data = struct.unpack('<B16s16s8s16s48s16s', packed_data)
-        version, client_id, server_id, creation_time, iv, encrypted_session_key, expiration_time = unpacked_data
-        return cls(version, client_id, server_id, creation_time, iv, encrypted_session_key, expiration_time)
\ No newline at end of file
+        return cls(*cls.STRUCT.unpack(packed_data))
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, size):
+        if size != cls.STRUCT.size:
+            raise ValueError(f'Expected {cls.STRUCT.size} bytes, got {size}')
+        return cls(*cls.STRUCT.unpack_from(buffer, offset))
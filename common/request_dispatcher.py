@@ -0,0 +1,114 @@
+import struct
+
+from common.protocol.client_request import ClientRequest
+
+
+class DispatchedRequest:
+    __slots__ = ('data', 'client_address', 'client_id', 'version', 'code', 'payload_size', 'payload')
+
+    def __init__(self, data, client_address):
+        """
+        A request on its way through the dispatcher. The header is unpacked once, when the request is created, and
+        the payload just before the handler is called - so middleware that rejects a request never pays for it.
+        :param data: the raw request bytes
+        :param client_address: the (ip, port) the request was received from
+        """
+        self.data = data
+        self.client_address = client_address
+        self.client_id, self.version, self.code, self.payload_size = ClientRequest.HEADER_STRUCT.unpack_from(data)
+        # set to the unpacked payload before the handler is called, or earlier by middleware that needs it
+        self.payload = None
+
+
+class Route:
+    __slots__ = ('code', 'handler', 'payload_type', 'payload_optional', 'call')
+
+    def __init__(self, code, handler, payload_type, payload_optional=False):
+        self.code = code
+        self.handler = handler
+        self.payload_type = payload_type
+        self.payload_optional = payload_optional
+        # the handler wrapped by the middleware of the route, rebuilt whenever middleware is added
+        self.call = None
+
+
+class RequestDispatcher:
+    def __init__(self, error_handler):
+        """
+        Routes requests to the handler registered for their request code. Handlers are called with the
+        DispatchedRequest, whose payload is unpacked into the payload type the handler was registered with, and
+        return the response.
+        Middleware wraps the handlers of all or some of the request codes, e.g. to time, count or reject requests,
+        without changing the handlers. A middleware is called as middleware(request, call_next) and either returns
+        call_next(request) or a response of its own.
+        :param error_handler: called as error_handler(request, reason) for requests that can't reach a handler -
+        reason is 'unknown_request' for an unregistered request code and 'malformed_request' for a payload that
+        can't be unpacked. Returns the response.
+        """
+        self.error_handler = error_handler
+        self.routes = dict()
+        # (middleware, codes) in the order they were added. codes is None for middleware of all the routes.
+        self.middleware = []
+        # the route of unregistered request codes, which goes through the middleware of all the routes
+        self.unknown_route = Route(None, lambda request: self.error_handler(request, 'unknown_request'), None)
+        self.build_chain(self.unknown_route)
+
+    def route(self, code, handler, payload_type=None, payload_optional=False):
+        """
+        Registers the handler of a request code. A request whose payload can't be unpacked into payload_type -
+        including an empty payload - is rejected as malformed before the handler is called.
+        :param payload_type: the type the payload is unpacked into, bytes for the raw payload bytes, or None for
+        requests without a payload
+        :param payload_optional: pass requests with an empty payload to the handler with a None payload, instead of
+        rejecting them
+        """
+        route = Route(code, handler, payload_type, payload_optional)
+        self.routes[code] = route
+        self.build_chain(route)
+
+    def add_middleware(self, middleware, codes=None):
+        """
+        Wraps the handlers of the request codes with middleware. Middleware added later runs inside the
+        middleware added before it.
+        :param codes: the request codes to wrap, None for all of them - including unknown request codes
+        """
+        self.middleware.append((middleware, None if codes is None else frozenset(codes)))
+        for route in self.routes.values():
+            self.build_chain(route)
+        self.build_chain(self.unknown_route)
+
+    def build_chain(self, route):
+        """
+        Composes the middleware of the route around its handler once, so dispatching a request is a dict lookup and
+        a call
+        """
+        call = self.bind_route(self.unpack_payload_and_handle, route)
+        for middleware, codes in reversed(self.middleware):
+            if codes is None or route.code in codes:
+                call = self.bind_middleware(middleware, call)
+        route.call = call
+
+    @staticmethod
+    def bind_route(call, route):
+        return lambda request: call(request, route)
+
+    @staticmethod
+    def bind_middleware(middleware, call_next):
+        return lambda request: middleware(request, call_next)
+
+    def unpack_payload_and_handle(self, request, route):
+        if route.payload_type is not None and request.payload is None and \
+                not (route.payload_optional and request.payload_size == 0):
+            try:
+                request.payload = ClientRequest.unpack_payload(request.data, request.payload_size, route.payload_type)
+            except (ValueError, struct.error):
+                return self.error_handler(request, 'malformed_request')
+        return route.handler(request)
+
+    def dispatch(self, request):
+        """
+        Runs the request through the middleware and the handler of its request code
+        :param request: a DispatchedRequest
+        :return: the response
+        """
+        return self.routes.get(request.code, self.unknown_route).call(request)
@@ -1,13 +1,20 @@
+import multiprocessing
+import os
+import signal
 import socket
 import struct
+import sys
 import threading
-import traceback
+import time
 from datetime import datetime, timedelta
 from typing import cast
 
-from common.cryptography_utils import generate_aes_key, decrypt_aes_cbc
+from common.cryptography_utils import generate_aes_key, decrypt_aes_cbc, decrypt_aes_cbc_fields
 from common.date_utils import get_datetime_from_ts_bytes, get_datetime_from_ts
 from common.file_utils import read_file_lines, write_lines_to_file
+from common.framing_utils import read_client_request, read_server_response
+from common.logging_utils import get_logger, get_hot_path_logger
+from common.metrics import ServerMetrics
 from common.network_utils import is_valid_port, is_valid_ip
 from common.protocol.authenticator import Authenticator
 from common.protocol.client_request import ClientRequest
@@ -20,12 +27,29 @@ from common.protocol.request_1029_send_message import SendMessageRequest
 from common.protocol.response_1608_message_server_registration_success import MessageServerRegistrationSuccessResponse
 from common.protocol.server_response import ServerResponse
 from common.protocol.ticket import Ticket
+from common.request_dispatcher import RequestDispatcher, DispatchedRequest
+from .message_sinks import MessagePipeline, StdoutSink
+from .replay_cache import ReplayCache
+from .session_store import Session, SessionStore
+from .shared_state import SharedSessionStore, SharedReplayCache
+
+logger = get_logger('message_server')
+# per-connection and per-request logs, which may be sampled or turned off
+request_logger = get_hot_path_logger('message_server')
 
 
 class MessageServer:
     VERSION = 24
-
-    def __init__(self, msg_server_config_file):
+    CONNECTION_IDLE_TIMEOUT_SECONDS = 30
+    DEFAULT_MAX_SESSIONS = 1000000
+    SESSION_REAP_INTERVAL_SECONDS = 1
+    AUTHENTICATOR_MAX_AGE_MINUTES = 10
+    MAX_CLOCK_SKEW_MINUTES = 5
+    # slots of the replay cache shared by worker processes
+    MAX_RECENT_AUTHENTICATORS = 2097152
+
+    def __init__(self, msg_server_config_file, max_sessions=None, workers=1, message_pipeline=None,
+                 metrics_port=None):
         """
         Initializes the message server. Requires the below parameters to be able to communicate with the auth server
         The server class expects a text file with at least 3 lines:
@@ -35,6 +59,13 @@ class MessageServer:
         4th line - the symmetrical key used to communicate with the auth server - if exists
         5th line - the server ID assigned by the auth server - if exists
         :param msg_server_config_file: path to config file
+        :param max_sessions: max number of client sessions kept in memory, least recently used ones are evicted
+        :param workers: number of worker processes accepting connections on the server port. With more than one,
+        the workers bind the port with SO_REUSEPORT and share the sessions and the replay cache through shared memory
+        :param message_pipeline: the MessagePipeline accepted messages are delivered through. Defaults to printing
+        them to stdout from a background thread. In multi-process mode every worker runs its own copy of it.
+        :param metrics_port: local HTTP port the Prometheus metrics are served on, None to not serve them.
+        Worker n serves its own metrics on metrics_port + n + 1.
         """
         self.config_file = msg_server_config_file
         lines = read_file_lines(msg_server_config_file)
@@ -48,7 +79,38 @@ class MessageServer:
         self.my_name = my_name
         self.auth_server_ip = auth_server_ip
         self.auth_server_port = auth_server_port
-        self.sessions = dict()
+        self.workers = workers
+        self.message_pipeline = message_pipeline if message_pipeline is not None else MessagePipeline([StdoutSink()])
+        self.metrics_port = metrics_port
+        self.metrics = ServerMetrics('message_server')
+        registry = self.metrics.registry
+        registry.gauge_function('message_server_sessions', lambda: self.sessions.stats()['live'], 'Valid sessions')
+        registry.gauge_function('message_server_workers', lambda: self.workers, 'Worker processes')
+        registry.gauge_function('message_server_queued_messages', lambda: self.message_pipeline.stats()['queued'],
+                                'Accepted messages waiting for delivery')
+        registry.gauge_function('message_server_delivered_messages',
+                                lambda: self.message_pipeline.stats()['delivered'], 'Messages delivered to the sinks')
+        registry.gauge_function('message_server_dropped_messages', lambda: self.message_pipeline.stats()['dropped'],
+                                'Messages dropped or rejected because the message queue was full')
+        if max_sessions is None:
+            max_sessions = self.DEFAULT_MAX_SESSIONS
+        if workers > 1:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise RuntimeError("Multiple workers require SO_REUSEPORT support!")
+            # created before the workers are forked, so they share the memory
+            self.sessions = SharedSessionStore(max_sessions)
+            self.replay_cache = SharedReplayCache(self.AUTHENTICATOR_MAX_AGE_MINUTES * 60,
+                                                  self.MAX_RECENT_AUTHENTICATORS)
+            registry.gauge_function('message_server_evicted_authenticators',
+                                    lambda: self.replay_cache.evicted_count.value,
+                                    'Authenticators forgotten before leaving the replay window')
+        else:
+            self.sessions = SessionStore(max_sessions)
+            self.replay_cache = ReplayCache(self.AUTHENTICATOR_MAX_AGE_MINUTES * 60)
+        self.dispatcher = RequestDispatcher(self.reject_request)
+        self.dispatcher.route(SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE, self.process_session_key_received,
+                              SendSessionKeyRequest)
+        self.dispatcher.route(SEND_MESSAGE_REQUEST_CODE, self.process_message_send_request, SendMessageRequest)
         if len(lines) == 5:
             self.auth_server_key = bytes.fromhex(lines[3])
             self.message_server_id = bytes.fromhex(lines[4])
@@ -68,12 +130,44 @@ class MessageServer:
         if self.auth_server_key is None:
             self.register_with_auth_server()
 
-        # Create a socket server
+        if self.workers > 1:
+            context = multiprocessing.get_context('fork')
+            worker_processes = [context.Process(target=self.serve, args=(number,), name=f'worker-{number}', daemon=True)
+                                for number in range(self.workers)]
+            for worker_process in worker_processes:
+                worker_process.start()
+            logger.info('Messaged server %s started %d workers on port %d!', self.my_name, self.workers, self.my_port)
+            self.metrics.start_http_server(self.metrics_port)
+            # set after forking, so only the parent turns SIGTERM into an exit that takes the workers down with it
+            signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+            try:
+                for worker_process in worker_processes:
+                    worker_process.join()
+            finally:
+                for worker_process in worker_processes:
+                    worker_process.terminate()
+        else:
+            self.sessions.start_reaper(self.SESSION_REAP_INTERVAL_SECONDS)
+            logger.info('Messaged server %s server started on port %d!', self.my_name, self.my_port)
+            self.serve()
+
+    def serve(self, worker_number=None):
+        """
+        Accepts connections on the server port, serving each one on its own thread.
+        In multi-process mode every worker runs its own accept loop on its own SO_REUSEPORT socket, and the kernel
+        spreads the incoming connections between them.
+        :param worker_number: the number of the worker process, None in single process mode
+        """
+        self.message_pipeline.start(worker_number)
+        self.metrics.start_http_server(self.metrics_port, worker_number)
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.workers > 1:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_socket.bind((self.my_ip, self.my_port))
         server_socket.listen()
 
-        print(f'Messaged server {self.my_name} server started on port {self.my_port}!')
+        if self.workers > 1:
+            logger.info('Worker %d is accepting connections', os.getpid())
         while True:
             client_socket, client_address = server_socket.accept()
             client_handler = threading.Thread(target=self.handle_client_request, args=(client_socket, client_address))
@@ -93,80 +187,93 @@ class MessageServer:
             auth_server_key = generate_aes_key()
             payload = ServerRegistrationRequest(self.my_name, auth_server_key, self.my_port)
             request = ClientRequest(bytes(16), self.VERSION, SERVER_REGISTRATION_CODE, payload)
-            client_socket.send(request.pack())
-            print("Server registration request sent!")
+            client_socket.sendall(request.pack())
+            logger.info("Server registration request sent!")
             # Receive and print the response
-            response_bytes = client_socket.recv(1024)
+            response_bytes = read_server_response(client_socket)
 
             response = ServerResponse.unpack(response_bytes, MessageServerRegistrationSuccessResponse)
             if response.code == SERVER_REGISTRATION_SUCCESS_CODE:
-                print(f"Server registered - ID: {response.payload.server_id.hex()}")
+                logger.info("Server registered - ID: %s", response.payload.server_id.hex())
                 self.message_server_id = response.payload.server_id
                 self.auth_server_key = auth_server_key
                 write_lines_to_file(self.config_file, [self.auth_server_key.hex(), self.message_server_id.hex()])
             else:
-                print(f"Error {response.code} - Server creation failed!")
+                logger.error("Error %d - Server creation failed!", response.code)
 
         finally:
             # Close the socket
-            print("Closing the connection from client side")
+            logger.info("Closing the connection from client side")
             client_socket.close()
 
     def handle_client_request(self, client_socket, client_address):
         """
-        Gets the socket object and client address and handles the request
+        Gets the socket object and client address and serves requests on the connection until the client closes it
+        or it is idle for CONNECTION_IDLE_TIMEOUT_SECONDS.
+        Requests are handled one after the other, so a client may pipeline several requests and read the responses
+        in the same order.
         :param client_socket:
         :param client_address:
         :return:
         """
-        print(f"Connection from {client_address}")
-
-        # Receiving data in chunks
-        received_data = b''
-        while True:
-            chunk = client_socket.recv(1024)
-            received_data += chunk
-            if len(chunk) < 1024:
-                break
-
-        print(f"Received a request from {client_address}")
+        request_logger.info("Connection from %s", client_address)
+        self.metrics.connection_opened()
+        client_socket.settimeout(self.CONNECTION_IDLE_TIMEOUT_SECONDS)
 
         try:
-            response = self.process_request(received_data, client_socket)
-            # Send a response back to the client
-            client_socket.send(response.pack())
-
-        except Exception as e:
-            print(f"error  {e}")
-            traceback.print_exc()
-            client_socket.send(ServerResponse(self.VERSION, GENERAL_SERVER_ERROR_CODE, None).pack())
+            while True:
+                received_data = read_client_request(client_socket)
+                if received_data is None:
+                    break
+                request_logger.info("Received a request from %s", client_address)
+
+                start_time = time.perf_counter()
+                request = DispatchedRequest(received_data, client_address)
+                try:
+                    response = self.dispatcher.dispatch(request)
+                except (ValueError, RuntimeError, struct.error) as e:
+                    # the handlers raise these for requests they refuse, e.g. replays or unknown sessions
+                    request_logger.info("Rejected request %d from %s: %s", request.code, client_address, e)
+                    self.metrics.client_error('invalid_request')
+                    response = ServerResponse(self.VERSION, GENERAL_SERVER_ERROR_CODE, None)
+                except Exception:
+                    logger.exception("Error handling a request from %s", client_address)
+                    self.metrics.error('internal_error')
+                    response = ServerResponse(self.VERSION, GENERAL_SERVER_ERROR_CODE, None)
+
+                # Send a response back to the client
+                packed_response = response.pack()
+                client_socket.sendall(packed_response)
+                self.metrics.request_handled(request.code, start_time, len(received_data), len(packed_response))
+
+        except socket.timeout:
+            request_logger.info("Connection with %s was idle for %d seconds.", client_address,
+                                self.CONNECTION_IDLE_TIMEOUT_SECONDS)
+
+        except ConnectionError as e:
+            request_logger.warning("Connection with %s ended before a full request was received: %s", client_address, e)
+            self.metrics.error('incomplete_request')
+
+        except Exception:
+            # The stream can't be trusted after a framing error, so report it and drop the connection
+            logger.exception("Error reading a request from %s", client_address)
+            self.metrics.error('framing_error')
+            client_socket.sendall(ServerResponse(self.VERSION, GENERAL_SERVER_ERROR_CODE, None).pack())
 
         finally:
-            print(f"Connection with {client_address} closed.")
+            request_logger.info("Connection with %s closed.", client_address)
+            self.metrics.connection_closed()
             client_socket.close()
 
-    def process_request(self, request, client_socket):
-        request_code = self.get_request_code(request)
-        if request_code == SEND_SESSION_KEY_TO_SERVER_REQUEST_CODE:
-            return self.process_session_key_received(request)
-        elif request_code == SEND_MESSAGE_REQUEST_CODE:
-            return self.process_message_send_request(request)
-        else:
-            print("Unknown request!")
-            return ServerResponse(self.VERSION, GENERAL_SERVER_ERROR_CODE, None)
-
-    def get_request_code(self, request):
-        pass
-
-    @staticmethod
-    def get_request_code(request):
-        bytes_18_19 = request[17:19]
-        return struct.unpack('<h', bytes_18_19)[0]
+    def reject_request(self, request, reason):
+        # rejections are logged on the sampled hot path, so a flood of bad requests can't flood the logs
+        request_logger.info("Rejected request %d from %s: %s", request.code, request.client_address, reason)
+        self.metrics.client_error(reason)
+        return ServerResponse(self.VERSION, GENERAL_SERVER_ERROR_CODE, None)
 
     def process_session_key_received(self, request):
-        client_request = ClientRequest.unpack(request, payload_type=SendSessionKeyRequest)
-        client_payload = cast(SendSessionKeyRequest, client_request.payload)
-        print(f'Received ticket from {client_request.client_id.hex()}')
+        client_payload = cast(SendSessionKeyRequest, request.payload)
+        request_logger.info('Received ticket from %s', request.client_id.hex())
         authenticator = Authenticator.unpack(client_payload.authenticator)
         ticket = Ticket.unpack(client_payload.ticket)
         if ticket.server_id != self.message_server_id:
@@ -176,46 +283,41 @@ class MessageServer:
         if ticket_time > now_time:
             raise ValueError("Ticket creation time is in the future!")
 
-        ticket_expiration_timestamp = decrypt_aes_cbc(self.auth_server_key, ticket.encrypted_expiration_time, ticket.iv)
+        ticket_expiration_timestamp, session_key = decrypt_aes_cbc_fields(
+            self.auth_server_key, [ticket.encrypted_expiration_time, ticket.encrypted_session_key], ticket.iv)
         ticket_expiration_time = get_datetime_from_ts_bytes(ticket_expiration_timestamp)
 
-        session_key = decrypt_aes_cbc(self.auth_server_key, ticket.encrypted_session_key, ticket.iv)
-
         # validate authenticator
-        authenticator_server_id = decrypt_aes_cbc(session_key, authenticator.encrypted_server_id, authenticator.iv)
-        authenticator_client_id = decrypt_aes_cbc(session_key, authenticator.encrypted_client_id, authenticator.iv)
-        authenticator_creation_time = get_datetime_from_ts_bytes(
-            decrypt_aes_cbc(session_key, authenticator.encrypted_creation_time, authenticator.iv))
-
-        if authenticator_creation_time < now_time - timedelta(minutes=10):
-            raise ValueError("Authenticator is older than 10 minutes!")
-        if authenticator_server_id != self.message_server_id or authenticator_client_id != client_request.client_id:
+        authenticator_server_id, authenticator_client_id, authenticator_creation_timestamp = decrypt_aes_cbc_fields(
+            session_key, [authenticator.encrypted_server_id, authenticator.encrypted_client_id,
+                          authenticator.encrypted_creation_time], authenticator.iv)
+        authenticator_creation_time = get_datetime_from_ts_bytes(authenticator_creation_timestamp)
+
+        if authenticator_creation_time < now_time - timedelta(minutes=self.AUTHENTICATOR_MAX_AGE_MINUTES):
+            raise ValueError(f"Authenticator is older than {self.AUTHENTICATOR_MAX_AGE_MINUTES} minutes!")
+        # bounds the creation times the replay cache has to remember
+        if authenticator_creation_time > now_time + timedelta(minutes=self.MAX_CLOCK_SKEW_MINUTES):
+            raise ValueError("Authenticator creation time is in the future!")
+        if authenticator_server_id != self.message_server_id or authenticator_client_id != request.client_id:
             raise ValueError("Server or client IDs do not match!")
+        if not self.replay_cache.add(authenticator.replay_key(), authenticator_creation_time.timestamp()):
+            raise ValueError("Authenticator was already used!")
 
-        print("Authenticator decrypted with session key, and validated! Sending accept to client.")
-        self.sessions[ticket.client_id.hex()] = MessageServer.Session(session_key, ticket.iv, ticket_expiration_time)
+        request_logger.info("Authenticator decrypted with session key, and validated! Sending accept to client.")
+        self.sessions.put(ticket.client_id.hex(), Session(session_key, ticket.iv, ticket_expiration_time))
         response = ServerResponse(self.VERSION, SESSION_KEY_ACCEPTED_RESPONSE_CODE, None)
         return response
 
     def process_message_send_request(self, request):
-        client_request = ClientRequest.unpack(request, payload_type=SendMessageRequest)
-        client_payload = cast(SendMessageRequest, client_request.payload)
-        session = self.sessions[client_request.client_id.hex()]
+        client_payload = cast(SendMessageRequest, request.payload)
+        session = self.sessions.get(request.client_id.hex())
         if session is None:
-            raise RuntimeError(f'Could not find client session with client id {client_request.client_id.hex()}')
-        now = datetime.now()
-        if session.expiration_time < now:
-            raise RuntimeError(f'Session key expired! Please get a new ticket from the auth server!')
+            raise RuntimeError(f'Could not find a valid session with client id {request.client_id.hex()}. '
+                               f'Please get a new ticket from the auth server!')
 
         decrypted_message = decrypt_aes_cbc(session.key, client_payload.encrypted_message, client_payload.message_iv)
 
-        print(f"Message from P{client_request.client_id.hex()}:\n{decrypted_message.decode('utf-8')}")
+        if not self.message_pipeline.submit(request.client_id.hex(), decrypted_message.decode('utf-8')):
+            raise RuntimeError("The message queue is full, please try again later!")
         response = ServerResponse(self.VERSION, MESSAGE_ACCEPTED_RESPONSE_CODE, None)
         return response
-
-    class Session:
-            def __init__(self, key, iv, expiration_time):
-                self.expiration_time = expiration_time
-                self.iv = iv
-                self.key = key
-
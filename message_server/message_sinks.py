@@ -0,0 +1,199 @@
+import json
+import os
+import queue
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+
+from common.logging_utils import get_logger
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP = 'drop'
+OVERFLOW_REJECT = 'reject'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP, OVERFLOW_REJECT)
+
+logger = get_logger('message_server.message_sinks')
+
+
+class MessageSink:
+    """
+    Receives the accepted messages from the MessagePipeline writer thread, in batches of
+    (received time, client id hex, message text) tuples.
+    """
+
+    def start(self, process_tag=None):
+        """
+        Called on the writer thread before the first batch
+        :param process_tag: set when several worker processes run their own pipelines, to tell their outputs apart
+        """
+
+    def write(self, messages):
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Called on the writer thread after the last batch
+        """
+
+
+class StdoutSink(MessageSink):
+    def write(self, messages):
+        sys.stdout.write(''.join(f"Message from P{client_id}:\n{text}\n" for _, client_id, text in messages))
+        sys.stdout.flush()
+
+
+class RotatingFileSink(MessageSink):
+    def __init__(self, file_path, max_bytes=64 * 1024 * 1024, backup_count=5):
+        """
+        Appends messages to a log file as JSON lines. Once the file reaches max_bytes it is renamed to
+        file_path.1 (shifting the older backups up to file_path.backup_count) and a new file is started.
+        :param file_path: path of the log file. Worker processes append their tag to it.
+        :param max_bytes: size the file is rotated at
+        :param backup_count: number of rotated files kept
+        """
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = None
+
+    def start(self, process_tag=None):
+        if process_tag is not None:
+            self.file_path = f'{self.file_path}.{process_tag}'
+        self.file = open(self.file_path, 'ab')
+
+    def write(self, messages):
+        self.file.write(''.join(
+            json.dumps({'time': received_time.isoformat(), 'client_id': client_id, 'message': text}) + '\n'
+            for received_time, client_id, text in messages).encode('utf-8'))
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        for number in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.file_path}.{number}'):
+                os.replace(f'{self.file_path}.{number}', f'{self.file_path}.{number + 1}')
+        if self.backup_count > 0:
+            os.replace(self.file_path, f'{self.file_path}.1')
+        else:
+            os.remove(self.file_path)
+        self.file = open(self.file_path, 'ab')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class RingBufferSink(MessageSink):
+    def __init__(self, capacity):
+        """
+        Keeps the last `capacity` messages in memory
+        """
+        self.messages = deque(maxlen=capacity)
+
+    def write(self, messages):
+        self.messages.extend(messages)
+
+    def recent(self, count=None):
+        """
+        :return: the last count messages (all of the kept ones by default), oldest first
+        """
+        messages = list(self.messages)
+        return messages if count is None else messages[-count:]
+
+
+class MessagePipeline:
+    def __init__(self, sinks, max_queue_size=10000, max_batch_size=256, overflow_policy=OVERFLOW_BLOCK):
+        """
+        Delivers the accepted messages to the sinks on a background writer thread, so the request handlers don't
+        wait for the sinks' I/O. The writer takes every message queued while it was writing the previous batch, up
+        to max_batch_size, and hands them to each sink at once.
+        :param sinks: list of MessageSink
+        :param max_queue_size: max number of messages waiting for the writer
+        :param max_batch_size: max number of messages written together
+        :param overflow_policy: what submit does when the queue is full - 'block' waits for room, slowing down
+        the clients, 'drop' discards the message and 'reject' discards it and returns False
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow_policy}!')
+        self.sinks = sinks
+        self.max_batch_size = max_batch_size
+        self.overflow_policy = overflow_policy
+        self.pending = queue.Queue(max_queue_size)
+        self.delivered_count = 0
+        self.dropped_count = 0
+        self.thread = None
+
+    def start(self, process_tag=None):
+        """
+        Starts the writer thread. Called in every worker process, as threads do not survive a fork.
+        """
+        self.thread = threading.Thread(target=self.run, args=(process_tag,), name='message-pipeline', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Writes the messages that are already queued, closes the sinks and stops the writer thread
+        """
+        self.pending.put(None)
+        self.thread.join()
+
+    def submit(self, client_id, text):
+        """
+        Queues an accepted message for delivery
+        :param client_id: hex id of the sending client
+        :param text: the decrypted message
+        :return: False if the message was rejected because the queue is full, True otherwise
+        """
+        message = (datetime.now(), client_id, text)
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            self.pending.put(message)
+            return True
+        try:
+            self.pending.put_nowait(message)
+        except queue.Full:
+            self.dropped_count += 1
+            return self.overflow_policy == OVERFLOW_DROP
+        return True
+
+    def next_batch(self):
+        """
+        Blocks until a message is queued, then takes up to max_batch_size queued messages.
+        :return: a tuple of the batch and whether the pipeline was asked to stop
+        """
+        batch = []
+        message = self.pending.get()
+        while message is not None:
+            batch.append(message)
+            if len(batch) >= self.max_batch_size:
+                break
+            try:
+                message = self.pending.get_nowait()
+            except queue.Empty:
+                break
+        return batch, message is None
+
+    def run(self, process_tag):
+        for sink in self.sinks:
+            sink.start(process_tag)
+        stopped = False
+        while not stopped:
+            batch, stopped = self.next_batch()
+            if len(batch) == 0:
+                continue
+            for sink in self.sinks:
+                try:
+                    sink.write(batch)
+                except Exception:
+                    logger.exception("%s could not write %d messages", type(sink).__name__, len(batch))
+            self.delivered_count += len(batch)
+        for sink in self.sinks:
+            sink.close()
+
+    def stats(self):
+        """
+        :return: a dict of the queued, delivered and dropped messages counters
+        """
+        return {'queued': self.pending.qsize(), 'delivered': self.delivered_count, 'dropped': self.dropped_count}
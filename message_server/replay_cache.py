@@ -0,0 +1,64 @@
+import hashlib
+import threading
+import time
+
+
+class ReplayCache:
+    def __init__(self, window_seconds, bucket_seconds=60):
+        """
+        Remembers the authenticators accepted in the last window_seconds, to reject replayed ones.
+        Authenticators are kept as 8 byte digests in one set per bucket_seconds of their creation time. A replayed
+        authenticator has the same creation time, so a lookup checks a single set, and whole sets are dropped once
+        their creation times are older than the window - so memory stays proportional to the authentication rate.
+        :param window_seconds: max age of an accepted authenticator
+        :param bucket_seconds: the creation time span of a bucket
+        """
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        # bucket number -> set of authenticator digests
+        self.buckets = dict()
+        self.oldest_bucket_number = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def digest(replay_key):
+        return int.from_bytes(hashlib.blake2b(bytes(replay_key), digest_size=8).digest(), 'little')
+
+    def add(self, replay_key, creation_timestamp, now=None):
+        """
+        Records an authenticator as used
+        :param replay_key: the authenticator's Authenticator.replay_key()
+        :param creation_timestamp: the authenticator's creation time, as a unix timestamp
+        :param now: the current unix timestamp, for testing
+        :return: True if the authenticator was not seen before, False if it is a replay or older than the window
+        """
+        if now is None:
+            now = time.time()
+        digest = self.digest(replay_key)
+        bucket_number = int(creation_timestamp // self.bucket_seconds)
+        with self.lock:
+            self.drop_expired_buckets(now)
+            if bucket_number < self.oldest_bucket_number:
+                return False
+            bucket = self.buckets.get(bucket_number)
+            if bucket is None:
+                bucket = set()
+                self.buckets[bucket_number] = bucket
+            if digest in bucket:
+                return False
+            bucket.add(digest)
+            return True
+
+    def drop_expired_buckets(self, now):
+        """
+        Drops the buckets whose creation times are all older than the window. Called under the lock.
+        """
+        oldest_bucket_number = int((now - self.window_seconds) // self.bucket_seconds)
+        if oldest_bucket_number == self.oldest_bucket_number:
+            return
+        self.oldest_bucket_number = oldest_bucket_number
+        for bucket_number in [number for number in self.buckets if number < oldest_bucket_number]:
+            del self.buckets[bucket_number]
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in list(self.buckets.values()))
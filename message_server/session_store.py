@@ -0,0 +1,126 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+from common.cryptography_utils import evict_cipher_key
+
+
+class Session:
+    __slots__ = ('key', 'iv', 'expiration_time', 'expiration_timestamp')
+
+    def __init__(self, key, iv, expiration_time):
+        """
+        A client session on the message server
+        :param key: the session key
+        :param iv: the ticket's iv
+        :param expiration_time: datetime the session key expires at
+        """
+        self.key = key
+        self.iv = iv
+        self.expiration_time = expiration_time
+        self.expiration_timestamp = expiration_time.timestamp()
+
+
+class SessionStore:
+    def __init__(self, max_sessions):
+        """
+        Holds the message server's sessions by client id.
+        Expired sessions are reclaimed in expiration order from a heap - O(log n) per session - either when they
+        are looked up or by a background reaper thread. When the store holds max_sessions sessions, the least
+        recently used one is evicted to make room for a new one.
+        :param max_sessions: max number of sessions kept in memory
+        """
+        self.max_sessions = max_sessions
+        # client id -> Session, in least recently used first order
+        self.sessions = OrderedDict()
+        # (expiration timestamp, client id, session object id, session) of every stored session - the object id
+        # breaks ties between sessions of the same client, as sessions are not comparable. Entries of sessions that
+        # were replaced or evicted stay in the heap until they are popped or the heap is compacted
+        self.expiration_heap = []
+        self.lock = threading.Lock()
+        self.expired_count = 0
+        self.evicted_count = 0
+        self.reaper_thread = None
+
+    def put(self, client_id, session: Session):
+        with self.lock:
+            previous_session = self.sessions.pop(client_id, None)
+            if previous_session is not None:
+                self.discard(previous_session)
+            self.sessions[client_id] = session
+            heapq.heappush(self.expiration_heap, (session.expiration_timestamp, client_id, id(session), session))
+            while len(self.sessions) > self.max_sessions:
+                _, evicted_session = self.sessions.popitem(last=False)
+                self.discard(evicted_session)
+                self.evicted_count += 1
+            if len(self.expiration_heap) > 2 * len(self.sessions) + 1024:
+                self.compact()
+
+    def get(self, client_id):
+        """
+        :return: the client's session, or None if there is none or it expired
+        """
+        with self.lock:
+            session = self.sessions.get(client_id)
+            if session is None:
+                return None
+            if session.expiration_timestamp <= time.time():
+                del self.sessions[client_id]
+                self.discard(session)
+                self.expired_count += 1
+                return None
+            self.sessions.move_to_end(client_id)
+            return session
+
+    def reap_expired(self, now=None):
+        """
+        Removes the sessions that expired by now
+        :return: the number of removed sessions
+        """
+        if now is None:
+            now = time.time()
+        reaped = 0
+        with self.lock:
+            while len(self.expiration_heap) > 0 and self.expiration_heap[0][0] <= now:
+                _, client_id, _, session = heapq.heappop(self.expiration_heap)
+                if self.sessions.get(client_id) is session:
+                    del self.sessions[client_id]
+                    self.discard(session)
+                    reaped += 1
+            self.expired_count += reaped
+        return reaped
+
+    def start_reaper(self, interval_seconds):
+        """
+        Starts a daemon thread that reaps the expired sessions every interval_seconds
+        """
+        def reap_forever():
+            while True:
+                time.sleep(interval_seconds)
+                self.reap_expired()
+
+        self.reaper_thread = threading.Thread(target=reap_forever, name='session-reaper', daemon=True)
+        self.reaper_thread.start()
+
+    def compact(self):
+        """
+        Rebuilds the heap from the stored sessions, dropping the entries of replaced and evicted sessions.
+        Called under the lock.
+        """
+        self.expiration_heap = [(session.expiration_timestamp, client_id, id(session), session)
+                                for client_id, session in self.sessions.items()]
+        heapq.heapify(self.expiration_heap)
+
+    @staticmethod
+    def discard(session):
+        evict_cipher_key(session.key)
+
+    def stats(self):
+        """
+        :return: a dict of the live, expired and evicted sessions counters
+        """
+        return {'live': len(self.sessions), 'expired': self.expired_count, 'evicted': self.evicted_count}
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,186 @@
+import mmap
+import multiprocessing
+import struct
+import time
+from datetime import datetime
+
+from .replay_cache import ReplayCache
+from .session_store import Session
+
+SLOT_FREE = 0
+SLOT_USED = 1
+
+
+class SharedTable:
+    def __init__(self, capacity, slot_struct: struct.Struct, ways=16, lock_count=256):
+        """
+        A fixed size set-associative table in anonymous shared memory, shared with the processes forked after it
+        was created. Every key maps to a set of `ways` consecutive slots, so an operation probes at most `ways`
+        slots, and the sets are guarded by striped multiprocessing locks.
+        :param capacity: minimal number of slots, rounded up to a power of two number of sets
+        :param slot_struct: the struct every slot is packed with
+        :param ways: number of slots per set
+        :param lock_count: max number of locks the sets are striped over
+        """
+        self.slot_struct = slot_struct
+        self.ways = ways
+        self.set_count = 1
+        while self.set_count * ways < capacity:
+            self.set_count *= 2
+        self.map = mmap.mmap(-1, self.set_count * ways * slot_struct.size)
+        context = multiprocessing.get_context('fork')
+        self.locks = [context.Lock() for _ in range(min(lock_count, self.set_count))]
+
+    def set_offsets(self, set_index):
+        """
+        :return: the offsets of the slots of a set
+        """
+        begin = set_index * self.ways * self.slot_struct.size
+        return range(begin, begin + self.ways * self.slot_struct.size, self.slot_struct.size)
+
+    def lock_for(self, set_index):
+        return self.locks[set_index % len(self.locks)]
+
+
+class SharedSessionStore(SharedTable):
+    # state, client id, session key, ticket iv, expiration timestamp
+    SLOT_STRUCT = struct.Struct('<B7x16s32s16sd')
+
+    def __init__(self, max_sessions):
+        """
+        Holds the message server's sessions in shared memory, so a session created by one worker process is visible
+        to the others. Has the get/put interface of SessionStore.
+        Expired sessions need no reaper - their slots are reused by new sessions of the same set. When all the
+        slots of a set hold valid sessions, the one closest to expiring is evicted.
+        :param max_sessions: number of session slots
+        """
+        super().__init__(max_sessions, self.SLOT_STRUCT)
+        context = multiprocessing.get_context('fork')
+        self.expired_count = context.Value('Q', 0)
+        self.evicted_count = context.Value('Q', 0)
+
+    def set_index(self, client_id_bytes):
+        return int.from_bytes(client_id_bytes[:8], 'little') & (self.set_count - 1)
+
+    def put(self, client_id, session: Session):
+        client_id_bytes = bytes.fromhex(client_id)
+        set_index = self.set_index(client_id_bytes)
+        now = time.time()
+        with self.lock_for(set_index):
+            client_offset = None
+            free_offset = None
+            expiring_offset = None
+            expiring_timestamp = None
+            for offset in self.set_offsets(set_index):
+                state, slot_client_id, _, _, expiration_timestamp = self.SLOT_STRUCT.unpack_from(self.map, offset)
+                if state == SLOT_USED and slot_client_id == client_id_bytes:
+                    client_offset = offset
+                    break
+                if state == SLOT_FREE or expiration_timestamp <= now:
+                    if free_offset is None:
+                        free_offset = offset
+                elif expiring_timestamp is None or expiration_timestamp < expiring_timestamp:
+                    expiring_offset = offset
+                    expiring_timestamp = expiration_timestamp
+
+            if client_offset is not None:
+                offset = client_offset
+            elif free_offset is not None:
+                offset = free_offset
+            else:
+                offset = expiring_offset
+                with self.evicted_count.get_lock():
+                    self.evicted_count.value += 1
+            self.SLOT_STRUCT.pack_into(self.map, offset, SLOT_USED, client_id_bytes, session.key, session.iv,
+                                       session.expiration_timestamp)
+
+    def get(self, client_id):
+        """
+        :param client_id: hex client id
+        :return: the client's session, or None if it has none or it expired
+        """
+        client_id_bytes = bytes.fromhex(client_id)
+        set_index = self.set_index(client_id_bytes)
+        with self.lock_for(set_index):
+            for offset in self.set_offsets(set_index):
+                state, slot_client_id, key, iv, expiration_timestamp = self.SLOT_STRUCT.unpack_from(self.map, offset)
+                if state != SLOT_USED or slot_client_id != client_id_bytes:
+                    continue
+                if expiration_timestamp <= time.time():
+                    self.SLOT_STRUCT.pack_into(self.map, offset, SLOT_FREE, bytes(16), bytes(32), bytes(16), 0)
+                    with self.expired_count.get_lock():
+                        self.expired_count.value += 1
+                    return None
+                return Session(key, iv, datetime.fromtimestamp(expiration_timestamp))
+        return None
+
+    def stats(self):
+        """
+        :return: a dict of the live, expired and evicted sessions counters
+        """
+        now = time.time()
+        live = 0
+        for state, _, _, _, expiration_timestamp in self.SLOT_STRUCT.iter_unpack(self.map):
+            if state == SLOT_USED and expiration_timestamp > now:
+                live += 1
+        return {'live': live, 'expired': self.expired_count.value, 'evicted': self.evicted_count.value}
+
+
+class SharedReplayCache(SharedTable):
+    # authenticator digest (0 for a free slot), expiration timestamp
+    SLOT_STRUCT = struct.Struct('<Qd')
+
+    def __init__(self, window_seconds, max_authenticators):
+        """
+        Remembers the authenticators accepted by all the worker processes in the last window_seconds.
+        Has the add interface of ReplayCache. Unlike it, the memory is fixed: when all the slots of a set hold
+        authenticators that are still in the window, the one closest to leaving the window is evicted, so a
+        legitimate authentication is never refused for lack of room. The evictions are counted - an evicted
+        authenticator could be replayed until it leaves the window, so max_authenticators should be sized to keep
+        them at zero.
+        :param window_seconds: max age of an accepted authenticator
+        :param max_authenticators: number of slots, should exceed the authenticators accepted in a window
+        """
+        super().__init__(max_authenticators, self.SLOT_STRUCT)
+        self.window_seconds = window_seconds
+        context = multiprocessing.get_context('fork')
+        self.evicted_count = context.Value('Q', 0)
+
+    def add(self, replay_key, creation_timestamp, now=None):
+        """
+        Records an authenticator as used
+        :param replay_key: the authenticator's Authenticator.replay_key()
+        :param creation_timestamp: the authenticator's creation time, as a unix timestamp
+        :param now: the current unix timestamp, for testing
+        :return: True if the authenticator was not seen before, False if it is a replay or older than the window
+        """
+        if now is None:
+            now = time.time()
+        expiration_timestamp = creation_timestamp + self.window_seconds
+        if expiration_timestamp <= now:
+            return False
+        digest = ReplayCache.digest(replay_key) or 1
+        set_index = digest & (self.set_count - 1)
+        with self.lock_for(set_index):
+            free_offset = None
+            expiring_offset = None
+            expiring_timestamp = None
+            for offset in self.set_offsets(set_index):
+                slot_digest, slot_expiration_timestamp = self.SLOT_STRUCT.unpack_from(self.map, offset)
+                if slot_digest == digest and slot_expiration_timestamp > now:
+                    return False
+                if slot_digest == 0 or slot_expiration_timestamp <= now:
+                    if free_offset is None:
+                        free_offset = offset
+                elif expiring_timestamp is None or slot_expiration_timestamp < expiring_timestamp:
+                    expiring_offset = offset
+                    expiring_timestamp = slot_expiration_timestamp
+
+            if free_offset is not None:
+                offset = free_offset
+            else:
+                offset = expiring_offset
+                with self.evicted_count.get_lock():
+                    self.evicted_count.value += 1
+            self.SLOT_STRUCT.pack_into(self.map, offset, digest, expiration_timestamp)
+            return True
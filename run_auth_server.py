@@ -1,10 +1,50 @@
-from auth_server import auth_server
-from auth_server.auth_server import AuthServer
-from common.file_utils import read_file_lines
+import argparse
+
+from auth_server.auth_server import AuthServer, SERVER_MODES
+from auth_server.registration_writer import FSYNC_POLICIES, FSYNC_BATCH
+from common.logging_utils import configure_logging
+
+
+def parse_rate_limit(value):
+    """
+    :param value: 'rate' or 'rate:burst', in requests per second. The burst defaults to one second of requests.
+    :return: the (rate, burst) tuple
+    """
+    rate, _, burst = value.partition(':')
+    try:
+        rate = float(rate)
+        burst = float(burst) if burst else max(rate, 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a rate[:burst] limit')
+    if rate <= 0 or burst < 1:
+        raise argparse.ArgumentTypeError('the rate must be positive and the burst at least 1')
+    return rate, burst
 
 
 def main():
-    server = AuthServer("port.info")
+    parser = argparse.ArgumentParser(description='Kerberos auth server')
+    parser.add_argument('--port-file', default='port.info', help='file with the port (and optionally the mode)')
+    parser.add_argument('--mode', choices=SERVER_MODES, help='overrides the server mode set in the port file')
+    parser.add_argument('--max-connections', type=int, help='max concurrent requests in async mode')
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES, default=FSYNC_BATCH,
+                        help="'batch' fsyncs registrations before acknowledging them, 'none' leaves it to the OS")
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes sharing the port with SO_REUSEPORT')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus metrics on this local HTTP port (worker n uses the port + n + 1)')
+    parser.add_argument('--client-rate-limit', type=parse_rate_limit, metavar='RATE[:BURST]',
+                        help='max tickets per second issued to each client id, counting every ticket of a batch')
+    parser.add_argument('--ip-rate-limit', type=parse_rate_limit, metavar='RATE[:BURST]',
+                        help='max requests per second of each ip address')
+    parser.add_argument('--max-in-flight-requests', type=int,
+                        help='max requests processed at once, the rest are rejected as busy. In async mode it also '
+                             'rejects requests over --max-connections as busy instead of queueing them')
+    args = parser.parse_args()
+
+    configure_logging(['auth_server'])
+
+    server = AuthServer(args.port_file, args.mode, args.max_connections, args.fsync, args.workers,
+                        args.metrics_port, args.client_rate_limit, args.ip_rate_limit, args.max_in_flight_requests)
 
 
 if __name__ == "__main__":
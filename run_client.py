@@ -1,8 +1,38 @@
+import argparse
+
 from client.client import Client
+from client.client_cli import ClientCli
+from client.ticket_cache import TicketCache
+from common.logging_utils import configure_logging
+from common.network_utils import is_valid_ip, is_valid_port
+
+
+def parse_address(address):
+    """
+    :param address: 'ip:port'
+    :return: an (ip, port) tuple
+    """
+    ip_address, _, port = address.rpartition(':')
+    if not is_valid_ip(ip_address) or not is_valid_port(port):
+        raise argparse.ArgumentTypeError(f'invalid address {address}')
+    return ip_address, int(port)
 
 
 def main():
-    client = Client()
+    parser = argparse.ArgumentParser(description='Interactive Kerberos client')
+    parser.add_argument('--auth-server', type=parse_address,
+                        default=f'{Client.DEFAULT_AUTH_SERVER_IP}:{Client.DEFAULT_AUTH_SERVER_PORT}',
+                        help='the auth server ip:port')
+    parser.add_argument('--config-file', default=ClientCli.CONFIG_FILE,
+                        help="file the client's name and id are saved in")
+    parser.add_argument('--ticket-cache', help='keep the tickets in this file across runs, encrypted with the password')
+    args = parser.parse_args()
+
+    # the client is interactive, so its logs are printed in order with its prompts, as plain lines
+    configure_logging(['client'], log_format='%(message)s', background=False)
+    auth_server_ip, auth_server_port = args.auth_server
+    client = Client(auth_server_ip, auth_server_port, ticket_cache=TicketCache(args.ticket_cache))
+    ClientCli(client, args.config_file).run()
 
 
 if __name__ == "__main__":
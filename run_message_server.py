@@ -1,8 +1,50 @@
+import argparse
+
+from common.logging_utils import configure_logging
 from message_server.message_server import MessageServer
+from message_server.message_sinks import MessagePipeline, StdoutSink, RotatingFileSink, RingBufferSink, \
+    OVERFLOW_POLICIES, OVERFLOW_BLOCK
+
+
+def create_sink(sink_spec):
+    """
+    :param sink_spec: 'stdout', 'file:<path>' or 'ring:<capacity>'
+    """
+    kind, _, argument = sink_spec.partition(':')
+    if kind == 'stdout':
+        return StdoutSink()
+    if kind == 'file' and argument:
+        return RotatingFileSink(argument)
+    if kind == 'ring' and argument.isdigit():
+        return RingBufferSink(int(argument))
+    raise argparse.ArgumentTypeError(f'invalid sink {sink_spec}')
 
 
 def main():
-    server = MessageServer("msg_server.info")
+    parser = argparse.ArgumentParser(description='Kerberos message server')
+    parser.add_argument('--config-file', default='msg_server.info', help='message server config file')
+    parser.add_argument('--max-sessions', type=int, help='max number of client sessions kept in memory')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes sharing the port with SO_REUSEPORT')
+    parser.add_argument('--sink', dest='sinks', action='append', type=create_sink,
+                        help="where accepted messages are delivered: 'stdout' (the default), 'file:<path>' for a "
+                             "rotating log file or 'ring:<capacity>' for an in-memory buffer. May be repeated")
+    parser.add_argument('--message-queue-size', type=int, default=10000,
+                        help='max number of accepted messages waiting for delivery')
+    parser.add_argument('--overflow-policy', choices=OVERFLOW_POLICIES, default=OVERFLOW_BLOCK,
+                        help="when the message queue is full: 'block' the client, 'drop' the message, or 'reject' it "
+                             "with an error response")
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus metrics on this local HTTP port (worker n uses the port + n + 1)')
+    args = parser.parse_args()
+
+    configure_logging(['message_server'])
+
+    message_pipeline = MessagePipeline(args.sinks or [StdoutSink()], args.message_queue_size,
+                                       overflow_policy=args.overflow_policy)
+    server = MessageServer(args.config_file, args.max_sessions, args.workers, message_pipeline,
+                           args.metrics_port)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+
+from client.async_client import ConnectionPool, AsyncClient
+from common.framing_utils import read_client_request_async
+from common.protocol.client_request import ClientRequest
+from common.protocol.server_response import ServerResponse
+
+
+class AsyncClientTest(unittest.IsolatedAsyncioTestCase):
+    async def start_echo_server(self, responses_per_connection=None):
+        """
+        Answers every request with its payload, closing connections after responses_per_connection responses
+        """
+        self.connection_count = 0
+
+        async def serve(reader, writer):
+            self.connection_count += 1
+            responses = 0
+            while responses_per_connection is None or responses < responses_per_connection:
+                request = await read_client_request_async(reader)
+                if request is None:
+                    break
+                # interleaves the handling of the connections
+                await asyncio.sleep(0)
+                writer.write(ServerResponse(24, 1605, bytes(request[23:])).pack())
+                await writer.drain()
+                responses += 1
+            writer.close()
+
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        return server.sockets[0].getsockname()[1]
+
+    async def test_pipelined_responses_reach_their_requests(self):
+        port = await self.start_echo_server()
+        async with ConnectionPool(max_connections_per_address=2, max_pipelined_requests=8) as pool:
+            responses = await asyncio.gather(*(
+                pool.request('127.0.0.1', port, ClientRequest(bytes(16), 24, 1029, str(i).encode()).pack())
+                for i in range(100)))
+
+        self.assertEqual([str(i).encode() for i in range(100)],
+                         [ServerResponse.unpack(response, bytes).payload for response in responses])
+        self.assertEqual(2, self.connection_count)
+
+    async def test_idempotent_request_is_resent_after_the_server_closed_the_connection(self):
+        port = await self.start_echo_server(responses_per_connection=1)
+        async with ConnectionPool(max_connections_per_address=1) as pool:
+            first = await pool.request('127.0.0.1', port, ClientRequest(bytes(16), 24, 1026, b'first').pack(), True)
+            second = await pool.request('127.0.0.1', port, ClientRequest(bytes(16), 24, 1026, b'second').pack(), True)
+
+        self.assertEqual(b'first', ServerResponse.unpack(first, bytes).payload)
+        self.assertEqual(b'second', ServerResponse.unpack(second, bytes).payload)
+        self.assertEqual(2, self.connection_count)
+
+    async def test_other_requests_are_not_resent(self):
+        # the server may have handled the request before closing the connection
+        port = await self.start_echo_server(responses_per_connection=0)
+        async with ConnectionPool(max_connections_per_address=1) as pool:
+            with self.assertRaises(ConnectionError):
+                await pool.request('127.0.0.1', port, ClientRequest(bytes(16), 24, 1029, b'message').pack())
+            self.assertEqual(1, self.connection_count)
+            with self.assertRaises(ConnectionError):
+                await pool.request('127.0.0.1', port, ClientRequest(bytes(16), 24, 1026, None).pack(), True)
+            self.assertEqual(3, self.connection_count)
+
+
+    async def test_servers_list_falls_back_to_text_when_the_binary_request_closes_the_connection(self):
+        async def serve(reader, writer):
+            # an old auth server, which drops the connection on request codes it does not know
+            while (request := await read_client_request_async(reader)) is not None:
+                if ClientRequest.unpack(request, bytes).code != 1026:
+                    break
+                servers_list = f'1) printer ID: {"ab" * 16} at: 127.0.0.1:1234\n'.encode()
+                writer.write(ServerResponse(24, 1602, servers_list).pack())
+                await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        async with ConnectionPool() as pool:
+            client = AsyncClient(pool, '127.0.0.1', server.sockets[0].getsockname()[1])
+            self.assertEqual([(bytes([0xab]) * 16, 'printer', '127.0.0.1', 1234)], await client.get_message_servers())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from auth_server.auth_server import AuthServer, VERSION
+from auth_server.message_server import MessageServer
+from common.framing_utils import read_server_response_async
+from common.protocol.client_request import ClientRequest
+from common.protocol.message_codes import BINARY_SERVER_LIST_REQUEST_CODE, SERVER_LIST_REQUEST_CODE, \
+    SESSION_KEY_AND_TICKET_REQUEST_CODE, RATE_LIMITED_RESPONSE_CODE, SERVER_BUSY_RESPONSE_CODE, \
+    BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE, MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE, \
+    GENERAL_SERVER_ERROR_CODE
+from common.protocol.request_1027_session_key import SessionKeyAndTicketRequest
+from common.protocol.request_1032_batch_session_key import BatchSessionKeyAndTicketRequest
+from common.protocol.request_1033_multi_server_session_key import MultiServerSessionKeyAndTicketRequest
+from common.protocol.request_1030_server_list_page import ServerListPageRequest
+from common.protocol.response_1610_message_server_list import MessageServerListResponse
+from common.protocol.server_response import ServerResponse
+
+ADDRESS = ('127.0.0.1', 5000)
+
+
+class IdleAuthServer(AuthServer):
+    """
+    An auth server that handles requests passed to process_request, without loading the stores or listening
+    """
+    def start_server(self):
+        pass
+
+
+def create_auth_server(**kwargs):
+    with tempfile.TemporaryDirectory() as work_dir:
+        port_file = os.path.join(work_dir, 'port.info')
+        with open(port_file, 'w') as file:
+            file.write('1256\n')
+        return IdleAuthServer(port_file, **kwargs)
+
+
+def add_message_server(auth_server, number):
+    auth_server.index_message_server(
+        MessageServer(bytes([number]) * 16, f'printer {number}', bytes(32), '127.0.0.1', 1234 + number))
+
+
+def list_servers(auth_server, offset, limit, name_filter=''):
+    request = ClientRequest(bytes(16), VERSION, BINARY_SERVER_LIST_REQUEST_CODE,
+                            ServerListPageRequest(offset, limit, name_filter))
+    response = ServerResponse.unpack(auth_server.process_request(request.pack(), ADDRESS), MessageServerListResponse)
+    return [] if response.payload is None else [server[1] for server in response.payload.servers]
+
+
+class ServerListTest(unittest.TestCase):
+    def setUp(self):
+        self.auth_server = create_auth_server()
+        for number in range(5):
+            add_message_server(self.auth_server, number)
+
+    @mock.patch('auth_server.auth_server.MAX_SERVER_LIST_PAGE_SIZE', 2)
+    def test_pages_are_bounded(self):
+        self.assertEqual(['printer 0', 'printer 1'], list_servers(self.auth_server, 0, 100))
+        self.assertEqual(['printer 4'], list_servers(self.auth_server, 4, 2))
+        self.assertEqual([], list_servers(self.auth_server, 10, 2))
+        self.assertEqual(['printer 3'], list_servers(self.auth_server, 0, 2, 'printer 3'))
+
+    def test_registration_invalidates_the_cached_pages(self):
+        self.assertEqual(5, len(list_servers(self.auth_server, 0, 10)))
+        add_message_server(self.auth_server, 5)
+        self.assertEqual(6, len(list_servers(self.auth_server, 0, 10)))
+
+    @mock.patch('auth_server.auth_server.MAX_CACHED_SERVER_LIST_PAGES', 2)
+    def test_least_recently_used_pages_are_evicted(self):
+        list_servers(self.auth_server, 0, 10)
+        list_servers(self.auth_server, 0, 10, 'filter a')
+        list_servers(self.auth_server, 0, 10)
+        list_servers(self.auth_server, 0, 10, 'filter b')
+
+        self.assertEqual([(True, 0, 10, ''), (True, 0, 10, 'filter b')], list(self.auth_server.server_list_cache))
+
+
+class MalformedRequestTest(unittest.TestCase):
+    def test_header_only_requests_are_rejected_as_malformed(self):
+        auth_server = create_auth_server()
+        auth_server.dispatcher.error_handler = lambda request, reason: reason
+        for code, route in auth_server.dispatcher.routes.items():
+            if route.payload_type is not None and not route.payload_optional:
+                self.assertEqual('malformed_request', auth_server.process_request(
+                    ClientRequest(bytes(16), VERSION, code, None).pack(), ADDRESS), code)
+
+
+def send(auth_server, code, client_id=bytes(16), payload=None, client_address=ADDRESS):
+    response = auth_server.process_request(ClientRequest(client_id, VERSION, code, payload).pack(), client_address)
+    return ServerResponse.unpack(response, bytes).code
+
+
+class AdmissionControlTest(unittest.TestCase):
+    def test_ip_over_its_rate_is_rejected(self):
+        auth_server = create_auth_server(ip_rate_limit=(1, 2))
+        auth_server.add_admission_control()
+
+        codes = [send(auth_server, SERVER_LIST_REQUEST_CODE) for _ in range(3)]
+        self.assertNotIn(RATE_LIMITED_RESPONSE_CODE, codes[:2])
+        self.assertEqual(RATE_LIMITED_RESPONSE_CODE, codes[2])
+        self.assertNotEqual(RATE_LIMITED_RESPONSE_CODE,
+                            send(auth_server, SERVER_LIST_REQUEST_CODE, client_address=('127.0.0.2', 5000)))
+
+    def test_client_over_its_ticket_rate_is_rejected(self):
+        auth_server = create_auth_server(client_rate_limit=(1, 1))
+        auth_server.add_admission_control()
+        payload = SessionKeyAndTicketRequest(b's' * 16, b'n' * 8)
+
+        self.assertNotEqual(RATE_LIMITED_RESPONSE_CODE,
+                            send(auth_server, SESSION_KEY_AND_TICKET_REQUEST_CODE, b'a' * 16, payload))
+        self.assertEqual(RATE_LIMITED_RESPONSE_CODE,
+                         send(auth_server, SESSION_KEY_AND_TICKET_REQUEST_CODE, b'a' * 16, payload))
+        self.assertNotEqual(RATE_LIMITED_RESPONSE_CODE,
+                            send(auth_server, SESSION_KEY_AND_TICKET_REQUEST_CODE, b'b' * 16, payload))
+        # only the ticket requests are limited per client
+        self.assertNotEqual(RATE_LIMITED_RESPONSE_CODE, send(auth_server, SERVER_LIST_REQUEST_CODE, b'a' * 16))
+
+    def test_batches_are_charged_a_token_per_ticket(self):
+        auth_server = create_auth_server(client_rate_limit=(1, 10))
+        auth_server.add_admission_control()
+
+        # one request, more tickets than the burst
+        large_batch = BatchSessionKeyAndTicketRequest([(b'a' * 16, b's' * 16, b'n' * 8)] * 1000)
+        self.assertEqual(RATE_LIMITED_RESPONSE_CODE,
+                         send(auth_server, BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE, b'x' * 16, large_batch))
+        multi_server = MultiServerSessionKeyAndTicketRequest([b's' * 16] * 1000, b'n' * 8)
+        self.assertEqual(RATE_LIMITED_RESPONSE_CODE,
+                         send(auth_server, MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE, b'b' * 16, multi_server))
+
+        # the tickets of a batch are charged to the client ids in it, not to the sender
+        batch = BatchSessionKeyAndTicketRequest([(b'a' * 16, b's' * 16, b'n' * 8)] * 6 +
+                                                [(b'c' * 16, b's' * 16, b'n' * 8)])
+        self.assertNotEqual(RATE_LIMITED_RESPONSE_CODE,
+                            send(auth_server, BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE, b'x' * 16, batch))
+        self.assertEqual(RATE_LIMITED_RESPONSE_CODE,
+                         send(auth_server, BATCH_SESSION_KEY_AND_TICKET_REQUEST_CODE, b'x' * 16, batch))
+        self.assertNotEqual(RATE_LIMITED_RESPONSE_CODE,
+                            send(auth_server, MULTI_SERVER_SESSION_KEY_AND_TICKET_REQUEST_CODE, b'x' * 16,
+                                 MultiServerSessionKeyAndTicketRequest([b's' * 16] * 10, b'n' * 8)))
+
+    def test_requests_over_the_in_flight_cap_are_rejected_as_busy(self):
+        auth_server = create_auth_server(max_in_flight_requests=1)
+        auth_server.add_admission_control()
+
+        auth_server.in_flight_limiter.try_acquire()
+        self.assertEqual(SERVER_BUSY_RESPONSE_CODE, send(auth_server, SERVER_LIST_REQUEST_CODE))
+        auth_server.in_flight_limiter.release()
+        self.assertNotEqual(SERVER_BUSY_RESPONSE_CODE, send(auth_server, SERVER_LIST_REQUEST_CODE))
+        self.assertEqual(0, auth_server.in_flight_limiter.in_flight)
+
+    def test_requests_are_not_limited_without_admission_control(self):
+        # the parent process of the workers, which serves the registrations they already admitted
+        auth_server = create_auth_server(ip_rate_limit=(1, 1))
+
+        codes = [send(auth_server, SERVER_LIST_REQUEST_CODE) for _ in range(3)]
+        self.assertNotIn(RATE_LIMITED_RESPONSE_CODE, codes)
+
+
+class ClientErrorTest(unittest.TestCase):
+    def test_client_errors_are_logged_on_the_sampled_hot_path_and_counted(self):
+        auth_server = create_auth_server()
+        add_message_server(auth_server, 1)
+        payload = SessionKeyAndTicketRequest(bytes([1]) * 16, b'n' * 8)
+
+        with self.assertLogs('auth_server.requests', 'INFO'), self.assertNoLogs('auth_server', 'WARNING'):
+            # the client is not registered
+            self.assertEqual(GENERAL_SERVER_ERROR_CODE,
+                             send(auth_server, SESSION_KEY_AND_TICKET_REQUEST_CODE, b'a' * 16, payload))
+            self.assertEqual(GENERAL_SERVER_ERROR_CODE, send(auth_server, 1100))
+
+        rendered = auth_server.metrics.registry.render()
+        self.assertIn('auth_server_client_errors_total{reason="ticket_failed"} 1\n', rendered)
+        self.assertIn('auth_server_client_errors_total{reason="unknown_request"} 1\n', rendered)
+
+
+class AsyncConnectionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.auth_server = create_auth_server(mode='async', max_connections=1)
+        self.auth_server.connection_semaphore = asyncio.Semaphore(self.auth_server.max_connections)
+        self.server = await asyncio.start_server(self.auth_server.handle_client_request_async, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def list_servers(self, reader, writer):
+        writer.write(ClientRequest(bytes(16), VERSION, SERVER_LIST_REQUEST_CODE, None).pack())
+        return ServerResponse.unpack(await read_server_response_async(reader), bytes).code
+
+    async def test_idle_keep_alive_connections_do_not_hold_a_slot(self):
+        idle_reader, idle_writer = await asyncio.open_connection('127.0.0.1', self.port)
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        try:
+            first = await self.list_servers(idle_reader, idle_writer)
+            # the first connection stays open and idle, and the only slot is free for the second one
+            second = await asyncio.wait_for(self.list_servers(reader, writer), 1)
+            self.assertEqual(first, second)
+            self.assertEqual(first, await self.list_servers(idle_reader, idle_writer))
+        finally:
+            idle_writer.close()
+            writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
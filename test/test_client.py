@@ -0,0 +1,142 @@
+import socket
+import threading
+import unittest
+
+from client.client import Client
+from common.cryptography_utils import sha256_hash, generate_aes_key, encrypt_aes_cbc_fields
+from common.framing_utils import read_client_request
+from common.protocol.client_request import ClientRequest
+from common.protocol.encrypted_session_key import EncryptedSessionKey
+from common.protocol.message_codes import CLIENT_REGISTRATION_SUCCESS_CODE, CLIENT_REGISTRATION_FAIL_CODE, \
+    SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE, RATE_LIMITED_RESPONSE_CODE
+from common.protocol.request_1027_session_key import SessionKeyAndTicketRequest
+from common.protocol.request_1030_server_list_page import ServerListPageRequest
+from common.protocol.response_1600_user_registration_success import UserRegistrationSuccessResponse
+from common.protocol.response_1603_key_and_token_success_response import KeyAndTokenResponse
+from common.protocol.response_1610_message_server_list import MessageServerListResponse
+from common.protocol.server_response import ServerResponse
+
+
+class FakeAuthServer:
+    def __init__(self, respond, keep_alive=False):
+        """
+        Answers every connection's request with respond(request bytes) -> response bytes
+        :param keep_alive: keep serving a connection's requests until the client closes it, rather than closing it
+        after the first response
+        """
+        self.respond = respond
+        self.keep_alive = keep_alive
+        self.connection_count = 0
+        self.server_socket = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server_socket.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                client_socket, _ = self.server_socket.accept()
+            except OSError:
+                return
+            self.connection_count += 1
+            threading.Thread(target=self.serve_connection, args=(client_socket,), daemon=True).start()
+
+    def serve_connection(self, client_socket):
+        with client_socket:
+            while True:
+                request = read_client_request(client_socket)
+                if request is None:
+                    return
+                client_socket.sendall(self.respond(request))
+                if not self.keep_alive:
+                    return
+
+    def close(self):
+        self.server_socket.close()
+
+
+class ClientTest(unittest.TestCase):
+    def start_auth_server(self, respond, keep_alive=False):
+        auth_server = FakeAuthServer(respond, keep_alive)
+        self.addCleanup(auth_server.close)
+        self.auth_server = auth_server
+        client = Client('127.0.0.1', auth_server.port, timeout=5)
+        self.addCleanup(client.close)
+        return client
+
+    def test_register_logs_in(self):
+        client = self.start_auth_server(lambda request: ServerResponse(
+            24, CLIENT_REGISTRATION_SUCCESS_CODE, UserRegistrationSuccessResponse(b'c' * 16)).pack())
+
+        self.assertEqual(b'c' * 16, client.register('alice', 'password'))
+        self.assertEqual('alice', client.name)
+        self.assertEqual(sha256_hash(b'password'), client.password_hash)
+
+    def test_auth_server_connection_is_reused(self):
+        for keep_alive, connection_count in ((True, 1), (False, 2)):
+            client = self.start_auth_server(lambda request: ServerResponse(
+                24, CLIENT_REGISTRATION_SUCCESS_CODE, UserRegistrationSuccessResponse(b'c' * 16)).pack(), keep_alive)
+
+            client.register('alice', 'password')
+            # reconnects if the server closed the connection after the first response
+            client.register('bob', 'password')
+            self.assertEqual(connection_count, self.auth_server.connection_count)
+
+    def test_servers_list_is_fetched_a_page_at_a_time(self):
+        servers = [(bytes([number]) * 16, f'printer {number}', '127.0.0.1', 1234 + number) for number in range(5)]
+        pages = []
+
+        def respond(request):
+            page_request = ClientRequest.unpack(request, ServerListPageRequest).payload
+            pages.append((page_request.offset, page_request.limit))
+            payload = MessageServerListResponse(servers[page_request.offset:page_request.offset + page_request.limit])
+            return ServerResponse(24, MESSAGE_SERVER_BINARY_LIST_RESPONSE_CODE, payload).pack()
+        client = self.start_auth_server(respond, keep_alive=True)
+        client.MAX_SERVER_LIST_PAGE_SIZE = 2
+
+        self.assertEqual(servers, client.get_message_servers())
+        self.assertEqual([(0, 2), (2, 2), (4, 2)], pages)
+
+    def test_rate_limited_servers_list_does_not_fall_back_to_the_text_list(self):
+        requests = []
+
+        def respond(request):
+            requests.append(request)
+            return ServerResponse(24, RATE_LIMITED_RESPONSE_CODE, None).pack()
+        client = self.start_auth_server(respond, keep_alive=True)
+
+        with self.assertRaises(RuntimeError):
+            client.get_message_servers()
+        self.assertEqual(1, len(requests))
+
+    def test_failed_registration_raises(self):
+        client = self.start_auth_server(lambda request: ServerResponse(24, CLIENT_REGISTRATION_FAIL_CODE, None).pack())
+
+        with self.assertRaises(RuntimeError):
+            client.register('alice', 'password')
+        self.assertIsNone(client.client_id)
+
+    def test_session_key_of_another_password_raises(self):
+        def respond(request):
+            nonce = ClientRequest.unpack(request, SessionKeyAndTicketRequest).payload.nonce
+            (encrypted_key, encrypted_nonce), iv = encrypt_aes_cbc_fields(
+                sha256_hash(b'another password'), [generate_aes_key(), nonce], None)
+            payload = KeyAndTokenResponse(b'c' * 16, EncryptedSessionKey(iv, encrypted_nonce, encrypted_key).pack(),
+                                          bytes(121))
+            return ServerResponse(24, SESSION_KEY_AND_TICKET_SUCCESS_RESPONSE_CODE, payload).pack()
+        client = self.start_auth_server(respond)
+        client.log_in('alice', b'c' * 16, 'password')
+        client.select_message_server((b's' * 16, 'printer', '127.0.0.1', 1))
+
+        with self.assertRaises(RuntimeError):
+            client.get_key_and_ticket()
+        self.assertIsNone(client.session_key)
+
+    def test_sending_without_a_session_raises(self):
+        client = Client()
+
+        with self.assertRaises(RuntimeError):
+            client.send_message_to_server('hello')
+
+
+if __name__ == '__main__':
+    unittest.main()
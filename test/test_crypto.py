@@ -1,6 +1,10 @@
 import unittest
 
-from common.cryptography_utils import encrypt_aes_cbc, decrypt_aes_cbc, generate_aes_key
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from common.cryptography_utils import encrypt_aes_cbc, decrypt_aes_cbc, generate_aes_key, encrypt_aes_cbc_fields, \
+    decrypt_aes_cbc_fields, encrypt_aes_cbc_batch
 
 
 class CryptoTest(unittest.TestCase):
@@ -16,6 +20,37 @@ class CryptoTest(unittest.TestCase):
         print(f'decrypted: {decrypted.decode()}!')
         self.assertEqual(text_bytes, decrypted)
 
+    def test_cached_ciphers_match_new_ciphers(self):
+        key = generate_aes_key()
+        fields = [bytes(16), b'short', b'a' * 47, generate_aes_key()]
+
+        for _ in range(3):
+            encrypted_fields, iv = encrypt_aes_cbc_fields(key, fields, None)
+            expected = [AES.new(key, AES.MODE_CBC, iv).encrypt(pad(field, AES.block_size)) for field in fields]
+            self.assertEqual(expected, encrypted_fields)
+            self.assertEqual(fields, decrypt_aes_cbc_fields(key, encrypted_fields, iv))
+            self.assertEqual(fields[2], decrypt_aes_cbc(key, encrypted_fields[2], iv))
+
+    def test_batch_encryption_matches_new_ciphers(self):
+        key = generate_aes_key()
+        fields = [generate_aes_key(), b'12345678', b'', b'b' * 100]
+        ivs = [generate_aes_key()[:16] for _ in fields]
+
+        expected = [AES.new(key, AES.MODE_CBC, iv).encrypt(pad(field, AES.block_size)) for field, iv in zip(fields, ivs)]
+        self.assertEqual(expected, encrypt_aes_cbc_batch(key, fields, ivs))
+
+    def test_failed_decryption_does_not_break_the_cache(self):
+        key = generate_aes_key()
+        encrypted, iv = encrypt_aes_cbc(key, b'text', None)
+
+        with self.assertRaises(ValueError):
+            decrypt_aes_cbc(key, encrypted[:-1], iv)
+        try:
+            decrypt_aes_cbc(key, bytes(16), iv)  # garbage usually fails unpadding
+        except ValueError:
+            pass
+        self.assertEqual(b'text', decrypt_aes_cbc(key, encrypted, iv))
+
 
 if __name__ == '__main__':
     unittest.main()
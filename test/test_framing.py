@@ -0,0 +1,60 @@
+import socket
+import threading
+import unittest
+
+from common.framing_utils import read_client_request, read_server_response
+from common.protocol.client_request import ClientRequest
+from common.protocol.server_response import ServerResponse
+
+
+class FramingTest(unittest.TestCase):
+    def setUp(self):
+        self.reader, self.writer = socket.socketpair()
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def test_payload_of_exact_chunk_multiple(self):
+        packed = ClientRequest(bytes(16), 24, 1029, bytes(2048 - 23)).pack()
+        self.writer.sendall(packed)
+
+        self.assertEqual(packed, read_client_request(self.reader))
+
+    def test_partial_writes(self):
+        packed = ServerResponse(24, 1602, b'x' * 5000).pack()
+
+        def write_slowly():
+            for i in range(0, len(packed), 3):
+                self.writer.send(packed[i:i + 3])
+
+        writer_thread = threading.Thread(target=write_slowly)
+        writer_thread.start()
+        received = read_server_response(self.reader)
+        writer_thread.join()
+
+        self.assertEqual(packed, received)
+
+    def test_back_to_back_frames(self):
+        first = ClientRequest(bytes(16), 24, 1029, b'first').pack()
+        second = ClientRequest(bytes(16), 24, 1029, b'second').pack()
+        self.writer.sendall(first + second)
+
+        self.assertEqual(first, read_client_request(self.reader))
+        self.assertEqual(second, read_client_request(self.reader))
+
+    def test_closed_connection(self):
+        self.writer.close()
+
+        self.assertIsNone(read_client_request(self.reader))
+
+    def test_truncated_frame(self):
+        self.writer.sendall(ClientRequest(bytes(16), 24, 1029, b'payload').pack()[:-1])
+        self.writer.close()
+
+        with self.assertRaises(ConnectionError):
+            read_client_request(self.reader)
+
+
+if __name__ == '__main__':
+    unittest.main()
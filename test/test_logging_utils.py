@@ -0,0 +1,38 @@
+import io
+import logging
+import unittest
+
+from common.logging_utils import SamplingFilter, configure_logging, get_hot_path_logger, get_logger, stop_logging
+
+
+class LoggingUtilsTest(unittest.TestCase):
+    def tearDown(self):
+        stop_logging()
+        root_logger = logging.getLogger()
+        for handler in list(root_logger.handlers):
+            root_logger.removeHandler(handler)
+        root_logger.setLevel(logging.WARNING)
+
+    def test_sampling_filter_keeps_one_of_n_and_all_warnings(self):
+        sampling_filter = SamplingFilter(3)
+        info_record = logging.LogRecord('test', logging.INFO, __file__, 0, 'info', None, None)
+        warning_record = logging.LogRecord('test', logging.WARNING, __file__, 0, 'warning', None, None)
+
+        self.assertEqual([True, False, False, True], [sampling_filter.filter(info_record) for _ in range(4)])
+        self.assertTrue(sampling_filter.filter(warning_record))
+
+    def test_logs_are_written_in_the_background_and_hot_path_can_be_disabled(self):
+        stream = io.StringIO()
+        configure_logging(['test_component'], level='INFO', log_format='%(name)s %(message)s', stream=stream,
+                          hot_path_enabled=False)
+        get_logger('test_component').info('started')
+        get_hot_path_logger('test_component').info('connection')
+        get_hot_path_logger('test_component').error('failed')
+        stop_logging()
+
+        self.assertEqual('test_component started\n', stream.getvalue())
+        self.assertFalse(get_hot_path_logger('test_component').isEnabledFor(logging.ERROR))
+
+
+if __name__ == '__main__':
+    unittest.main()
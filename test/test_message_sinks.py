@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+import unittest
+
+from message_server.message_sinks import MessagePipeline, RingBufferSink, RotatingFileSink, OVERFLOW_DROP, \
+    OVERFLOW_REJECT
+
+
+class MessageSinksTest(unittest.TestCase):
+    def test_pipeline_delivers_messages_in_order(self):
+        ring = RingBufferSink(2)
+        pipeline = MessagePipeline([ring], max_batch_size=2)
+        for text in ['first', 'second', 'third']:
+            self.assertTrue(pipeline.submit('aa', text))
+        pipeline.start()
+        pipeline.stop()
+
+        self.assertEqual(['second', 'third'], [text for _, _, text in ring.recent()])
+        self.assertEqual(3, pipeline.stats()['delivered'])
+
+    def test_full_queue_overflow_policies(self):
+        dropping = MessagePipeline([], max_queue_size=1, overflow_policy=OVERFLOW_DROP)
+        rejecting = MessagePipeline([], max_queue_size=1, overflow_policy=OVERFLOW_REJECT)
+        for pipeline in (dropping, rejecting):
+            self.assertTrue(pipeline.submit('aa', 'queued'))
+
+        self.assertTrue(dropping.submit('aa', 'dropped'))
+        self.assertFalse(rejecting.submit('aa', 'rejected'))
+        self.assertEqual(1, dropping.stats()['dropped'])
+
+    def test_file_sink_rotates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'messages.log')
+            pipeline = MessagePipeline([RotatingFileSink(file_path, max_bytes=1, backup_count=2)], max_batch_size=1)
+            for text in ['first', 'second', 'third']:
+                pipeline.submit('aa', text)
+            pipeline.start()
+            pipeline.stop()
+
+            with open(file_path + '.1') as file:
+                self.assertEqual('third', json.loads(file.read())['message'])
+            with open(file_path + '.2') as file:
+                self.assertEqual('second', json.loads(file.read())['message'])
+            self.assertFalse(os.path.exists(file_path + '.3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import threading
+import unittest
+
+from common.metrics import MetricsRegistry, COUNTER, HISTOGRAM
+
+
+class MetricsTest(unittest.TestCase):
+    def test_counters_of_all_threads_are_summed(self):
+        registry = MetricsRegistry()
+        registry.describe('requests_total', COUNTER, 'Requests')
+
+        def record():
+            for _ in range(100):
+                registry.add('requests_total', labels=(('code', 1027),))
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        registry.add('requests_total', labels=(('code', 1028),))
+
+        self.assertIn('requests_total{code="1027"} 400\n', registry.render())
+        self.assertIn('requests_total{code="1028"} 1\n', registry.render())
+        # the shards of the ended threads were retired into one
+        self.assertEqual(1, len(registry.shards))
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry(buckets=(0.1, 1.0))
+        registry.describe('duration_seconds', HISTOGRAM, 'Duration')
+        for value in (0.05, 0.5, 5):
+            registry.observe('duration_seconds', value)
+
+        rendered = registry.render()
+        self.assertIn('duration_seconds_bucket{le="0.1"} 1\n', rendered)
+        self.assertIn('duration_seconds_bucket{le="1.0"} 2\n', rendered)
+        self.assertIn('duration_seconds_bucket{le="+Inf"} 3\n', rendered)
+        self.assertIn('duration_seconds_count 3\n', rendered)
+
+
+if __name__ == '__main__':
+    unittest.main()
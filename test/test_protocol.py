@@ -0,0 +1,60 @@
+import unittest
+
+from common.protocol.client_request import ClientRequest
+from common.protocol.request_1028_send_session_key import SendSessionKeyRequest
+from common.protocol.request_1029_send_message import SendMessageRequest
+from common.protocol.request_1032_batch_session_key import BatchSessionKeyAndTicketRequest
+from common.protocol.request_1033_multi_server_session_key import MultiServerSessionKeyAndTicketRequest
+from common.protocol.response_1603_key_and_token_success_response import KeyAndTokenResponse
+from common.protocol.response_1610_message_server_list import MessageServerListResponse
+from common.protocol.response_1611_batch_key_and_token import BatchKeyAndTokenResponse
+from common.protocol.server_response import ServerResponse
+
+
+class ProtocolTest(unittest.TestCase):
+    def test_binary_server_list(self):
+        servers = [(bytes(range(16)), 'Printer 1) at: 10.0.0.1:80', '127.0.0.1', 1235),
+                   (bytes(16), 'Printer 2', '2001:db8::1', 65535)]
+        packed = ServerResponse(24, 1610, MessageServerListResponse(servers)).pack()
+
+        response = ServerResponse.unpack(packed, MessageServerListResponse)
+        self.assertEqual(servers, response.payload.servers)
+
+    def test_batch_tickets(self):
+        ticket_requests = [(bytes([i]) * 16, bytes(16), bytes([i]) * 8) for i in range(3)]
+        request = BatchSessionKeyAndTicketRequest.unpack(BatchSessionKeyAndTicketRequest(ticket_requests).pack())
+        self.assertEqual(ticket_requests, request.ticket_requests)
+
+        key_and_token = KeyAndTokenResponse(bytes([1]) * 16, bytes([2]) * 80, bytes([3]) * 121)
+        response = BatchKeyAndTokenResponse.unpack(BatchKeyAndTokenResponse([key_and_token, None]).pack())
+        self.assertEqual(key_and_token.ticket, response.key_and_token_responses[0].ticket)
+        self.assertIsNone(response.key_and_token_responses[1])
+
+    def test_multi_server_tickets(self):
+        message_server_ids = [bytes([i]) * 16 for i in range(3)]
+        request = MultiServerSessionKeyAndTicketRequest.unpack(
+            MultiServerSessionKeyAndTicketRequest(message_server_ids, b'n' * 8).pack())
+        self.assertEqual(message_server_ids, request.message_server_ids)
+        self.assertEqual(b'n' * 8, request.nonce)
+
+        with self.assertRaises(ValueError):
+            MultiServerSessionKeyAndTicketRequest.unpack(
+                MultiServerSessionKeyAndTicketRequest(message_server_ids, b'n' * 8).pack()[:-1])
+
+    def test_message_is_unpacked_without_copying(self):
+        packed = bytearray(ClientRequest(bytes(16), 24, 1029, SendMessageRequest(b'i' * 16, b'm' * 64)).pack())
+
+        request = ClientRequest.unpack(packed, SendMessageRequest)
+        self.assertEqual(b'm' * 64, request.payload.encrypted_message)
+        packed[-1:] = b'x'
+        self.assertEqual(b'm' * 63 + b'x', request.payload.encrypted_message)
+
+    def test_payload_of_another_size_raises(self):
+        packed = ClientRequest(bytes(16), 24, 1028, bytes(SendSessionKeyRequest.STRUCT.size + 1)).pack()
+
+        with self.assertRaises(ValueError):
+            ClientRequest.unpack(packed, SendSessionKeyRequest)
+
+
+if __name__ == '__main__':
+    unittest.main()
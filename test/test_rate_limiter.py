@@ -0,0 +1,51 @@
+import unittest
+
+from auth_server.rate_limiter import TokenBucketLimiter, InFlightLimiter
+
+
+class TokenBucketLimiterTest(unittest.TestCase):
+    def test_bursts_are_allowed_then_limited_to_the_rate(self):
+        limiter = TokenBucketLimiter(rate=2, burst=3)
+        self.assertEqual([True, True, True, False], [limiter.allow('a', now=0) for _ in range(4)])
+        # other keys have their own buckets
+        self.assertTrue(limiter.allow('b', now=0))
+        self.assertFalse(limiter.allow('a', now=0.25))
+        self.assertTrue(limiter.allow('a', now=0.5))
+        self.assertFalse(limiter.allow('a', now=0.5))
+        # an idle bucket refills up to the burst only
+        self.assertEqual([True, True, True, False], [limiter.allow('a', now=100) for _ in range(4)])
+
+    def test_requests_take_their_cost_in_tokens(self):
+        limiter = TokenBucketLimiter(rate=1, burst=10)
+        self.assertFalse(limiter.allow('a', cost=11, now=0))
+        self.assertTrue(limiter.allow('a', cost=6, now=0))
+        self.assertFalse(limiter.allow('a', cost=6, now=0))
+        self.assertTrue(limiter.allow('a', cost=6, now=2))
+
+    def test_the_least_recently_used_keys_are_evicted(self):
+        limiter = TokenBucketLimiter(rate=1, burst=1, max_buckets=2)
+        self.assertTrue(limiter.allow('a', now=0))
+        self.assertTrue(limiter.allow('b', now=0))
+        self.assertFalse(limiter.allow('a', now=0))
+        self.assertTrue(limiter.allow('c', now=0))
+        self.assertEqual(2, len(limiter))
+        # b was evicted, so it starts over with a full bucket, while a is still limited
+        self.assertTrue(limiter.allow('b', now=0))
+        self.assertEqual(['c', 'b'], list(limiter.buckets))
+
+    def test_invalid_limits_are_refused(self):
+        self.assertRaises(ValueError, TokenBucketLimiter, 0, 1)
+        self.assertRaises(ValueError, TokenBucketLimiter, 1, 0)
+
+
+class InFlightLimiterTest(unittest.TestCase):
+    def test_requests_over_the_cap_are_refused_until_one_is_released(self):
+        limiter = InFlightLimiter(2)
+        self.assertEqual([True, True, False], [limiter.try_acquire() for _ in range(3)])
+        limiter.release()
+        self.assertTrue(limiter.try_acquire())
+        self.assertEqual(2, limiter.in_flight)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from auth_server.client import Client
+from auth_server.message_server import MessageServer
+from auth_server.record_store import RecordStore, LazyRecordMapping
+from auth_server.store_converter import convert_text_file
+
+
+class RecordStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store_path = os.path.join(self.temp_dir.name, 'clients.db')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_append_and_reopen(self):
+        client = Client(bytes(range(16)), 'user 1', bytes(32), datetime.fromtimestamp(1708511394))
+        store = RecordStore(self.store_path, Client.RECORD_STRUCT)
+        store.append([client.to_record()])
+        self.assertEqual(0, len(store))
+        self.assertEqual(1, store.refresh())
+        store.close()
+
+        store = RecordStore(self.store_path, Client.RECORD_STRUCT)
+        loaded = Client.from_record(store.record(0))
+        self.assertEqual(client.client_id, loaded.client_id)
+        self.assertEqual(client.name, loaded.name)
+        self.assertEqual(client.last_seen, loaded.last_seen)
+        self.assertEqual([(client.client_id, b'user 1'.ljust(255, b'\x00'))],
+                         list(store.records(Client.ID_AND_NAME_STRUCT)))
+        store.close()
+
+    def test_record_size_mismatch(self):
+        RecordStore(self.store_path, Client.RECORD_STRUCT).close()
+
+        with self.assertRaises(ValueError):
+            RecordStore(self.store_path, MessageServer.RECORD_STRUCT)
+
+    def test_convert_servers_text_file(self):
+        text_path = os.path.join(self.temp_dir.name, 'servers')
+        with open(text_path, 'w') as file:
+            file.write('15fc8df41bdf46378b0a14c8f136f7f0:Printer 20:' + '11' * 32 + ':127.0.0.1:1235\n')
+
+        self.assertEqual(1, convert_text_file(text_path, self.store_path, MessageServer))
+        store = RecordStore(self.store_path, MessageServer.RECORD_STRUCT)
+        server = MessageServer.from_record(store.record(0))
+        self.assertEqual(('Printer 20', '127.0.0.1', 1235), (server.name, server.ip_address, server.port))
+        store.close()
+
+    def test_ipv6_server_record(self):
+        server = MessageServer(bytes(16), 'Printer 21', bytes(32), '::1', 1236)
+
+        loaded = MessageServer.from_record(MessageServer.RECORD_STRUCT.unpack(
+            MessageServer.RECORD_STRUCT.pack(*server.to_record())))
+        self.assertEqual(('::1', 1236), (loaded.ip_address, loaded.port))
+
+    def test_lazy_mapping(self):
+        store = RecordStore(self.store_path, Client.RECORD_STRUCT)
+        store.append([Client(bytes([1]) * 16, 'user 1', bytes(32)).to_record()])
+        store.refresh()
+        clients = LazyRecordMapping(store, Client.from_record, {(bytes([1]) * 16).hex(): 0})
+        new_client = Client(bytes([2]) * 16, 'user 2', bytes(32))
+        clients[new_client.get_id_string()] = new_client
+
+        self.assertEqual(2, len(clients))
+        self.assertEqual('user 1', clients[(bytes([1]) * 16).hex()].name)
+        self.assertIs(new_client, clients[new_client.get_id_string()])
+        self.assertNotIn('missing', clients)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from auth_server.client import Client
+from auth_server.record_store import RecordStore
+from auth_server.registration_writer import RegistrationWriter
+
+
+class RegistrationWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = RecordStore(os.path.join(self.temp_dir.name, 'clients.db'), Client.RECORD_STRUCT)
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def test_queued_records_are_committed_together(self):
+        writer = RegistrationWriter()
+        commits = []
+        original_commit = writer.commit
+        writer.commit = lambda batch: commits.append(len(batch)) or original_commit(batch)
+
+        futures = [writer.submit(self.store, Client(bytes([i]) * 16, f'user {i}', bytes(32)).to_record())
+                   for i in range(10)]
+        writer.start()
+        for future in futures:
+            future.result(timeout=5)
+        writer.stop()
+
+        self.assertEqual([10], commits)
+        self.store.refresh()
+        self.assertEqual([f'user {i}' for i in range(10)],
+                         [Client.from_record(record).name for record in self.store.records()])
+
+    def test_failed_commit_fails_the_batch(self):
+        writer = RegistrationWriter()
+        writer.start()
+        future = writer.submit(self.store, ('not', 'a', 'client', 'record'))
+
+        with self.assertRaises(Exception):
+            future.result(timeout=5)
+        writer.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
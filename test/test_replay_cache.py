@@ -0,0 +1,44 @@
+import unittest
+
+from common.cryptography_utils import generate_aes_key, encrypt_aes_cbc_fields
+from common.protocol.authenticator import Authenticator
+from message_server.replay_cache import ReplayCache
+
+
+class ReplayCacheTest(unittest.TestCase):
+    def test_replayed_authenticator_is_rejected(self):
+        cache = ReplayCache(600)
+        now = 1000000.0
+
+        self.assertTrue(cache.add(b'authenticator 1', now - 5, now))
+        self.assertTrue(cache.add(b'authenticator 2', now - 5, now))
+        self.assertFalse(cache.add(b'authenticator 1', now - 5, now))
+        self.assertFalse(cache.add(b'authenticator 1', now - 5, now + 30))
+
+    def test_expired_buckets_are_dropped(self):
+        cache = ReplayCache(600, bucket_seconds=60)
+        now = 1000000.0
+        cache.add(b'old', now, now)
+        cache.add(b'new', now + 300, now + 300)
+
+        self.assertTrue(cache.add(b'newer', now + 700, now + 700))
+        self.assertEqual(2, len(cache))
+        # older than the window, so it can no longer be told apart from a replay
+        self.assertFalse(cache.add(b'old', now, now + 700))
+
+    def test_replay_with_an_altered_version_is_rejected(self):
+        cache = ReplayCache(600)
+        now = 1000000.0
+        encrypted_fields, iv = encrypt_aes_cbc_fields(
+            generate_aes_key(), [bytes([24]), b'c' * 16, b's' * 16, int(now).to_bytes(8, 'big')], None)
+        authenticator = Authenticator(iv, *encrypted_fields)
+        # the server does not check the version, so a replay may carry any version block
+        tampered = Authenticator.unpack(authenticator.pack())
+        tampered.encrypted_version = bytes(16)
+
+        self.assertTrue(cache.add(authenticator.replay_key(), now, now))
+        self.assertFalse(cache.add(tampered.replay_key(), now, now))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+from common.protocol.client_request import ClientRequest
+from common.protocol.request_1024_user_registration import UserRegistrationRequest
+from common.protocol.request_1025_server_registration import ServerRegistrationRequest
+from common.protocol.request_1027_session_key import SessionKeyAndTicketRequest
+from common.protocol.request_1028_send_session_key import SendSessionKeyRequest
+from common.protocol.request_1029_send_message import SendMessageRequest
+from common.protocol.request_1030_server_list_page import ServerListPageRequest
+from common.protocol.request_1032_batch_session_key import BatchSessionKeyAndTicketRequest
+from common.protocol.request_1033_multi_server_session_key import MultiServerSessionKeyAndTicketRequest
+from common.request_dispatcher import RequestDispatcher, DispatchedRequest
+
+ADDRESS = ('127.0.0.1', 5000)
+
+
+def dispatch(dispatcher, code, payload):
+    return dispatcher.dispatch(DispatchedRequest(ClientRequest(b'c' * 16, 24, code, payload).pack(), ADDRESS))
+
+
+class RequestDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = RequestDispatcher(lambda request, reason: reason)
+        self.dispatcher.route(1027, lambda request: (request.client_id, request.payload.nonce),
+                              SessionKeyAndTicketRequest)
+        self.dispatcher.route(1029, lambda request: request.payload, bytes)
+
+    def test_requests_reach_the_handler_of_their_code(self):
+        self.assertEqual((b'c' * 16, b'n' * 8), dispatch(self.dispatcher, 1027,
+                                                         SessionKeyAndTicketRequest(b's' * 16, b'n' * 8)))
+        self.assertEqual(b'message', dispatch(self.dispatcher, 1029, b'message'))
+
+    def test_unknown_and_malformed_requests_reach_the_error_handler(self):
+        self.assertEqual('unknown_request', dispatch(self.dispatcher, 1099, b''))
+        self.assertEqual('malformed_request', dispatch(self.dispatcher, 1027, b'too short'))
+
+    def test_header_only_requests_of_typed_routes_are_malformed(self):
+        payload_types = {1024: UserRegistrationRequest, 1025: ServerRegistrationRequest,
+                         1027: SessionKeyAndTicketRequest, 1028: SendSessionKeyRequest, 1029: SendMessageRequest,
+                         1030: ServerListPageRequest, 1032: BatchSessionKeyAndTicketRequest,
+                         1033: MultiServerSessionKeyAndTicketRequest}
+        dispatcher = RequestDispatcher(lambda request, reason: reason)
+        for code, payload_type in payload_types.items():
+            dispatcher.route(code, lambda request: 'handled', payload_type)
+        dispatcher.route(1031, lambda request: request.payload, ServerListPageRequest, payload_optional=True)
+
+        for code in payload_types:
+            self.assertEqual('malformed_request', dispatch(dispatcher, code, None), code)
+            self.assertEqual('malformed_request', dispatch(dispatcher, code, b'\x01'), code)
+        self.assertIsNone(dispatch(dispatcher, 1031, None))
+
+    def test_middleware_wraps_the_handlers_of_its_codes(self):
+        calls = []
+
+        def record(name):
+            def middleware(request, call_next):
+                calls.append((name, request.code))
+                return call_next(request)
+            return middleware
+
+        self.dispatcher.add_middleware(record('all'))
+        self.dispatcher.add_middleware(record('1029 only'), [1029])
+        self.dispatcher.add_middleware(lambda request, call_next: 'rejected', [1027])
+
+        self.assertEqual('rejected', dispatch(self.dispatcher, 1027, b'not unpacked'))
+        self.assertEqual(b'message', dispatch(self.dispatcher, 1029, b'message'))
+        self.assertEqual('unknown_request', dispatch(self.dispatcher, 1099, b''))
+        self.assertEqual([('all', 1027), ('all', 1029), ('1029 only', 1029), ('all', 1099)], calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from message_server.session_store import Session, SessionStore
+
+
+def new_session(seconds_to_expiration):
+    return Session(bytes(32), bytes(16), datetime.now() + timedelta(seconds=seconds_to_expiration))
+
+
+class SessionStoreTest(unittest.TestCase):
+    def test_expired_session_is_not_returned(self):
+        store = SessionStore(10)
+        store.put('client', new_session(-1))
+
+        self.assertIsNone(store.get('client'))
+        self.assertEqual({'live': 0, 'expired': 1, 'evicted': 0}, store.stats())
+
+    def test_reap_expired_in_expiration_order(self):
+        store = SessionStore(10)
+        store.put('expired 1', new_session(-2))
+        store.put('valid', new_session(300))
+        store.put('expired 2', new_session(-1))
+
+        self.assertEqual(2, store.reap_expired())
+        self.assertEqual(['valid'], list(store.sessions))
+        self.assertEqual(0, store.reap_expired(time.time()))
+
+    def test_replaced_session_is_not_reaped(self):
+        store = SessionStore(10)
+        store.put('client', new_session(-1))
+        valid_session = new_session(300)
+        store.put('client', valid_session)
+
+        self.assertEqual(0, store.reap_expired())
+        self.assertIs(valid_session, store.get('client'))
+
+    def test_least_recently_used_session_is_evicted(self):
+        store = SessionStore(2)
+        store.put('client 1', new_session(300))
+        store.put('client 2', new_session(300))
+        store.get('client 1')
+        store.put('client 3', new_session(300))
+
+        self.assertIsNone(store.get('client 2'))
+        self.assertIsNotNone(store.get('client 1'))
+        self.assertEqual({'live': 2, 'expired': 0, 'evicted': 1}, store.stats())
+
+    def test_session_replaced_with_same_expiration(self):
+        store = SessionStore(10)
+        expiration_time = datetime.now() + timedelta(seconds=300)
+        store.put('client', Session(bytes(32), bytes(16), expiration_time))
+        replacement = Session(bytes(32), bytes(16), expiration_time)
+        store.put('client', replacement)
+
+        self.assertIs(replacement, store.get('client'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import multiprocessing
+import unittest
+from datetime import datetime, timedelta
+
+from message_server.session_store import Session
+from message_server.shared_state import SharedSessionStore, SharedReplayCache
+
+
+def new_session(seconds_to_expiration, key=bytes(32)):
+    return Session(key, bytes(16), datetime.now() + timedelta(seconds=seconds_to_expiration))
+
+
+class SharedStateTest(unittest.TestCase):
+    def test_session_put_by_another_process_is_visible(self):
+        store = SharedSessionStore(100)
+        client_id = bytes(range(16)).hex()
+        worker = multiprocessing.get_context('fork').Process(
+            target=store.put, args=(client_id, new_session(300, bytes([7]) * 32)))
+        worker.start()
+        worker.join()
+
+        self.assertEqual(bytes([7]) * 32, store.get(client_id).key)
+        self.assertIsNone(store.get(bytes(16).hex()))
+
+    def test_expired_session_is_not_returned(self):
+        store = SharedSessionStore(100)
+        store.put('01' * 16, new_session(-1))
+
+        self.assertIsNone(store.get('01' * 16))
+        self.assertEqual({'live': 0, 'expired': 1, 'evicted': 0}, store.stats())
+
+    def test_full_set_evicts_session_closest_to_expiring(self):
+        store = SharedSessionStore(16)
+        # client ids with the same first 8 bytes share a set
+        client_ids = [(bytes(8) + index.to_bytes(8, 'little')).hex() for index in range(17)]
+        for index, client_id in enumerate(client_ids):
+            store.put(client_id, new_session(100 + index))
+
+        self.assertIsNone(store.get(client_ids[0]))
+        self.assertIsNotNone(store.get(client_ids[16]))
+        self.assertEqual(1, store.stats()['evicted'])
+
+    def test_replay_cache_is_shared(self):
+        cache = SharedReplayCache(600, 1024)
+        now = 1000000.0
+        worker = multiprocessing.get_context('fork').Process(target=cache.add, args=(b'authenticator', now, now))
+        worker.start()
+        worker.join()
+
+        self.assertFalse(cache.add(b'authenticator', now, now))
+        self.assertTrue(cache.add(b'other authenticator', now, now))
+        self.assertFalse(cache.add(b'old authenticator', now - 600, now))
+
+    def test_full_set_evicts_authenticator_closest_to_leaving_the_window(self):
+        # a single set of 16 slots
+        cache = SharedReplayCache(600, 16)
+        now = 1000000.0
+        for number in range(16):
+            self.assertTrue(cache.add(b'authenticator %d' % number, now - 100 + number, now))
+
+        self.assertTrue(cache.add(b'fresh authenticator', now, now))
+        self.assertEqual(1, cache.evicted_count.value)
+        # the oldest one was evicted, the others are still remembered
+        self.assertFalse(cache.add(b'authenticator 1', now - 99, now))
+        self.assertFalse(cache.add(b'fresh authenticator', now, now))
+
+
+if __name__ == '__main__':
+    unittest.main()
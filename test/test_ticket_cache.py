@@ -0,0 +1,69 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from client.ticket_cache import TicketCache
+from common.cryptography_utils import sha256_hash
+from common.date_utils import datetime_to_timestamp_bytes
+from common.protocol.ticket import Ticket
+
+SERVER = (b's' * 16, 'printer', '127.0.0.1', 1256)
+
+
+def new_ticket():
+    return Ticket(24, b'c' * 16, SERVER[0], datetime_to_timestamp_bytes(datetime.now()), bytes(16), bytes(48),
+                  bytes(16)).pack()
+
+
+class TicketCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'tickets')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_ticket_expires_after_its_lifetime(self):
+        cache = TicketCache(ticket_lifetime_seconds=300)
+        packed_ticket = new_ticket()
+        cache.put(SERVER, b'k' * 32, packed_ticket)
+
+        self.assertEqual(packed_ticket, cache.get(SERVER[0]).packed_ticket)
+        self.assertIsNone(cache.get(SERVER[0], min_remaining_seconds=400))
+        self.assertIsNone(cache.get(SERVER[0], now=time.time() + 301))
+        self.assertEqual(0, len(cache))
+
+    def test_tickets_are_loaded_by_the_same_client(self):
+        cache = TicketCache(self.file_path)
+        cache.load(b'c' * 16, sha256_hash(b'password'))
+        packed_ticket = new_ticket()
+        cache.put(SERVER, b'k' * 32, packed_ticket).authenticated = True
+
+        loaded_cache = TicketCache(self.file_path)
+        loaded_cache.load(b'c' * 16, sha256_hash(b'password'))
+        ticket = loaded_cache.get(SERVER[0])
+        self.assertEqual((SERVER, b'k' * 32, packed_ticket), (ticket.server, ticket.session_key, ticket.packed_ticket))
+        self.assertFalse(ticket.authenticated)
+
+        other_cache = TicketCache(self.file_path)
+        other_cache.load(b'c' * 16, sha256_hash(b'another password'))
+        self.assertEqual(0, len(other_cache))
+
+    def test_tickets_put_together_are_saved_once(self):
+        cache = TicketCache(self.file_path)
+        cache.load(b'c' * 16, sha256_hash(b'password'))
+        servers = [(bytes([number]) * 16, f'printer {number}', '127.0.0.1', 1256 + number) for number in range(10)]
+        with mock.patch.object(cache, 'save', wraps=cache.save) as save:
+            cache.put_many([(server, b'k' * 32, new_ticket()) for server in servers])
+        self.assertEqual(1, save.call_count)
+
+        loaded_cache = TicketCache(self.file_path)
+        loaded_cache.load(b'c' * 16, sha256_hash(b'password'))
+        self.assertEqual(servers, [loaded_cache.get(server[0]).server for server in servers])
+
+
+if __name__ == '__main__':
+    unittest.main()